@@ -140,6 +140,7 @@ CFG_SITE_NAME_INTL['sv'] = "Atlantis Institut för Fiktiv Vetenskap"
 CFG_SITE_NAME_INTL['uk'] = "Інститут вигаданих наук в Атлантісі"
 CFG_SITE_NAME_INTL['zh_CN'] = "阿特兰提斯虚拟科学学院"
 CFG_SITE_NAME_INTL['zh_TW'] = "阿特蘭提斯虛擬科學學院"
+CFG_ACCESS_CONTROL_AUTHORIZATIONS_CHECK_INTERVAL = 5
 CFG_ACCESS_CONTROL_LEVEL_ACCOUNTS = 0
 CFG_ACCESS_CONTROL_LEVEL_GUESTS = 0
 CFG_ACCESS_CONTROL_LEVEL_SITE = 0
@@ -410,6 +411,8 @@ CFG_BIBRANK_SHOW_DOWNLOAD_GRAPHS = 1
 CFG_BIBRANK_SHOW_DOWNLOAD_GRAPHS_CLIENT_IP_DISTRIBUTION = 0
 CFG_BIBRANK_SHOW_DOWNLOAD_STATS = 1
 CFG_BIBRANK_SHOW_READING_STATS = 1
+CFG_BIBSCHED_BIBUPLOAD_LANES = 1
+CFG_BIBSCHED_BIBUPLOAD_LANES_MAX_FILE_SIZE = 10485760
 CFG_BIBSCHED_EDITOR = which("vim")
 CFG_BIBSCHED_GC_TASKS_OLDER_THAN = 30
 CFG_BIBSCHED_GC_TASKS_TO_ARCHIVE = ['bibupload', 'oairepositoryupdater', ]
@@ -418,9 +421,11 @@ CFG_BIBSCHED_GC_TASKS_TO_REMOVE = [
 CFG_BIBSCHED_LOG_PAGER = which("less")
 CFG_BIBSCHED_LOGDIR = join(CFG_PREFIX, "var", "log", "bibsched")
 CFG_BIBSCHED_MAX_ARCHIVED_ROWS_DISPLAY = 500
+CFG_BIBSCHED_MAX_IDLE_TIME = 60
 CFG_BIBSCHED_MAX_NUMBER_CONCURRENT_TASKS = 1
 CFG_BIBSCHED_NODE_TASKS = {}
 CFG_BIBSCHED_PROCESS_USER = ""
+CFG_BIBSCHED_QUEUE_CHECK_INTERVAL = 0.5
 CFG_BIBSCHED_REFRESHTIME = 5
 CFG_BIBSCHED_TASKLET_PACKAGES = [
     'invenio.legacy.bibsched.tasklets',
@@ -455,6 +460,8 @@ CFG_ORGANIZATION_IDENTIFIER = ""
 CFG_CROSSREF_EMAIL = ""
 CFG_CROSSREF_PASSWORD = ""
 CFG_CROSSREF_USERNAME = ""
+CFG_DATACACHER_CHECK_INTERVAL = 1
+CFG_DATACACHER_SNAPSHOT_STORE = ""
 CFG_DEVEL_SITE = 0
 CFG_DEVEL_TEST_DATABASE_ENGINES = {}
 CFG_DEVEL_TOOLS = []
@@ -530,6 +537,7 @@ CFG_OAI_PROVENANCE_DATESTAMP_SUBFIELD = "d"
 CFG_OAI_PROVENANCE_HARVESTDATE_SUBFIELD = "h"
 CFG_OAI_PROVENANCE_METADATANAMESPACE_SUBFIELD = "m"
 CFG_OAI_PROVENANCE_ORIGINDESCRIPTION_SUBFIELD = "d"
+CFG_OAI_RESUMPTION_TOKEN_STORE = "file"
 CFG_OAI_RIGHTS_CONTACT_SUBFIELD = "e"
 CFG_OAI_RIGHTS_DATE_SUBFIELD = "g"
 CFG_OAI_RIGHTS_FIELD = "542__"
@@ -685,7 +693,9 @@ CFG_WEBSEARCH_ENABLE_GOOGLESCHOLAR = True
 CFG_WEBSEARCH_ENABLE_OPENGRAPH = False
 CFG_WEBSEARCH_EXTERNAL_COLLECTION_SEARCH_MAXRESULTS = 10
 CFG_WEBSEARCH_EXTERNAL_COLLECTION_SEARCH_TIMEOUT = 5
+CFG_WEBSEARCH_FACET_POSTINGS_CHECK_INTERVAL = 300
 CFG_WEBSEARCH_FIELDS_CONVERT = {}
+CFG_WEBSEARCH_FIELD_VALUES_BATCH_SIZE = 1000
 CFG_WEBSEARCH_FULLTEXT_SNIPPETS = {
     '': 4,
 }
@@ -693,6 +703,8 @@ CFG_WEBSEARCH_FULLTEXT_SNIPPETS_CHARS = {
     '': 100,
 }
 CFG_WEBSEARCH_FULLTEXT_SNIPPETS_GENERATOR = "native"
+CFG_WEBSEARCH_HITLIST_CACHE_CHECK_INTERVAL = 10
+CFG_WEBSEARCH_HITLIST_CACHE_SIZE = 33554432
 CFG_WEBSEARCH_I18N_LATEST_ADDITIONS = 0
 CFG_WEBSEARCH_INSTANT_BROWSE = 10
 CFG_WEBSEARCH_INSTANT_BROWSE_RSS = 25
@@ -195,58 +195,39 @@ class UserInfo(CombinedMultiDict, UserMixin):
         user_info = info
         user_info.update(self.req)
 
-        from invenio.legacy.webuser import isUserSubmitter, isUserReferee, \
-            isUserAdmin, isUserSuperAdmin
-        from invenio.modules.access.engine import acc_authorize_action
-        from invenio.modules.access.control import acc_get_role_id, \
-            acc_is_user_in_role
-        from invenio.legacy.search_engine import \
-            get_permitted_restricted_collections
+        from invenio.legacy.webuser import isUserSubmitter
+        from invenio.modules.access.control import \
+            acc_get_user_roles_from_user_info, acc_get_roles_signature
+        from invenio.utils.hash import md5
+
+        timeout = current_app.config.get(
+            'CFG_WEBSESSION_EXPIRY_LIMIT_DEFAULT', 0)*3600
+
+        # permissions depending on the roles only are shared by the users
+        # having the same roles
+        user_roles = acc_get_user_roles_from_user_info(user_info)
+        roles_key = 'precached_roles::' + md5(
+            acc_get_roles_signature(user_roles)).hexdigest()
+        data = cache.get(roles_key)
+        if data is None:
+            data = self._precache_roles(user_info, user_roles)
+            cache.set(roles_key, data, timeout=timeout)
+        data = dict(data)
 
-        data = {}
-        data['precached_permitted_restricted_collections'] = \
-            get_permitted_restricted_collections(user_info)
-        data['precached_usebaskets'] = acc_authorize_action(
-            user_info, 'usebaskets')[0] == 0
-        data['precached_useloans'] = acc_authorize_action(
-            user_info, 'useloans')[0] == 0
-        data['precached_usegroups'] = acc_authorize_action(
-            user_info, 'usegroups')[0] == 0
-        data['precached_usealerts'] = acc_authorize_action(
-            user_info, 'usealerts')[0] == 0
-        data['precached_usemessages'] = acc_authorize_action(
-            user_info, 'usemessages')[0] == 0
-        data['precached_usestats'] = acc_authorize_action(
-            user_info, 'runwebstatadmin')[0] == 0
         try:
             data['precached_viewsubmissions'] = isUserSubmitter(user_info)
         except:
             data['precached_viewsubmissions'] = None
-        data['precached_useapprove'] = isUserReferee(user_info)
-        data['precached_useadmin'] = isUserAdmin(user_info)
-        data['precached_usesuperadmin'] = isUserSuperAdmin(user_info)
-        data['precached_canseehiddenmarctags'] = acc_authorize_action(
-            user_info, 'runbibedit')[0] == 0
-        usepaperclaim = False
-        usepaperattribution = False
-        viewclaimlink = False
-
-        if (CFG_BIBAUTHORID_ENABLED and acc_is_user_in_role(
-                user_info, acc_get_role_id("paperclaimviewers"))):
-            usepaperclaim = True
-
-        if (CFG_BIBAUTHORID_ENABLED and acc_is_user_in_role(
-                user_info, acc_get_role_id("paperattributionviewers"))):
-            usepaperattribution = True
 
+        viewclaimlink = False
         viewlink = False
         try:
             viewlink = session['personinfo']['claim_in_process']
         except (KeyError, TypeError):
             pass
 
-        if (current_app.config.get('CFG_BIBAUTHORID_ENABLED')
-                and usepaperattribution and viewlink):
+        if (CFG_BIBAUTHORID_ENABLED
+                and data['precached_usepaperattribution'] and viewlink):
             viewclaimlink = True
 
 #       if (CFG_BIBAUTHORID_ENABLED
@@ -256,15 +237,66 @@ class UserInfo(CombinedMultiDict, UserMixin):
 #           viewclaimlink = True
 
         data['precached_viewclaimlink'] = viewclaimlink
-        data['precached_usepaperclaim'] = usepaperclaim
-        data['precached_usepaperattribution'] = usepaperattribution
 
-        timeout = current_app.config.get(
-            'CFG_WEBSESSION_EXPIRY_LIMIT_DEFAULT', 0)*3600
         cache.set(acc_key, data,
                   timeout=timeout)
         return data
 
+    def _precache_roles(self, user_info, user_roles):
+        """Calculate permissions depending on the roles of the user only.
+
+        All the authorizations are computed from USER_ROLES, without
+        querying the roles of the user again for every action.
+        """
+        from invenio.modules.access.engine import acc_authorize_actions
+        from invenio.modules.access.control import acc_get_role_id, \
+            acc_find_possible_roles
+        from invenio.modules.access.local_config import SUPERADMINROLE, \
+            CFG_ACC_ACTIVITIES_URLS
+        from invenio.legacy.search_engine import \
+            get_permitted_restricted_collections
+
+        CFG_BIBAUTHORID_ENABLED = current_app.config.get(
+            'CFG_BIBAUTHORID_ENABLED', False)
+
+        def is_user_in_action_roles(name_action):
+            """Is the user in a role authorized to some NAME_ACTION?"""
+            return bool(acc_find_possible_roles(
+                name_action, always_add_superadmin=False) & user_roles)
+
+        data = {}
+        data['precached_permitted_restricted_collections'] = \
+            get_permitted_restricted_collections(user_info,
+                                                 user_roles=user_roles)
+        actions = (('precached_usebaskets', 'usebaskets'),
+                   ('precached_useloans', 'useloans'),
+                   ('precached_usegroups', 'usegroups'),
+                   ('precached_usealerts', 'usealerts'),
+                   ('precached_usemessages', 'usemessages'),
+                   ('precached_usestats', 'runwebstatadmin'),
+                   ('precached_canseehiddenmarctags', 'runbibedit'))
+        auths = acc_authorize_actions(
+            user_info, [(name_action, {}) for dummy, name_action in actions],
+            user_roles=user_roles)
+        for (key, dummy), auth in zip(actions, auths):
+            data[key] = auth[0] == 0
+
+        data['precached_usesuperadmin'] = \
+            acc_get_role_id(SUPERADMINROLE) in user_roles
+        data['precached_useapprove'] = \
+            current_app.config.get('CFG_CERN_SITE', False) or \
+            is_user_in_action_roles('referee')
+        data['precached_useadmin'] = data['precached_usesuperadmin'] or \
+            any(is_user_in_action_roles(name_action)
+                for name_action in CFG_ACC_ACTIVITIES_URLS)
+        data['precached_usepaperclaim'] = bool(
+            CFG_BIBAUTHORID_ENABLED and
+            acc_get_role_id("paperclaimviewers") in user_roles)
+        data['precached_usepaperattribution'] = bool(
+            CFG_BIBAUTHORID_ENABLED and
+            acc_get_role_id("paperattributionviewers") in user_roles)
+        return data
+
     def is_authenticated(self):
         return not self.is_guest
 
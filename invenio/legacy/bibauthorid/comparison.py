@@ -18,12 +18,14 @@
 ## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
 
 import re
+import time
+import numpy
 from invenio.legacy.bibauthorid import config as bconfig
 from itertools import starmap
 
 from operator import mul, itemgetter
 from invenio.legacy.bibauthorid.name_utils import compare_names
-from invenio.legacy.bibauthorid.dbinterface import get_name_by_bibrecref
+from invenio.legacy.bibauthorid.dbinterface import get_name_by_bibref
 from invenio.legacy.bibauthorid.dbinterface import get_grouped_records
 from invenio.legacy.bibauthorid.dbinterface import get_authors_of_paper
 from invenio.legacy.bibauthorid.dbinterface import get_collaborations_for_paper
@@ -311,7 +313,10 @@ def _compare_papers(bib1, bib2):
     return '?'
 
 
-cached_get_name_by_bibrecref = cached_arg(use_ref)(get_name_by_bibref)
+@cached_arg(use_ref)
+def cached_get_name_by_bibrecref(bib):
+    return get_name_by_bibref(bib)
+
 cached_compare_names  = cached_sym(use_string)(compare_names)
 
 @cached_sym(use_ref)
@@ -449,3 +454,276 @@ elif bconfig.CFG_ADS_SITE:
 
 else:
     cbrr_func_weight = ((_compare_names, 5.,'names'),)
+
+
+# Vectorized comparison
+# compare_signatures gives the results of compare_bibrefrecs for whole
+# blocks of signatures at once: the metadata of every signature is
+# extracted once by the finders above and the comparison functions of
+# cbrr_func_weight are replaced by numpy operations on these features.
+# A missing comparison ('?') is represented by nan.
+
+class _NameFeature(object):
+    '''
+    Names of the signatures, see _compare_names.
+    '''
+    def __init__(self, bibs):
+        names = [cached_get_name_by_bibrecref(bib) for bib in bibs]
+        self.names = sorted(set(name for name in names if name))
+        index = dict((name, i) for i, name in enumerate(self.names))
+        self.codes = numpy.array([index.get(name, -1) if name else -1
+                                  for name in names], dtype=int)
+
+    def compare(self, rows, cols):
+        codes1, codes2 = self.codes[rows], self.codes[cols]
+        names1 = numpy.unique(codes1[codes1 >= 0])
+        names2 = numpy.unique(codes2[codes2 >= 0])
+        # compare_names is only called once per pair of distinct names
+        scores = numpy.empty((len(names1) + 1, len(names2) + 1))
+        scores[-1, :] = numpy.nan
+        scores[:, -1] = numpy.nan
+        for i, code1 in enumerate(names1):
+            for j, code2 in enumerate(names2):
+                scores[i, j] = cached_compare_names(self.names[code1],
+                                                    self.names[code2])
+        idx1 = numpy.where(codes1 >= 0, numpy.searchsorted(names1, codes1), -1)
+        idx2 = numpy.where(codes2 >= 0, numpy.searchsorted(names2, codes2), -1)
+        return scores[idx1[:, numpy.newaxis], idx2[numpy.newaxis, :]]
+
+
+class _SetFeature(object):
+    '''
+    Sets of values of the signatures, compared like by jaccard.
+    '''
+    def __init__(self, bibs, finder):
+        vocabulary = dict()
+        self.tokens = []
+        for bib in bibs:
+            tokens = set(vocabulary.setdefault(value, len(vocabulary))
+                         for value in finder(bib))
+            self.tokens.append(numpy.array(sorted(tokens), dtype=int))
+        self.sizes = numpy.array([len(t) for t in self.tokens], dtype=int)
+        # signatures having each token
+        postings = [[] for dummy in xrange(len(vocabulary))]
+        for i, tokens in enumerate(self.tokens):
+            for token in tokens:
+                postings[token].append(i)
+        self.postings = [numpy.array(p, dtype=int) for p in postings]
+
+    def compare(self, rows, cols):
+        ret = numpy.empty((len(rows), len(cols)))
+        sizes1, sizes2 = self.sizes[rows], self.sizes[cols]
+        for i, row in enumerate(rows):
+            tokens = self.tokens[row]
+            if not len(tokens):
+                ret[i] = numpy.nan
+                continue
+            match = numpy.bincount(
+                numpy.concatenate([self.postings[t] for t in tokens]),
+                minlength=len(self.sizes))[cols]
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                ret[i] = match / (sizes1[i] + sizes2 - match).astype(float)
+        ret[:, sizes2 == 0] = numpy.nan
+        return ret
+
+
+class _SingleValueFeature(object):
+    '''
+    Values of the signatures which are comparable only if the signatures
+    have exactly one of them, e.g. _compare_email.
+    '''
+    def __init__(self, bibs, finder, same, different):
+        vocabulary = dict()
+        self.codes = numpy.empty(len(bibs), dtype=int)
+        for i, bib in enumerate(bibs):
+            values = finder(bib)
+            if len(values) == 1:
+                value = iter(values).next()
+                self.codes[i] = vocabulary.setdefault(value, len(vocabulary))
+            else:
+                self.codes[i] = -1
+        self.same = same
+        self.different = different
+
+    def compare(self, rows, cols):
+        codes1 = self.codes[rows][:, numpy.newaxis]
+        codes2 = self.codes[cols][numpy.newaxis, :]
+        ret = numpy.where(codes1 == codes2, float(self.same),
+                          float(self.different))
+        ret[(codes1 < 0) | (codes2 < 0)] = numpy.nan
+        return ret
+
+
+class _PairwiseFeature(object):
+    '''
+    Slow path for comparison functions without vectorized version.
+    '''
+    def __init__(self, bibs, func):
+        self.bibs = bibs
+        self.func = func
+
+    def compare(self, rows, cols):
+        ret = numpy.empty((len(rows), len(cols)))
+        for i, row in enumerate(rows):
+            for j, col in enumerate(cols):
+                val = self.func(self.bibs[row], self.bibs[col])
+                ret[i, j] = numpy.nan if val == '?' else val
+        return ret
+
+
+cbrr_func_feature = {
+    _compare_inspireid: lambda bibs: _SingleValueFeature(bibs, _find_inspireid, 1, 0),
+    _compare_affiliations: lambda bibs: _SetFeature(bibs, _find_affiliation),
+    # _compare_unified_affiliations compares the raw affiliations too
+    _compare_unified_affiliations: lambda bibs: _SetFeature(bibs, _find_affiliation),
+    _compare_email: lambda bibs: _SingleValueFeature(bibs, _find_email, 1., .3),
+    _compare_names: _NameFeature,
+    _compare_key_words: lambda bibs: _SetFeature(bibs, _find_key_words),
+    _compare_collaboration: lambda bibs: _SingleValueFeature(bibs, _find_collaboration, 1., 0.),
+    _compare_coauthors: lambda bibs: _SetFeature(bibs, _find_coauthors),
+    _compare_citations: lambda bibs: _SetFeature(bibs, _find_citations),
+    _compare_citations_by: lambda bibs: _SetFeature(bibs, _find_citations_by),
+    }
+
+
+class SignatureFeatures(object):
+    '''
+    Metadata of a list of signatures used by compare_signatures.
+    The features are extracted at creation, hence this object may be
+    shared with forked processes which do not access the database.
+    '''
+    def __init__(self, bibs):
+        self.bibs = list(bibs)
+        self.recs = numpy.array([use_rec(bib) for bib in self.bibs], dtype=int)
+        self.features = []
+        for func, weight, dummy in cbrr_func_weight:
+            feature = cbrr_func_feature.get(func)
+            if feature is None:
+                feature = lambda bibs, func=func: _PairwiseFeature(bibs, func)
+            self.features.append((feature(self.bibs), weight))
+
+    def __len__(self):
+        return len(self.bibs)
+
+
+def compare_signatures(features, rows, cols):
+    '''
+    Compares the signatures ROWS with the signatures COLS, given as
+    arrays of indices in FEATURES (a SignatureFeatures object), like
+    compare_bibrefrecs does for every pair of them.
+    Returns three arrays of shape (len(rows), len(cols)): the same_paper
+    booleans, for which compare_bibrefrecs returns '-', and the
+    probabilities and compatibilities it returns for the other pairs.
+    '''
+    rows = numpy.asarray(rows, dtype=int)
+    cols = numpy.asarray(cols, dtype=int)
+    same_paper = (features.recs[rows][:, numpy.newaxis] ==
+                  features.recs[cols][numpy.newaxis, :])
+
+    # summed in the same order as compare_bibrefrecs to get the same values
+    total_weights = sum(weight for dummy, weight in features.features)
+    cert = numpy.zeros(same_paper.shape)
+    prob = numpy.zeros(same_paper.shape)
+    for feature, weight in features.features:
+        val = feature.compare(rows, cols)
+        known = ~numpy.isnan(val)
+        cert += numpy.where(known, val * weight, 0.)
+        prob += numpy.where(known, weight, 0.)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        probabilities = numpy.where(prob > 0, cert / prob, 0.)
+    return same_paper, probabilities, prob / total_weights
+
+
+_benchmark_first_names = ('John', 'J.', 'J.R.', 'John R.', 'Jonathan',
+                          'Richard', 'R.', 'R.K.', 'Robert', 'Keith', 'K.')
+
+def _create_surname_block(nb_signatures, seed=0):
+    '''
+    Creates a synthetic surname block of NB_SIGNATURES signatures and
+    returns them together with the database getters of their metadata.
+    '''
+    rnd = random.Random(seed)
+    # a few signatures of a same paper, which are compared with '-'
+    recs = [rnd.randint(1, int(nb_signatures * 0.95) + 1)
+            for dummy in xrange(nb_signatures)]
+    bibs = [(100 + i % 2 * 600, i, rec) for i, rec in enumerate(recs)]
+    sample = lambda values, n: rnd.sample(values, rnd.randint(0, n))
+    institutes = ['Institute %d' % i for i in range(30)]
+    words = ['keyword %d' % i for i in range(200)]
+    authors = ['Author, %d.' % i for i in range(500)]
+    collaborations = ['ATLAS', 'CMS', 'LHCb']
+    grouped = dict()
+    papers = dict()
+    names = dict()
+    for bib in bibs:
+        names[bib[0:2]] = 'Ellis, %s' % rnd.choice(_benchmark_first_names)
+        grouped[bib] = {'__u': sample(institutes, 2),
+                        '__i': sample(['INSPIRE-%d' % i for i in range(20)], 1),
+                        '__m': sample(['ellis%d@cern.ch' % i for i in range(20)], 1)}
+    for rec in set(recs):
+        papers[rec] = {'keywords': sample(words, 6),
+                       'authors': sample(authors, 20),
+                       'collaborations': sample(collaborations, 1),
+                       'cited_by': set(sample(range(1000), 20)),
+                       'refers_to': set(sample(range(1000), 20))}
+    getters = {
+        'get_name_by_bibref': lambda bib: names[bib[0:2]],
+        'get_grouped_records': lambda bib, tag: {tag: grouped[bib][tag[3:]]},
+        'get_keywords_for_paper': lambda rec: papers[rec]['keywords'],
+        'get_authors_of_paper': lambda rec: papers[rec]['authors'],
+        'get_collaborations_for_paper': lambda rec: papers[rec]['collaborations'],
+        'get_cited_by': lambda rec: papers[rec]['cited_by'],
+        'get_refers_to': lambda rec: papers[rec]['refers_to'],
+        'get_resolved_affiliation': lambda aff: aff,
+        }
+    return bibs, getters
+
+
+def compare_signatures_benchmark(nb_signatures=1000):
+    '''
+    Compares every pair of signatures of a synthetic surname block with
+    compare_bibrefrecs and with compare_signatures.
+    Example:
+
+        >>> compare_signatures_benchmark(1000)
+
+    @return: dictionary with the time spent by each function, in seconds,
+        the number of pairs whose '-' differ and the largest difference
+        of the other results
+    '''
+    bibs, getters = _create_surname_block(nb_signatures)
+    module = globals()
+    saved_getters = dict((name, module[name]) for name in getters)
+    module.update(getters)
+    clear_all_caches()
+    try:
+        t1 = time.time()
+        expected = [[compare_bibrefrecs(bib1, bib2) for bib2 in bibs[i + 1:]]
+                    for i, bib1 in enumerate(bibs)]
+        scalar_time = time.time() - t1
+        clear_all_caches()
+
+        t1 = time.time()
+        features = SignatureFeatures(bibs)
+        results = [compare_signatures(features, [i], range(i + 1, len(bibs)))
+                   for i in xrange(len(bibs) - 1)]
+        vectorized_time = time.time() - t1
+    finally:
+        module.update(saved_getters)
+        clear_all_caches()
+
+    stats = {'compare_bibrefrecs': scalar_time,
+             'compare_signatures': vectorized_time,
+             'different signs': 0,
+             'largest difference': 0.}
+    for row, (same_paper, probabilities, compatibilities) in zip(expected, results):
+        for j, val in enumerate(row):
+            if (val == '-') != same_paper[0, j]:
+                stats['different signs'] += 1
+            elif val != '-':
+                stats['largest difference'] = max(
+                    stats['largest difference'],
+                    abs(val[0] - probabilities[0, j]),
+                    abs(val[1] - compatibilities[0, j]))
+    return stats
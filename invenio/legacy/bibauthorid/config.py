@@ -121,6 +121,14 @@ if GLOBAL_CONFIG and CFG_BIBAUTHORID_MAX_PROCESSES:
 else:
     BIBAUTHORID_MAX_PROCESSES = 12
 
+# Number of processes comparing the signatures of one last name cluster
+# when building its probability matrix. Keep in mind that tortoise may
+# already build BIBAUTHORID_MAX_PROCESSES matrices in parallel.
+PROB_MATRIX_MAX_PROCESSES = 1
+
+# Number of pairs of signatures compared at once by these processes
+PROB_MATRIX_BLOCK_SIZE = 1000000
+
 WEDGE_THRESHOLD = 0.70
 
 
@@ -36,6 +36,7 @@ from invenio.utils.text import translate_to_ascii
 from jellyfish import levenshtein_distance as distance
 
 artifact_removal = re.compile("[^a-zA-Z0-9]")
+SQRT2 = sqrt(2)
 
 CFG_AUTHORIDS_NAME_AUTHORITY_DIR = pkg_resources.resource_filename(
             'invenio.modules.authorids', 'name_authority_files')
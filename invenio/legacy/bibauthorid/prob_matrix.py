@@ -19,8 +19,12 @@
 
 
 import gc
+import numpy
+from multiprocessing import Pool
 import invenio.legacy.bibauthorid.config as bconfig
 from invenio.legacy.bibauthorid.comparison import compare_bibrefrecs
+from invenio.legacy.bibauthorid.comparison import SignatureFeatures
+from invenio.legacy.bibauthorid.comparison import compare_signatures
 from invenio.legacy.bibauthorid.comparison import clear_all_caches as clear_comparison_caches
 from invenio.legacy.bibauthorid.backinterface import get_modified_papers_before
 from invenio.legacy.bibauthorid.general_utils import bibauthor_print \
@@ -105,9 +109,11 @@ class ProbabilityMatrix(object):
         if expected == 0:
             expected = 1
 
+        val = None
         try:
             cur_calc, opti, prints_counter = 0, 0, 0
-            for cl1 in cluster_set.clusters:
+            for bibs1, bibs2, same_paper, probabilities, compatibilities \
+                    in compare_cluster_set(cluster_set):
 
                 if cur_calc+opti - prints_counter > 100000 or cur_calc == 0:
                     update_status((float(opti) + cur_calc) / expected, "Prob matrix: calc %d, opti %d." % (cur_calc, opti))
@@ -119,26 +125,26 @@ class ProbabilityMatrix(object):
     #                clear_comparison_caches()
                     last_cleaned = cur_calc
 
-                for cl2 in cluster_set.clusters:
-                    if id(cl1) < id(cl2) and not cl1.hates(cl2):
-                        for bib1 in cl1.bibs:
-                            for bib2 in cl2.bibs:
-                                if have_cached_bibs:
-                                    try:
-                                        val = old_matrix[bib1, bib2]
-                                        opti += 1
-                                        if bconfig.DEBUG_CHECKS:
-                                            assert _debug_is_eq_v(val, compare_bibrefrecs(bib1, bib2))
-                                    except KeyError:
-                                        cur_calc += 1
-                                        val = compare_bibrefrecs(bib1, bib2)
-                                    if not val:
-                                        cur_calc += 1
-                                        val = compare_bibrefrecs(bib1, bib2)
-                                else:
-                                    cur_calc += 1
-                                    val = compare_bibrefrecs(bib1, bib2)
-                                self._bib_matrix[bib1, bib2] = val
+                for i, bib1 in enumerate(bibs1):
+                    for j, bib2 in enumerate(bibs2):
+                        val = None
+                        if have_cached_bibs:
+                            try:
+                                val = old_matrix[bib1, bib2]
+                            except KeyError:
+                                pass
+                        if val is None:
+                            cur_calc += 1
+                            if same_paper[i, j]:
+                                val = '-'
+                            else:
+                                val = (float(probabilities[i, j]),
+                                       float(compatibilities[i, j]))
+                        else:
+                            opti += 1
+                        if bconfig.DEBUG_CHECKS:
+                            assert _debug_is_eq_v(val, compare_bibrefrecs(bib1, bib2))
+                        self._bib_matrix[bib1, bib2] = val
 
         except Exception, e:
             raise Exception("""Error happened in prob_matrix.recalculate with
@@ -150,6 +156,95 @@ class ProbabilityMatrix(object):
         update_status_final("Matrix done. %d calc, %d opt." % (cur_calc, opti))
 
 
+# Signatures of the cluster set being compared, shared with the processes
+# of compare_cluster_set when they are forked.
+_cluster_set_signatures = None
+
+def _compare_signature_blocks(blocks):
+    '''
+    Compares the signatures of each block (cluster, start, stop) with
+    the signatures of the next clusters it does not hate.
+    '''
+    features, offsets, cluster_of, hated = _cluster_set_signatures
+    ret = []
+    for cluster, start, stop in blocks:
+        cols = numpy.arange(offsets[cluster + 1], offsets[-1])
+        if len(hated[cluster]):
+            cols = cols[~numpy.in1d(cluster_of[cols], hated[cluster])]
+        if len(cols):
+            ret.append((start, stop, cols) +
+                       compare_signatures(features, numpy.arange(start, stop), cols))
+    return ret
+
+
+def _get_signature_blocks(offsets, block_size):
+    '''
+    Splits the signatures of the clusters delimited by OFFSETS into
+    blocks of about BLOCK_SIZE pairs to compare.
+    '''
+    blocks, block, pairs = [], [], 0
+    for cluster in xrange(len(offsets) - 1):
+        ncols = offsets[-1] - offsets[cluster + 1]
+        if not ncols:
+            continue
+        step = max(1, block_size / ncols)
+        for start in xrange(offsets[cluster], offsets[cluster + 1], step):
+            stop = min(start + step, offsets[cluster + 1])
+            block.append((cluster, start, stop))
+            pairs += (stop - start) * ncols
+            if pairs >= block_size:
+                blocks.append(block)
+                block, pairs = [], 0
+    if block:
+        blocks.append(block)
+    return blocks
+
+
+def compare_cluster_set(cluster_set,
+                        processes=bconfig.PROB_MATRIX_MAX_PROCESSES,
+                        block_size=bconfig.PROB_MATRIX_BLOCK_SIZE):
+    '''
+    Compares the signatures of every pair of clusters of CLUSTER_SET
+    which do not hate each other, like compare_bibrefrecs does.
+    The signatures are split in blocks compared in PROCESSES processes.
+    Yields (bibs1, bibs2, same_paper, probabilities, compatibilities),
+    see compare_signatures.
+    '''
+    global _cluster_set_signatures
+
+    # as before, a pair of clusters is compared once, from the cluster
+    # with the lowest id
+    clusters = sorted(cluster_set.clusters, key=id)
+    position = dict((cl, i) for i, cl in enumerate(clusters))
+    bibs, offsets, cluster_of = [], [0], []
+    for i, cl in enumerate(clusters):
+        bibs.extend(cl.bibs)
+        offsets.append(len(bibs))
+        cluster_of.extend([i] * len(cl.bibs))
+    hated = [numpy.array([position[h] for h in cl.hate if h in position],
+                         dtype=int)
+             for cl in clusters]
+
+    _cluster_set_signatures = (SignatureFeatures(bibs), offsets,
+                               numpy.array(cluster_of, dtype=int), hated)
+    blocks = _get_signature_blocks(offsets, block_size)
+    pool = None
+    try:
+        if processes > 1 and len(blocks) > 1:
+            pool = Pool(processes)
+            results = pool.imap_unordered(_compare_signature_blocks, blocks)
+        else:
+            results = (_compare_signature_blocks(block) for block in blocks)
+        for result in results:
+            for start, stop, cols, same_paper, probabilities, compatibilities in result:
+                yield (bibs[start:stop], [bibs[col] for col in cols],
+                       same_paper, probabilities, compatibilities)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        _cluster_set_signatures = None
+
+
 def prepare_matirx(cluster_set, force):
     if bconfig.DEBUG_CHECKS:
         assert cluster_set._debug_test_hate_relation()
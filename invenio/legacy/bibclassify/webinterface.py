@@ -213,8 +213,12 @@ def generate_keywords(req, recid, argd):
     if os.path.exists(abs_path):
         try:
             # Try to load the data from the tmp file
-            recs = xml_marc_to_records(open_marc_file(abs_path))
-            return record_get_keywords(recs[0])
+            marc_file = open_marc_file(abs_path)
+            try:
+                recs = xml_marc_to_records(marc_file)
+                return record_get_keywords(next(iter(recs)))
+            finally:
+                marc_file.close()
         except:
             pass
 
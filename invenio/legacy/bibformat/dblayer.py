@@ -450,6 +450,32 @@ def get_preformatted_record(recID, of, decompress=zlib.decompress):
     else:
         return None, None
 
+def get_preformatted_records(recIDs, of, decompress=zlib.decompress):
+    """
+    Returns the preformatted records with ids 'recIDs' and format 'of'
+    and whether they need a 2nd pass, fetched in one query.
+
+    @param recIDs: the ids of the records to fetch
+    @param of: the output format code
+    @param decompress: the method used to decompress the preformatted records in database
+    @return: dictionary recID -> (formatted record as String, needs 2nd pass)
+             for the records formatted in 'of'
+    """
+    if not recIDs:
+        return {}
+    # Decide whether to use DB slave:
+    if of in ('xm', 'recstruct'):
+        run_on_slave = False # for master formats, use DB master
+    else:
+        run_on_slave = True # for other formats, we can use DB slave
+    query = """SELECT id_bibrec, value, needs_2nd_pass FROM bibfmt
+               WHERE id_bibrec IN (%s) AND format = %%s""" % \
+            ','.join(['%s'] * len(recIDs))
+    params = tuple(recIDs) + (of, )
+    res = run_sql(query, params, run_on_slave=run_on_slave)
+    return dict((recID, (decompress(value), bool(needs_2nd_pass)))
+                for recID, value, needs_2nd_pass in res)
+
 def get_preformatted_record_date(recID, of):
     """
     Returns the date of the last update of the cache for the considered
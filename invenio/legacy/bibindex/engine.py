@@ -32,7 +32,9 @@ import sys
 import time
 import fnmatch
 import inspect
+from collections import deque
 from datetime import datetime
+from multiprocessing import Pool
 from six import iteritems
 
 from invenio.config import CFG_SOLR_URL
@@ -45,7 +47,8 @@ from invenio.legacy.bibindex.engine_config import CFG_MAX_MYSQL_THREADS, \
      CFG_BIBINDEX_UPDATE_MODE, \
      CFG_BIBINDEX_TOKENIZER_TYPE, \
      CFG_BIBINDEX_WASH_INDEX_TERMS, \
-     CFG_BIBINDEX_SPECIAL_TAGS
+     CFG_BIBINDEX_SPECIAL_TAGS, \
+     CFG_BIBINDEX_BULK_FLUSH_CHUNKSIZE
 from invenio.legacy.bibauthority.config import \
      CFG_BIBAUTHORITY_CONTROLLED_FIELDS_BIBLIOGRAPHIC
 from invenio.legacy.bibauthority.engine import get_index_strings_by_control_no,\
@@ -55,8 +58,10 @@ from invenio.legacy.search_engine import perform_request_search, \
      get_synonym_terms, \
      search_pattern, \
      search_unit_in_bibrec
-from invenio.legacy.dbquery import run_sql, DatabaseError, serialize_via_marshal, \
-     deserialize_via_marshal, wash_table_column_name
+from invenio.legacy.search_engine.hitlist_cache import hitlist_cache
+from invenio.legacy.dbquery import run_sql, run_sql_many, DatabaseError, \
+     serialize_via_marshal, deserialize_via_marshal, wash_table_column_name, \
+     _db_login
 from invenio.legacy.bibindex.engine_washer import wash_index_term
 from invenio.legacy.bibsched.bibtask import task_init, write_message, get_datetime, \
     task_set_option, task_get_option, task_get_task_param, \
@@ -83,6 +88,7 @@ from invenio.legacy.bibindex.engine_utils import load_tokenizers, \
     run_sql_drop_silently, \
     get_min_last_updated, \
     remove_inexistent_indexes, \
+    get_collation_key, \
     get_all_synonym_knowledge_bases, \
     get_index_remove_stopwords, \
     get_index_remove_html_markup, \
@@ -596,6 +602,28 @@ def chunk_generator(rng):
             current_low += chunksize
 
 
+_words_collector = None
+
+
+def _init_words_collector(index_name, table_type, table_prefix, wash_index_terms):
+    """Creates the word table a reindexing worker process tokenizes with.
+
+    The database connections inherited from the parent process are
+    dropped first, so that the worker opens its own ones.
+    """
+    global _words_collector
+    from invenio.ext.sqlalchemy import db
+    db.engine.dispose()
+    _db_login(relogin=1)
+    _words_collector = WordTable(index_name, table_type,
+                                 table_prefix, wash_index_terms)
+
+
+def _collect_words_from_recID_range(recID1, recID2):
+    """Tokenizes records from RECID1 to RECID2 in a worker process."""
+    return _words_collector.get_words_from_recID_range(recID1, recID2)
+
+
 class AbstractIndexTable(object):
     """
         This class represents an index table in database.
@@ -625,6 +653,8 @@ class AbstractIndexTable(object):
                                                 table_type + \
                                                 ("%02d" % self.index_id) + "F")
         self.table_prefix = table_prefix
+        # flush a chunk of terms per query instead of one term at a time:
+        self.bulk_flush = bool(task_get_option("bulk-flush"))
 
         self.value = {} # cache
         self.recIDs_in_mem = []
@@ -654,20 +684,26 @@ class AbstractIndexTable(object):
         nb_words_total = len(self.value)
         nb_words_report = int(nb_words_total / 10.0)
         nb_words_done = 0
-        for word in self.value.keys():
-            self.put_word_into_db(word)
-            nb_words_done += 1
-            if nb_words_report != 0 and ((nb_words_done % nb_words_report) == 0):
-                write_message('......processed %d/%d words' % \
-                              (nb_words_done, nb_words_total))
-                percentage_display = get_percentage_completed(nb_words_done, nb_words_total)
-                task_update_progress("(%s:%s) flushed %d/%d words %s" % \
-                                     (tab_name, self.index_name,
-                                      nb_words_done, nb_words_total,
-                                      percentage_display))
+        if self.bulk_flush:
+            words = self.value.keys()
+            for i in xrange(0, nb_words_total, CFG_BIBINDEX_BULK_FLUSH_CHUNKSIZE):
+                chunk = words[i:i + CFG_BIBINDEX_BULK_FLUSH_CHUNKSIZE]
+                self.put_words_into_db(chunk)
+                nb_words_done += len(chunk)
+                if nb_words_report != 0 and \
+                   (nb_words_done / nb_words_report) > \
+                   ((nb_words_done - len(chunk)) / nb_words_report):
+                    self.log_flush_progress(nb_words_done, nb_words_total)
+        else:
+            for word in self.value.keys():
+                self.put_word_into_db(word)
+                nb_words_done += 1
+                if nb_words_report != 0 and ((nb_words_done % nb_words_report) == 0):
+                    self.log_flush_progress(nb_words_done, nb_words_total)
 
         write_message('...updating %d words into %s ended' % \
                       (nb_words_total, tab_name))
+        hitlist_cache.invalidate(self.table_name)
 
         write_message('...updating reverse table %s started' % tab_name)
         if mode == "normal":
@@ -703,6 +739,106 @@ class AbstractIndexTable(object):
         task_update_progress("(%s:%s) flush ended" % \
                       (self.table_name, self.index_name))
 
+    def log_flush_progress(self, nb_words_done, nb_words_total):
+        """Report how many words of the table were already flushed."""
+        write_message('......processed %d/%d words' % \
+                      (nb_words_done, nb_words_total))
+        percentage_display = get_percentage_completed(nb_words_done, nb_words_total)
+        task_update_progress("(%s:%s) flushed %d/%d words %s" % \
+                             (self.table_name[:-1] + "R", self.index_name,
+                              nb_words_done, nb_words_total,
+                              percentage_display))
+
+    def put_words_into_db(self, words):
+        """Flush a chunk of words to the database.
+
+        This is the bulk counterpart of put_word_into_db(): the existing
+        hitlists of all the words are loaded with a single query, merged
+        with the signs kept in memory and the changed hitlists are written
+        back with multi-row statements.  Words sharing their collation
+        key with another term of the chunk or of the table are flushed
+        one by one, so that the database merges them like it does in
+        put_word_into_db().
+        """
+        table_name = wash_table_column_name(self.table_name)
+        wanted = set(words)
+        old_hitlists = {}
+        collation_matches = False
+        terms_by_key = {}
+        for word in words:
+            terms_by_key.setdefault(get_collation_key(word), set()).add(word)
+        query = "SELECT term, hitlist FROM %s WHERE term IN (%s)" % \
+                (table_name, ", ".join(["%s"] * len(words))) # kwalitee: disable=sql
+        for term, hitlist in run_sql(query, tuple(words)):
+            if term in wanted:
+                if term not in old_hitlists:
+                    old_hitlists[term] = hitlist
+            else:
+                key = get_collation_key(term)
+                if key in terms_by_key:
+                    terms_by_key[key].add(term)
+                else:
+                    # the DB collation matched a term we cannot relate
+                    # to any word of the chunk:
+                    collation_matches = True
+
+        updated = []
+        inserted = []
+        emptied = []
+        one_by_one = []
+        for word in words:
+            if len(terms_by_key[get_collation_key(word)]) > 1 or \
+               (collation_matches and word not in old_hitlists):
+                # the word may be stored under another spelling, let
+                # the word-by-word flush find out which one:
+                one_by_one.append(word)
+                continue
+            if word in old_hitlists:
+                hitlist = intbitset(old_hitlists[word])
+                if not self.merge_with_old_recIDs(word, hitlist):
+                    write_message("......... unchanged hitlist for ``%s''" % \
+                                  word, verbose=9)
+                elif hitlist:
+                    write_message("......... updating hitlist for ``%s''" % \
+                                  word, verbose=9)
+                    updated.append((word, hitlist.fastdump()))
+            else:
+                write_message("......... inserting hitlist for ``%s''" % \
+                              word, verbose=9)
+                hitlist = intbitset(self.value[word].keys())
+                inserted.append((word, hitlist.fastdump()))
+            if not hitlist: # never store empty words
+                emptied.append(word)
+
+        try:
+            if self.table_type == CFG_BIBINDEX_INDEX_TABLE_TYPE["Phrases"]:
+                # phrase terms are not unique keys, so no upsert here:
+                run_sql_many("UPDATE %s SET hitlist=%%s WHERE term=%%s" % table_name,
+                             [(dump, word) for word, dump in updated],
+                             limit=CFG_BIBINDEX_BULK_FLUSH_CHUNKSIZE) # kwalitee: disable=sql
+            else:
+                run_sql_many("INSERT INTO %s (term, hitlist) VALUES (%%s, %%s) "
+                             "ON DUPLICATE KEY UPDATE hitlist=VALUES(hitlist)" % table_name,
+                             updated, limit=CFG_BIBINDEX_BULK_FLUSH_CHUNKSIZE) # kwalitee: disable=sql
+            # no upsert for new words: a duplicate key means that the
+            # collation matched another term, which the fallback merges
+            run_sql_many("INSERT INTO %s (term, hitlist) VALUES (%%s, %%s)" % table_name,
+                         inserted, limit=CFG_BIBINDEX_BULK_FLUSH_CHUNKSIZE) # kwalitee: disable=sql
+        except Exception, e:
+            ## merging the signs again is harmless, so fall back to the
+            ## word-by-word flush which reports the offending term:
+            register_exception(prefix="Error when putting %d terms into %s in bulk: %s\n" % (len(words), table_name, e), alert_admin=False)
+            for word in words:
+                self.put_word_into_db(word)
+            return
+
+        if emptied:
+            run_sql("DELETE FROM %s WHERE term IN (%s)" % \
+                    (table_name, ", ".join(["%s"] * len(emptied))),
+                    tuple(emptied)) # kwalitee: disable=sql
+        for word in one_by_one:
+            self.put_word_into_db(word)
+
     def put_word_into_db(self, word):
         """Flush a single word to the database and delete it from memory"""
         set = self.load_old_recIDs(word)
@@ -1351,62 +1487,110 @@ class WordTable(AbstractIndexTable):
             write_message("The word '%s' does not exist in the word file."\
                               % word)
 
-    def add_recIDs(self, recIDs, opt_flush):
-        """Fetches records which id in the recIDs range list and adds
-        them to the wordTable.  The recIDs range list is of the form:
-        [[i1_low,i1_high],[i2_low,i2_high], ..., [iN_low,iN_high]].
+    def get_recID_chunks(self, recIDs, opt_flush):
+        """Splits the recIDs range list into the (low, high) chunks of
+        records which are indexed in one go, with respect to the flush
+        size and the global chunksize variable.
         """
-        global chunksize, _last_word_table
+        global chunksize
         flush_count = 0
-        records_done = 0
-        records_to_go = 0
-
-        for arange in recIDs:
-            records_to_go = records_to_go + arange[1] - arange[0] + 1
-
-        time_started = time.time() # will measure profile time
         for arange in recIDs:
             i_low = arange[0]
             chunksize_count = 0
             while i_low <= arange[1]:
-                task_sleep_now_if_required()
-                # calculate chunk group of recIDs and treat it:
                 i_high = min(i_low + opt_flush - flush_count - 1, arange[1])
                 i_high = min(i_low + chunksize - chunksize_count - 1, i_high)
-
-                try:
-                    self.chk_recID_range(i_low, i_high)
-                except StandardError:
-                    if self.index_name == 'fulltext' and CFG_SOLR_URL:
-                        solr_commit()
-                    raise
-
-                write_message(CFG_BIBINDEX_ADDING_RECORDS_STARTED_STR % \
-                        (self.table_name, i_low, i_high))
-                if CFG_CHECK_MYSQL_THREADS:
-                    kill_sleepy_mysql_threads()
-                percentage_display = get_percentage_completed(records_done, records_to_go)
-                task_update_progress("(%s:%s) adding recs %d-%d %s" % (self.table_name, self.index_name, i_low, i_high, percentage_display))
-                self.del_recID_range(i_low, i_high)
-                just_processed = self.add_recID_range(i_low, i_high)
+                yield i_low, i_high
                 flush_count = flush_count + i_high - i_low + 1
                 chunksize_count = chunksize_count + i_high - i_low + 1
-                records_done = records_done + just_processed
-                write_message(CFG_BIBINDEX_ADDING_RECORDS_STARTED_STR % \
-                        (self.table_name, i_low, i_high))
                 if chunksize_count >= chunksize:
                     chunksize_count = 0
-                # flush if necessary:
                 if flush_count >= opt_flush:
-                    self.put_into_db()
-                    self.clean()
-                    if self.index_name == 'fulltext' and CFG_SOLR_URL:
-                        solr_commit()
-                    write_message("%s backing up" % (self.table_name))
                     flush_count = 0
-                    self.log_progress(time_started, records_done, records_to_go)
-                # iterate:
                 i_low = i_high + 1
+
+    def get_words_from_recID_chunks(self, chunks, workers=1):
+        """Yields (low, high, words) for every chunk of records, where
+        words are the (recID, termlist) pairs of the chunk as returned by
+        get_words_from_recID_range().  With more than one worker the
+        chunks are tokenized ahead in a pool of processes, otherwise
+        words is None and the tokenizing is left to add_recID_range().
+        """
+        if workers <= 1:
+            for i_low, i_high in chunks:
+                yield i_low, i_high, None
+            return
+
+        pool = Pool(workers, _init_words_collector,
+                    (self.index_name, self.table_type,
+                     self.table_prefix, self.wash_index_terms))
+        try:
+            pending = deque()
+            for chunk in chunks:
+                pending.append((chunk, pool.apply_async(
+                    _collect_words_from_recID_range, chunk)))
+                # keep at most two chunks per worker in memory:
+                if len(pending) >= 2 * workers:
+                    (i_low, i_high), result = pending.popleft()
+                    yield i_low, i_high, result.get()
+            while pending:
+                (i_low, i_high), result = pending.popleft()
+                yield i_low, i_high, result.get()
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def add_recIDs(self, recIDs, opt_flush, workers=1):
+        """Fetches records which id in the recIDs range list and adds
+        them to the wordTable.  The recIDs range list is of the form:
+        [[i1_low,i1_high],[i2_low,i2_high], ..., [iN_low,iN_high]].
+        Records are tokenized in WORKERS processes; the words are always
+        put into the table in the parent process, chunk after chunk, so
+        the result does not depend on the number of workers.
+        """
+        global chunksize, _last_word_table
+        flush_count = 0
+        records_done = 0
+        records_to_go = 0
+
+        for arange in recIDs:
+            records_to_go = records_to_go + arange[1] - arange[0] + 1
+
+        time_started = time.time() # will measure profile time
+        chunks = self.get_words_from_recID_chunks(
+            self.get_recID_chunks(recIDs, opt_flush), workers)
+        for i_low, i_high, words in chunks:
+            task_sleep_now_if_required()
+
+            try:
+                self.chk_recID_range(i_low, i_high)
+            except StandardError:
+                if self.index_name == 'fulltext' and CFG_SOLR_URL:
+                    solr_commit()
+                raise
+
+            write_message(CFG_BIBINDEX_ADDING_RECORDS_STARTED_STR % \
+                    (self.table_name, i_low, i_high))
+            if CFG_CHECK_MYSQL_THREADS:
+                kill_sleepy_mysql_threads()
+            percentage_display = get_percentage_completed(records_done, records_to_go)
+            task_update_progress("(%s:%s) adding recs %d-%d %s" % (self.table_name, self.index_name, i_low, i_high, percentage_display))
+            self.del_recID_range(i_low, i_high)
+            just_processed = self.add_recID_range(i_low, i_high, words)
+            flush_count = flush_count + i_high - i_low + 1
+            records_done = records_done + just_processed
+            write_message(CFG_BIBINDEX_ADDING_RECORDS_STARTED_STR % \
+                    (self.table_name, i_low, i_high))
+            # flush if necessary:
+            if flush_count >= opt_flush:
+                self.put_into_db()
+                self.clean()
+                if self.index_name == 'fulltext' and CFG_SOLR_URL:
+                    solr_commit()
+                write_message("%s backing up" % (self.table_name))
+                flush_count = 0
+                self.log_progress(time_started, records_done, records_to_go)
         if flush_count > 0:
             self.put_into_db()
             if self.index_name == 'fulltext' and CFG_SOLR_URL:
@@ -1414,10 +1598,12 @@ class WordTable(AbstractIndexTable):
             self.log_progress(time_started, records_done, records_to_go)
         self.notify_virtual_indexes(recIDs)
 
-    def add_recID_range(self, recID1, recID2):
-        """Add records from RECID1 to RECID2."""
+    def get_words_from_recID_range(self, recID1, recID2):
+        """Returns the list of (recID, termlist) pairs of the records
+        from RECID1 to RECID2.  Only reads from the database, so it can
+        run in a worker process.
+        """
         wlist = {}
-        self.recIDs_in_mem.append([recID1, recID2])
         # special case of author indexes where we also add author
         # canonical IDs:
         if self.index_name in ('author', 'firstauthor', 'exactauthor', 'exactfirstauthor'):
@@ -1448,7 +1634,7 @@ class WordTable(AbstractIndexTable):
         # lookup index-time synonyms:
         synonym_kbrs = get_all_synonym_knowledge_bases()
         if self.index_name in synonym_kbrs:
-            if len(wlist) == 0: return 0
+            if len(wlist) == 0: return []
             recIDs = wlist.keys()
             for recID in recIDs:
                 for word in wlist[recID]:
@@ -1469,10 +1655,21 @@ class WordTable(AbstractIndexTable):
                 write_message("... record %d was declared deleted, removing its word list" % recID, verbose=9)
             write_message("... record %d, termlist: %s" % (recID, wlist[recID]), verbose=9)
 
-        if len(wlist) == 0: return 0
+        return [(recID, wlist[recID]) for recID in recIDs]
+
+    def add_recID_range(self, recID1, recID2, words=None):
+        """Add records from RECID1 to RECID2.
+        @param words: (recID, termlist) pairs of the records, as returned
+            by get_words_from_recID_range(); computed here when None
+        """
+        self.recIDs_in_mem.append([recID1, recID2])
+        if words is None:
+            words = self.get_words_from_recID_range(recID1, recID2)
+
+        if len(words) == 0: return 0
         # put words into reverse index table with FUTURE status:
-        for recID in recIDs:
-            run_sql("INSERT INTO %sR (id_bibrec,termlist,type) VALUES (%%s,%%s,'FUTURE')" % wash_table_column_name(self.table_name[:-1]), (recID, serialize_via_marshal(wlist[recID]))) # kwalitee: disable=sql
+        for recID, termlist in words:
+            run_sql("INSERT INTO %sR (id_bibrec,termlist,type) VALUES (%%s,%%s,'FUTURE')" % wash_table_column_name(self.table_name[:-1]), (recID, serialize_via_marshal(termlist))) # kwalitee: disable=sql
             # ... and, for new records, enter the CURRENT status as empty:
             try:
                 run_sql("INSERT INTO %sR (id_bibrec,termlist,type) VALUES (%%s,%%s,'CURRENT')" % wash_table_column_name(self.table_name[:-1]), (recID, serialize_via_marshal([]))) # kwalitee: disable=sql
@@ -1482,10 +1679,10 @@ class WordTable(AbstractIndexTable):
 
         # put words into memory word list:
         put = self.put
-        for recID in recIDs:
-            for w in wlist[recID]:
+        for recID, termlist in words:
+            for w in termlist:
                 put(recID, w, 1)
-        return len(recIDs)
+        return len(words)
 
     def find_nonmarc_records(self, recID1, recID2):
         """Divides recID range into two different tables,
@@ -1783,6 +1980,8 @@ def main():
   --force\t\tforce indexing of all records for provided indexes
   -Z, --remove-dependent-index=w  name of an index for removing from virtual index
   -l --all-virtual\t\t set of all virtual indexes; the same as: -w virtual_ind1, virtual_ind2, ...
+  --bulk-flush\t\tflush word tables in chunks of terms instead of term by term
+  --workers=NNN\t\tnumber of processes tokenizing records when adding (1)
 """,
             version=__revision__,
             specific_params=("adi:m:c:w:krRM:f:oZ:l", [
@@ -1799,7 +1998,9 @@ def main():
                 "flush=",
                 "force",
                 "remove-dependent-index=",
-                "all-virtual"
+                "all-virtual",
+                "bulk-flush",
+                "workers="
             ]),
             task_stop_helper_fnc=task_stop_table_close_fnc,
             task_submit_elaborate_specific_parameter_fnc=task_submit_elaborate_specific_parameter,
@@ -1858,6 +2059,12 @@ def task_submit_elaborate_specific_parameter(key, value, opts, args):
         task_set_option("remove-dependent-index", value)
     elif key in ("-l", "--all-virtual",):
         task_set_option("all-virtual", True)
+    elif key in ("--bulk-flush",):
+        task_set_option("bulk-flush", True)
+    elif key in ("--workers",):
+        task_set_option("workers", int(value))
+        if task_get_option("workers") < 1:
+            raise StandardError("Number of workers should be at least 1")
     else:
         return False
     return True
@@ -2197,7 +2404,8 @@ def task_run_core():
                     raise StandardError(error_message)
             elif task_get_option("cmd") == "add":
                 final_recIDs = beautify_range_list(create_range_list(recIDs_for_index[index_name]))
-                wordTable.add_recIDs(final_recIDs, task_get_option("flush"))
+                wordTable.add_recIDs(final_recIDs, task_get_option("flush"),
+                                     task_get_option("workers", 1))
                 task_sleep_now_if_required(can_stop_too=True)
             elif task_get_option("cmd") == "repair":
                 wordTable.repair(task_get_option("flush"))
@@ -2236,7 +2444,8 @@ def task_run_core():
                     raise StandardError(error_message)
             elif task_get_option("cmd") == "add":
                 final_recIDs = beautify_range_list(create_range_list(recIDs_for_index[index_name]))
-                wordTable.add_recIDs(final_recIDs, task_get_option("flush"))
+                wordTable.add_recIDs(final_recIDs, task_get_option("flush"),
+                                     task_get_option("workers", 1))
                 task_sleep_now_if_required(can_stop_too=True)
             elif task_get_option("cmd") == "repair":
                 wordTable.repair(task_get_option("flush"))
@@ -2275,7 +2484,8 @@ def task_run_core():
                     raise StandardError(error_message)
             elif task_get_option("cmd") == "add":
                 final_recIDs = beautify_range_list(create_range_list(recIDs_for_index[index_name]))
-                wordTable.add_recIDs(final_recIDs, task_get_option("flush"))
+                wordTable.add_recIDs(final_recIDs, task_get_option("flush"),
+                                     task_get_option("workers", 1))
                 if not task_get_option("id") and not task_get_option("collection"):
                     update_index_last_updated([index_name], task_get_task_param('task_starting_time'))
                 task_sleep_now_if_required(can_stop_too=True)
@@ -52,6 +52,10 @@ CFG_BIBINDEX_WASH_INDEX_TERMS = { 'Words': 50,
                                   'Pairs': 100,
                                   'Phrases': 0}
 
+## how many terms are read and written per query when flushing
+## word tables in bulk mode (see bibindex --bulk-flush):
+CFG_BIBINDEX_BULK_FLUSH_CHUNKSIZE = 1000
+
 CFG_BIBINDEX_ADDING_RECORDS_STARTED_STR = "%s adding records #%d-#%d started"
 
 CFG_BIBINDEX_UPDATE_MESSAGE = "Searching for records which should be reindexed..."
@@ -24,6 +24,7 @@
 
 import re
 import sys
+import unicodedata
 
 from invenio.base.helpers import utf8ifier
 
@@ -143,6 +144,18 @@ def author_name_requires_phrase_search(p):
     return False
 
 
+def get_collation_key(term):
+    """Return an approximation of the case and accent insensitive
+    collation of the term columns, under which MySQL considers terms
+    such as 'cafe' and 'café' equal."""
+    try:
+        term = term.decode('utf-8')
+    except UnicodeDecodeError:
+        return term
+    return u''.join(char for char in unicodedata.normalize('NFKD', term)
+                    if not unicodedata.combining(char)).lower().rstrip(u' ')
+
+
 def get_field_count(recID, tags):
     """
     Return number of field instances having TAGS in record RECID.
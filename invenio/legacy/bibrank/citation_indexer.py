@@ -48,6 +48,9 @@ from invenio.legacy.bibsched.bibtask import write_message, task_get_option, \
 from invenio.legacy.bibindex.engine_utils import get_field_tags
 from invenio.legacy.docextract.record import get_record
 from invenio.legacy.dbquery import serialize_via_marshal
+from invenio.legacy.bibrank.citation_searcher import \
+    store_citation_dicts_snapshot, \
+    get_selfcites_weights
 
 re_CFG_JOURNAL_PUBINFO_STANDARD_FORM_REGEXP_CHECK \
                    = re.compile(CFG_JOURNAL_PUBINFO_STANDARD_FORM_REGEXP_CHECK)
@@ -201,9 +204,12 @@ def process_and_store(recids, config, chunk_size):
 
 
 def store_weights_cache(weights):
-    """Store into key/value store"""
+    """Store into key/value store and into the citation dictionaries
+    snapshot shared by the web processes"""
     redis = get_redis()
     redis.set('citations_weights', serialize_via_marshal(weights))
+    if weights is not None:
+        store_citation_dicts_snapshot(weights, get_selfcites_weights())
 
 
 def process_chunk(recids, config):
@@ -19,8 +19,12 @@
 
 __revision__ = "$Id$"
 
+import os
 import re
+import time
+from itertools import izip
 
+from invenio.config import CFG_CACHEDIR
 from invenio.legacy.dbquery import run_sql
 from intbitset import intbitset
 from invenio.legacy.miscutil.data_cacher import DataCacher
@@ -29,6 +33,235 @@ from invenio.legacy.dbquery import deserialize_via_marshal
 from operator import itemgetter
 from six import iteritems
 
+try:
+    import numpy
+    import_numpy = 1
+except ImportError:
+    import_numpy = 0
+
+## citation dictionaries snapshots shared by all the processes; every
+## snapshot is a subdirectory, the file 'current' names the newest one
+CFG_CITATION_DICTS_SNAPSHOT_DIR = os.path.join(CFG_CACHEDIR, 'citations')
+
+
+class CitationWeights(object):
+    """
+    Read-only recid -> number of citations mapping kept in two aligned
+    arrays, the recids being sorted.  The arrays may be memory mapped
+    from a citation dictionaries snapshot.
+    """
+    def __init__(self, recids, counts):
+        self.recids = recids
+        self.counts = counts
+
+    def _position(self, recid):
+        try:
+            i = int(self.recids.searchsorted(recid))
+        except (TypeError, ValueError):
+            return None
+        if i < len(self.recids) and self.recids[i] == recid:
+            return i
+        return None
+
+    def __len__(self):
+        return len(self.recids)
+
+    def __contains__(self, recid):
+        return self._position(recid) is not None
+
+    def __getitem__(self, recid):
+        i = self._position(recid)
+        if i is None:
+            raise KeyError(recid)
+        return int(self.counts[i])
+
+    def get(self, recid, default=None):
+        i = self._position(recid)
+        if i is None:
+            return default
+        return int(self.counts[i])
+
+    def keys(self):
+        return self.recids.tolist()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def iteritems(self):
+        return izip(self.recids.tolist(), self.counts.tolist())
+
+    def items(self):
+        return list(self.iteritems())
+
+
+class CitationCounts(object):
+    """
+    Read-only list of (recid, number of citations) pairs sorted by
+    decreasing number of citations, given by the precomputed ORDER of
+    the positions in the RECIDS and COUNTS arrays.
+    """
+    def __init__(self, recids, counts, order, block_size=10000):
+        self.recids = recids
+        self.counts = counts
+        self.order = order
+        self.block_size = block_size
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        position = self.order[i]
+        return (int(self.recids[position]), int(self.counts[position]))
+
+    def __iter__(self):
+        for start in xrange(0, len(self.order), self.block_size):
+            positions = self.order[start:start + self.block_size]
+            for pair in izip(self.recids[positions].tolist(),
+                             self.counts[positions].tolist()):
+                yield pair
+
+    def get_recids_with_counts(self, low, high=None):
+        """Returns the intbitset of recids cited between LOW and HIGH
+        times (or at least LOW times when HIGH is None)."""
+        selected = self.counts >= low
+        if high is not None:
+            selected &= self.counts <= high
+        return intbitset(self.recids[selected].tolist())
+
+
+def _weights_arrays(weights, recids=None):
+    """Returns the sorted recids and the aligned counts arrays of a
+    recid -> count dictionary; the counts of the RECIDS are returned
+    if they are given."""
+    if recids is None:
+        recids = numpy.array(sorted(weights), dtype=numpy.int32)
+    counts = numpy.array([weights.get(recid, 0) for recid in recids.tolist()],
+                         dtype=numpy.int32)
+    return recids, counts
+
+
+def _decreasing_order(counts):
+    """Returns the positions of the counts sorted by decreasing value."""
+    return numpy.argsort(-counts.astype(numpy.int64),
+                         kind='mergesort').astype(numpy.int32)
+
+
+def get_citation_dicts_snapshot_path(path=CFG_CITATION_DICTS_SNAPSHOT_DIR):
+    """Returns the directory of the newest snapshot, None if none."""
+    try:
+        current = open(os.path.join(path, 'current')).read().strip()
+    except IOError:
+        return None
+    if not current or not os.path.isdir(os.path.join(path, current)):
+        return None
+    return os.path.join(path, current)
+
+
+def store_citation_dicts_snapshot(weights, selfcites,
+                                  path=CFG_CITATION_DICTS_SNAPSHOT_DIR):
+    """
+    Writes a snapshot of the citation dictionaries that every process
+    can memory map instead of building its own copy: the sorted recids,
+    their citation counts, the counts without self-citations and the
+    decreasing orderings of both counts.  The previous snapshots are
+    removed; processes still mapping them keep reading them fine.
+
+    @param weights: recid -> number of citations
+    @param selfcites: recid -> number of self-citations
+    """
+    if not import_numpy:
+        return None
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    name = "%.6f" % time.time()
+    snapshot = os.path.join(path, name)
+    os.mkdir(snapshot)
+
+    recids, counts = _weights_arrays(weights)
+    dummy, selfcites_counts = _weights_arrays(selfcites, recids)
+    selfcites_counts = counts - selfcites_counts
+    for array_name, array in (('recids', recids),
+                              ('citations', counts),
+                              ('citations_order', _decreasing_order(counts)),
+                              ('selfcites', selfcites_counts),
+                              ('selfcites_order',
+                               _decreasing_order(selfcites_counts))):
+        numpy.save(os.path.join(snapshot, array_name + '.npy'), array)
+
+    tmp_current = os.path.join(path, 'current.%s.tmp' % os.getpid())
+    current_file = open(tmp_current, 'w')
+    current_file.write(name)
+    current_file.close()
+    os.rename(tmp_current, os.path.join(path, 'current'))
+
+    for old_name in os.listdir(path):
+        old_snapshot = os.path.join(path, old_name)
+        if old_name != name and os.path.isdir(old_snapshot):
+            for filename in os.listdir(old_snapshot):
+                os.remove(os.path.join(old_snapshot, filename))
+            os.rmdir(old_snapshot)
+    return snapshot
+
+
+def load_citation_dicts_snapshot(path=CFG_CITATION_DICTS_SNAPSHOT_DIR):
+    """
+    Memory maps the newest snapshot of the citation dictionaries.
+    Returns the dictionaries used by CitationDictsDataCacher, or None
+    when there is no snapshot.
+    """
+    if not import_numpy:
+        return None
+    snapshot = get_citation_dicts_snapshot_path(path)
+    if snapshot is None:
+        return None
+
+    def load(array_name):
+        return numpy.load(os.path.join(snapshot, array_name + '.npy'),
+                          mmap_mode='r')
+
+    try:
+        recids = load('recids')
+        counts = load('citations')
+        selfcites_counts = load('selfcites')
+        alldicts = {
+            'citations_weights': CitationWeights(recids, counts),
+            'citations_keys': intbitset(recids.tolist()),
+            'citations_counts': CitationCounts(recids, counts,
+                                               load('citations_order')),
+            'selfcites_weights': CitationWeights(recids, selfcites_counts),
+            'selfcites_counts': CitationCounts(recids, selfcites_counts,
+                                               load('selfcites_order')),
+        }
+    except (IOError, OSError, ValueError):
+        # the snapshot was replaced while we were loading it
+        return None
+    return alldicts
+
+
+def get_citations_weights():
+    """Returns the recid -> number of citations dictionary, as stored
+    by the citation indexer in redis, or in the database otherwise."""
+    from invenio.legacy.bibrank.tag_based_indexer import fromDB
+    serialized_weights = get_redis().get('citations_weights')
+    if serialized_weights:
+        weights = deserialize_via_marshal(serialized_weights)
+        if weights is not None:
+            return weights
+    return fromDB('citation')
+
+
+def get_selfcites_weights():
+    """Returns the recid -> number of self-citations dictionary, as
+    stored by the self-citations task in redis, or in the database
+    otherwise."""
+    from invenio.legacy.bibrank.tag_based_indexer import fromDB
+    serialized_weights = get_redis().get('selfcites_weights')
+    if serialized_weights:
+        weights = deserialize_via_marshal(serialized_weights)
+        if weights is not None:
+            return weights
+    return fromDB('selfcites')
+
 
 class CitationDictsDataCacher(DataCacher):
     """
@@ -38,14 +271,12 @@ class CitationDictsDataCacher(DataCacher):
     def __init__(self):
 
         def fill():
+            alldicts = load_citation_dicts_snapshot()
+            if alldicts is not None:
+                return alldicts
+
             alldicts = {}
-            from invenio.legacy.bibrank.tag_based_indexer import fromDB
-            redis = get_redis()
-            serialized_weights = redis.get('citations_weights')
-            if serialized_weights:
-                weights = deserialize_via_marshal(serialized_weights)
-            else:
-                weights = fromDB('citation')
+            weights = get_citations_weights()
 
             alldicts['citations_weights'] = weights
             # for cited:M->N queries, it is interesting to cache also
@@ -57,11 +288,7 @@ class CitationDictsDataCacher(DataCacher):
             alldicts['citations_counts'].sort(key=itemgetter(1), reverse=True)
 
             # Self-cites
-            serialized_weights = redis.get('selfcites_weights')
-            if serialized_weights:
-                selfcites = deserialize_via_marshal(serialized_weights)
-            else:
-                selfcites = fromDB('selfcites')
+            selfcites = get_selfcites_weights()
             selfcites_weights = {}
             for recid, counts in alldicts['citations_counts']:
                 selfcites_weights[recid] = counts - selfcites.get(recid, 0)
@@ -127,9 +354,7 @@ def get_cited_by(recordid):
 
 def get_cited_by_count(recordid):
     """Return how many records cite given RECORDID."""
-    rows = run_sql("SELECT 1 FROM rnkCITATIONDICT WHERE citee = %s",
-                   [recordid])
-    return len(rows)
+    return get_citation_dict("citations_weights").get(recordid, 0)
 
 
 def get_records_with_num_cites(numstr, allrecs=intbitset([]),
@@ -141,7 +366,7 @@ def get_records_with_num_cites(numstr, allrecs=intbitset([]),
     """
     if exclude_selfcites:
         cache_cited_by_dictionary_counts = get_citation_dict("selfcites_counts")
-        citations_keys = intbitset(get_citation_dict("selfcites_weights").keys())
+        citations_keys = get_citation_dict("citations_keys")
     else:
         cache_cited_by_dictionary_counts = get_citation_dict("citations_counts")
         citations_keys = get_citation_dict("citations_keys")
@@ -161,6 +386,8 @@ def get_records_with_num_cites(numstr, allrecs=intbitset([]),
         if num == 0:
             #we return recids that are not in keys
             return allrecs - citations_keys
+        elif isinstance(cache_cited_by_dictionary_counts, CitationCounts):
+            return cache_cited_by_dictionary_counts.get_recids_with_counts(num, num)
         else:
             return intbitset([recid for recid, cit_count
                         in cache_cited_by_dictionary_counts
@@ -175,18 +402,24 @@ def get_records_with_num_cites(numstr, allrecs=intbitset([]),
             # Start with those that have no cites..
     	    matches = allrecs - citations_keys
         if first <= sec:
-            matches += intbitset([recid for recid, cit_count
-                             in cache_cited_by_dictionary_counts
-                             if first <= cit_count <= sec])
+            if isinstance(cache_cited_by_dictionary_counts, CitationCounts):
+                matches += cache_cited_by_dictionary_counts.get_recids_with_counts(first, sec)
+            else:
+                matches += intbitset([recid for recid, cit_count
+                                 in cache_cited_by_dictionary_counts
+                                 if first <= cit_count <= sec])
         return matches
 
     # Try to get 10+
     firstsec = re.findall("(\d+)\+", numstr)
     if firstsec:
         first = int(firstsec[0])
-        matches = intbitset([recid for recid, cit_count
-                         in cache_cited_by_dictionary_counts \
-                         if cit_count > first])
+        if isinstance(cache_cited_by_dictionary_counts, CitationCounts):
+            matches = cache_cited_by_dictionary_counts.get_recids_with_counts(first + 1)
+        else:
+            matches = intbitset([recid for recid, cit_count
+                             in cache_cited_by_dictionary_counts \
+                             if cit_count > first])
 
     return matches
 
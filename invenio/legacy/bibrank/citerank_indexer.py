@@ -33,7 +33,8 @@ import time
 import re
 import sys
 try:
-    from numpy import array, ones, zeros, int32, float32, sqrt, dot
+    from numpy import array, ones, zeros, int32, float32, float64, sqrt, \
+        dot, bincount, flatnonzero, concatenate, arange, asarray
     import_numpy = 1
 except ImportError:
     import_numpy = 0
@@ -336,63 +337,79 @@ def get_dates_from_db(dict_of_ids, publication_year_tag, creation_date_tag):
     return dates
 
 
+def construct_citation_arrays(cit, dict_of_ids):
+    """returns two index arrays (cited, citing) holding one entry
+    for each citation, in the index space given by dict_of_ids"""
+    nr_of_citations = 0
+    for item in cit:
+        nr_of_citations += len(cit[item])
+    cited = zeros(nr_of_citations, int32)
+    citing = zeros(nr_of_citations, int32)
+    position = 0
+    for item in cit:
+        end = position + len(cit[item])
+        cited[position:end] = dict_of_ids[item]
+        citing[position:end] = [dict_of_ids[value] for value in cit[item]]
+        position = end
+    return cited, citing
+
+
+def sparse_dot(sparse, vector, len_):
+    """multiplies the sparse matrix, given in coordinate format as
+    (rows, columns, values) arrays, by the vector"""
+    rows, columns, values = sparse
+    return bincount(rows, weights=values * vector[columns], minlength=len_)
+
+
 def construct_sparse_matrix(cit, ref, dict_of_ids, len_, damping_factor):
     """returns several structures needed in the calculation
     of the PAGERANK method using this structures, we don't need
-    to keep the full matrix in the memory"""
-    sparse = {}
-    for item in cit:
-        for value in cit[item]:
-            sparse[(dict_of_ids[item], dict_of_ids[value])] = \
-                    damping_factor * 1.0/ref[dict_of_ids[value]]
-    semi_sparse = []
-    for j in range(len_):
-        if ref[j] == 0:
-            semi_sparse.append(j)
+    to keep the full matrix in the memory; the sparse matrix is
+    kept in coordinate format as (rows, columns, values) arrays"""
+    ref = asarray(ref)
+    rows, columns = construct_citation_arrays(cit, dict_of_ids)
+    values = damping_factor / ref[columns].astype(float64)
+    semi_sparse = flatnonzero(ref[:len_] == 0)
     semi_sparse_coeficient = damping_factor/len_
     #zero_coeficient = (1-damping_factor)/len_
     write_message("Sparse information calculated", verbose=3)
-    return sparse, semi_sparse, semi_sparse_coeficient
+    return (rows, columns, values), semi_sparse, semi_sparse_coeficient
 
 
 def construct_sparse_matrix_ext(cit, ref, ext_links, dict_of_ids, alpha, beta):
     """if x doesn't cite anyone: cites everyone : 1/len_ -- should be used!
     returns several structures needed in the calculation
-    of the PAGERANK_EXT method"""
+    of the PAGERANK_EXT method; row and column 0 of the sparse matrix
+    stand for the external papers, the semi sparse structure is a
+    (columns, values) pair of arrays"""
     len_ = len(dict_of_ids)
-    sparse = {}
-    semi_sparse = {}
-    sparse[0, 0] = 1.0 - alpha
-    for j in range(len_):
-        sparse[j+1, 0] = alpha/(len_)
-        if j not in ext_links:
-            sparse[0, j+1] = beta/(len_ + beta)
-        else:
-            if ext_links[j] == 0:
-                sparse[0, j+1] = beta/(len_ + beta)
-            else:
-                aux = beta * ext_links[j]
-                if ref[j] == 0:
-                    sparse[0, j+1] = aux/(aux + len_)
-                else:
-                    sparse[0, j+1] = aux/(aux + ref[j])
-        if ref[j] == 0:
-            semi_sparse[j+1] = (1.0 - sparse[0, j + 1])/len_
-    for item in cit:
-        for value in cit[item]:
-            sparse[(dict_of_ids[item] + 1, dict_of_ids[value] + 1)] = \
-               (1.0 - sparse[0, dict_of_ids[value] + 1])/ref[dict_of_ids[value]]
-    #for i in range(len_ + 1):
-    #    a = ""
-    #    for j in range (len_ + 1):
-    #        if (i,j) in sparse:
-    #            a += str(sparse[(i,j)]) + "\t"
-    #        else:
-    #            a += "0\t"
-    #    print a
-    #print semi_sparse
+    ref = asarray(ref)[:len_].astype(float64)
+    ext = zeros(len_, float64)
+    for j in ext_links:
+        ext[j] = ext_links[j]
+    # weight of the links from each paper towards the external papers:
+    aux = beta * ext
+    external = zeros(len_, float64)
+    external[:] = beta/(len_ + beta)
+    has_ext = ext != 0
+    has_ref = ref != 0
+    with_ref = has_ext & has_ref
+    without_ref = has_ext & ~has_ref
+    external[with_ref] = aux[with_ref]/(aux[with_ref] + ref[with_ref])
+    external[without_ref] = aux[without_ref]/(aux[without_ref] + len_)
+
+    papers = arange(1, len_ + 1, dtype=int32)
+    cited, citing = construct_citation_arrays(cit, dict_of_ids)
+    rows = concatenate(([0], papers, zeros(len_, int32), cited + 1))
+    columns = concatenate(([0], zeros(len_, int32), papers, citing + 1))
+    values = concatenate(([1.0 - alpha],
+                          ones(len_, float64) * (alpha/len_),
+                          external,
+                          (1.0 - external[citing])/ref[citing]))
+    leaves_ = flatnonzero(~has_ref)
+    semi_sparse = (leaves_ + 1, (1.0 - external[leaves_])/len_)
     write_message("Sparse information calculated", verbose=3)
-    return sparse, semi_sparse
+    return (rows.astype(int32), columns.astype(int32), values), semi_sparse
 
 
 def construct_sparse_matrix_time(cit, ref, dict_of_ids, \
@@ -401,27 +418,30 @@ def construct_sparse_matrix_time(cit, ref, dict_of_ids, \
     method using this structures,
     we don't need to keep the full matrix in the memory"""
     len_ = len(dict_of_ids)
-    sparse = {}
-    for item in cit:
-        for value in cit[item]:
-            sparse[(dict_of_ids[item], dict_of_ids[value])] = damping_factor * \
-                    date_coef[dict_of_ids[value]]/ref[dict_of_ids[value]]
-    semi_sparse = []
-    for j in range(len_):
-        if ref[j] == 0:
-            semi_sparse.append(j)
+    ref = asarray(ref)
+    date_coef = date_coef_array(date_coef, len_)
+    rows, columns = construct_citation_arrays(cit, dict_of_ids)
+    values = damping_factor * date_coef[columns] / ref[columns]
+    semi_sparse = flatnonzero(ref[:len_] == 0)
     semi_sparse_coeficient = damping_factor/len_
     #zero_coeficient = (1-damping_factor)/len_
     write_message("Sparse information calculated", verbose=3)
-    return sparse, semi_sparse, semi_sparse_coeficient
+    return (rows, columns, values), semi_sparse, semi_sparse_coeficient
+
+
+def date_coef_array(date_coef, len_):
+    """returns the time coeficients, given as a dictionary
+    index:coeficient, as an array"""
+    coefs = zeros(len_, float64)
+    for j in range(len_):
+        coefs[j] = date_coef[j]
+    return coefs
 
 
 def statistics_on_sparse(sparse):
     """returns the number of papers that cite themselves"""
-    count_diag = 0
-    for (i, j) in sparse.keys():
-        if i == j:
-            count_diag += 1
+    rows, columns, dummy = sparse
+    count_diag = int((rows == columns).sum())
     write_message("The number of papers that cite themselves: %s" % \
         str(count_diag), verbose=3)
     return count_diag
@@ -439,21 +459,17 @@ def pagerank(conv_threshold, check_point, len_, sparse, \
     while not converged:
         nr_of_check_points += 1
         for step in (range(check_point)):
-            weights_new = zeros((len_), float32)
-            for (i, j) in sparse.keys():
-                weights_new[i] += sparse[(i, j)]*weights_old[j]
-            semi_total = 0.0
-            for j in semi_sparse:
-                semi_total += weights_old[j]
+            weights_new = sparse_dot(sparse, weights_old, len_).astype(float32)
+            semi_total = float(weights_old[semi_sparse].sum())
             weights_new = weights_new + semi_sparse_coef * semi_total + \
-                            (1.0/len_ - semi_sparse_coef) * sum(weights_old)
+                            (1.0/len_ - semi_sparse_coef) * float(weights_old.sum())
             if step == check_point - 1:
                 diff = weights_new - weights_old
                 difference = sqrt(dot(diff, diff))/len_
                 write_message("Finished step: %s, %s " \
                         %(str(check_point*(nr_of_check_points-1) + step), \
                             str(difference)), verbose=5)
-            weights_old = weights_new.copy()
+            weights_old = weights_new
             converged = (difference < conv_threshold)
     write_message("PageRank calculated for all recids finnished in %s steps. \
 The threshold was %s" % (str(nr_of_check_points), str(difference)),\
@@ -464,21 +480,17 @@ The threshold was %s" % (str(nr_of_check_points), str(difference)),\
 def pagerank_ext(conv_threshold, check_point, len_, sparse, semi_sparse):
     """the core function of the PAGERANK_EXT method
     returns an array with the ranks coresponding to each recid"""
-    weights_old = array((), float32)
     weights_old = ones((len_), float32)
     weights_new = array((), float32)
+    semi_columns, semi_values = semi_sparse
     converged = False
     nr_of_check_points = 0
     difference = len_
     while not converged:
         nr_of_check_points += 1
         for step in (range(check_point)):
-            weights_new = zeros((len_), float32)
-            for (i, j) in sparse.keys():
-                weights_new[i] += sparse[(i, j)]*weights_old[j]
-            total_sum = 0.0
-            for j in semi_sparse:
-                total_sum += semi_sparse[j]*weights_old[j]
+            weights_new = sparse_dot(sparse, weights_old, len_).astype(float32)
+            total_sum = float(dot(semi_values, weights_old[semi_columns]))
             weights_new[1:len_] = weights_new[1:len_] + total_sum
             if step == check_point - 1:
                 diff = weights_new - weights_old
@@ -486,7 +498,7 @@ def pagerank_ext(conv_threshold, check_point, len_, sparse, semi_sparse):
                 write_message("Finished step: %s, %s " \
                     % (str(check_point*(nr_of_check_points-1) + step), \
                         str(difference)), verbose=5)
-            weights_old = weights_new.copy()
+            weights_old = weights_new
             converged = (difference < conv_threshold)
     write_message("PageRank calculated for all recids finnished in %s steps. \
 The threshold was %s" % (str(nr_of_check_points), \
@@ -499,26 +511,19 @@ def pagerank_time(conv_threshold, check_point, len_, \
         sparse, semi_sparse, semi_sparse_coeficient, date_coef):
     """the core function of the PAGERANK_TIME method: pageRank + time decay
     returns an array with the ranks coresponding to each recid"""
-    weights_old = array((), float32)
     weights_old = ones((len_), float32) # initial weights
     weights_new = array((), float32)
+    date_coef = date_coef_array(date_coef, len_)
     converged = False
     nr_of_check_points = 0
     difference = len_
     while not converged:
         nr_of_check_points += 1
         for step in (range(check_point)):
-            weights_new = zeros((len_), float32)
-            for (i, j) in sparse.keys():
-                weights_new[i] += sparse[(i, j)]*weights_old[j]
-            semi_total = 0.0
-            for j in semi_sparse:
-                semi_total += weights_old[j]*date_coef[j]
-            zero_total = 0.0
-            for i in range(len_):
-                zero_total += weights_old[i]*date_coef[i]
-            #dates = array(date_coef.keys())
-            #zero_total = dot(weights_old, dates)
+            weights_new = sparse_dot(sparse, weights_old, len_).astype(float32)
+            semi_total = float(dot(weights_old[semi_sparse],
+                                   date_coef[semi_sparse]))
+            zero_total = float(dot(weights_old, date_coef))
             weights_new = weights_new + semi_sparse_coeficient * semi_total + \
                     (1.0/len_ - semi_sparse_coeficient) * zero_total
             if step == check_point - 1:
@@ -527,7 +532,7 @@ def pagerank_time(conv_threshold, check_point, len_, \
                 write_message("Finished step: %s, %s " \
                     % (str(check_point*(nr_of_check_points-1) + step), \
                     str(difference)), verbose=5)
-            weights_old = weights_new.copy()
+            weights_old = weights_new
             converged = (difference < conv_threshold)
     write_message("PageRank calculated for all recids finnished in %s steps.\
 The threshold was %s" % (str(nr_of_check_points), \
@@ -879,3 +884,69 @@ to set output_ranks_to_filename and output_rank_limit \
 parameters in the configuration file", verbose=3)
     normalize_weights(dict_of_ranks)
     into_db(dict_of_ranks, rank_method_code)
+
+
+def _pagerank_with_dict(conv_threshold, check_point, len_, cit, ref, \
+            dict_of_ids, damping_factor):
+    """the PAGERANK method as computed before the sparse matrix was kept
+    in arrays: the matrix is a dictionary (i, j):value which is walked in
+    python at every step; only used for benchmarking"""
+    sparse = {}
+    for item in cit:
+        for value in cit[item]:
+            sparse[(dict_of_ids[item], dict_of_ids[value])] = \
+                    damping_factor * 1.0/ref[dict_of_ids[value]]
+    semi_sparse = [j for j in range(len_) if ref[j] == 0]
+    semi_sparse_coef = damping_factor/len_
+    weights_old = ones((len_), float32)
+    converged = False
+    difference = len_
+    while not converged:
+        for step in range(check_point):
+            weights_new = zeros((len_), float32)
+            for (i, j) in sparse.keys():
+                weights_new[i] += sparse[(i, j)]*weights_old[j]
+            semi_total = 0.0
+            for j in semi_sparse:
+                semi_total += weights_old[j]
+            weights_new = weights_new + semi_sparse_coef * semi_total + \
+                            (1.0/len_ - semi_sparse_coef) * sum(weights_old)
+            if step == check_point - 1:
+                diff = weights_new - weights_old
+                difference = sqrt(dot(diff, diff))/len_
+            weights_old = weights_new.copy()
+            converged = (difference < conv_threshold)
+    return weights_old
+
+
+def citerank_benchmark(nr_of_papers=20000, nr_of_citations=200000):
+    """Runs a benchmark of the PAGERANK method on a random citation graph,
+    comparing the array based computation with the dictionary based one.
+
+    @return: dictionary with the time spent by each computation, in
+        seconds, and the largest difference of the weights
+    """
+    import random
+    random.seed(0)
+    recids = range(1, nr_of_papers + 1)
+    dict_of_ids = dict((recid, recid - 1) for recid in recids)
+    cit = {}
+    for dummy in range(nr_of_citations):
+        cited, citing = random.sample(recids, 2)
+        cit.setdefault(cited, set()).add(citing)
+    ref = construct_ref_array(cit, dict_of_ids, nr_of_papers)
+
+    stats = {}
+    start = time.time()
+    sparse, semi_sparse, semi_sparse_coeficient = \
+        construct_sparse_matrix(cit, ref, dict_of_ids, nr_of_papers, 0.85)
+    weights = pagerank(0.0001, 1, nr_of_papers, sparse, semi_sparse, \
+                       semi_sparse_coeficient)
+    stats['arrays'] = time.time() - start
+
+    start = time.time()
+    old_weights = _pagerank_with_dict(0.0001, 1, nr_of_papers, cit, ref, \
+                                      dict_of_ids, 0.85)
+    stats['dictionary'] = time.time() - start
+    stats['largest difference'] = float(abs(weights - old_weights).max())
+    return stats
@@ -223,7 +223,7 @@ def citation(rank_method_code, related_to, hitset, rank_limit_relevance, verbose
     return rank_by_citations(hits, verbose)
 
 
-def rank_records(rank_method_code, rank_limit_relevance, hitset, related_to=[], verbose=0, field='', rg=None, jrec=None):
+def rank_records(rank_method_code, rank_limit_relevance, hitset, related_to=[], verbose=0, field='', rg=None, jrec=None, ranked_result_amount=None):
     """Sorts given records or related records according to given method
 
        Parameters:
@@ -243,6 +243,8 @@ def rank_records(rank_method_code, rank_limit_relevance, hitset, related_to=[],
         - field: stuff
         - rg: more stuff
         - jrec: even more stuff
+        - ranked_result_amount: if given, word similarity ranking
+                                sorts only this many best records
 
        Output:
        - list of records
@@ -278,7 +280,7 @@ def rank_records(rank_method_code, rank_limit_relevance, hitset, related_to=[],
             result = find_similar(rank_method_code, related_to[0][6:], hitset, rank_limit_relevance, verbose, METHODS)
         elif func_object:
             if function == "word_similarity":
-                result = func_object(rank_method_code, related_to, hitset, rank_limit_relevance, verbose, METHODS)
+                result = func_object(rank_method_code, related_to, hitset, rank_limit_relevance, verbose, METHODS, ranked_result_amount)
             elif function in ("word_similarity_solr", "word_similarity_xapian"):
                 if not rg:
                     rg = CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS
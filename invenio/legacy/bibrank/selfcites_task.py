@@ -56,7 +56,9 @@ from invenio.legacy.bibrank.selfcites_indexer import update_self_cites_tables, \
                                               compute_friends_self_citations, \
                                               compute_simple_self_citations, \
                                               get_authors_tags
-from invenio.legacy.bibrank.citation_searcher import get_refers_to
+from invenio.legacy.bibrank.citation_searcher import get_refers_to, \
+                                              get_citations_weights, \
+                                              store_citation_dicts_snapshot
 from invenio.legacy.bibauthorid.daemon import get_user_logs as bibauthorid_user_log
 from invenio.legacy.bibrank.citation_indexer import get_bibrankmethod_lastupdate
 from invenio.legacy.bibrank.tag_based_indexer import intoDB, fromDB
@@ -329,6 +331,8 @@ def fill_self_cites_tables(rank_method_code, config):
 
 
 def store_weights_cache(weights):
-    """Store into key/value store"""
+    """Store into key/value store and into the citation dictionaries
+    snapshot shared by the web processes"""
     redis = get_redis()
     redis.set('selfcites_weights', serialize_via_marshal(weights))
+    store_citation_dicts_snapshot(get_citations_weights(), weights)
@@ -23,6 +23,13 @@ import re
 
 from operator import itemgetter
 from six import iteritems
+from intbitset import intbitset
+
+try:
+    import numpy
+    import_numpy = 1
+except ImportError:
+    import_numpy = 0
 
 from invenio.legacy.dbquery import run_sql, deserialize_via_marshal
 from invenio.legacy.bibindex.engine_stemmer import stem
@@ -170,7 +177,7 @@ def sort_record_relevance_findsimilar(recdict, rec_termcount, hitset, rank_limit
         voutput += "Sort time: %s<br />" % (str(time.time() - startCreate))
     return (reclist, hitset)
 
-def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verbose, methods):
+def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verbose, methods, ranked_result_amount=None):
     """Ranking a records containing specified words and returns a sorted list.
     input:
     rank_method_code - the code of the method, from the name field in rnkMETHOD
@@ -178,6 +185,9 @@ def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verb
     hitset - a list of hits for the query found by search_engine
     rank_limit_relevance - show only records with a rank value above this
     verbose - verbose value
+    ranked_result_amount - if given, only this many best records are sorted
+                           (the rest of the ranked records come before them
+                           in recid order), see sort_record_relevance_arrays
     output:
     reclist - a list of sorted records: [[23,34], [344,24], [1,01]]
     prefix - what to show before the rank value
@@ -203,18 +213,32 @@ def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verb
                 if lwords_old[i] != term: #add if stemmed word is different than original word
                     lwords.append((term, methods[rank_method_code]["rnkWORD_table"]))
 
-    (recdict, rec_termcount, lrecIDs_remove) = ({}, {}, {})
+    if import_numpy:
+        #scores and number of query terms of every record, indexed by recid
+        hitset_mask = get_hitset_mask(hitset)
+        (recdict, rec_termcount) = (numpy.zeros(len(hitset_mask), numpy.int64), numpy.zeros(len(hitset_mask), numpy.int32))
+    else:
+        (recdict, rec_termcount) = ({}, {})
     #For each term, if accepted, get a list of the records using the term
     #calculate then relevance for each term before sorting the list of records
     for (term, table) in lwords:
         term_recs = run_sql("""SELECT term, hitlist FROM %s WHERE term=%%s""" % methods[rank_method_code]["rnkWORD_table"], (term,))
         if term_recs: #if term exists in database, use for ranking
             term_recs = deserialize_via_marshal(term_recs[0][1])
-            (recdict, rec_termcount) = calculate_record_relevance((term, int(term_recs["Gi"][1])) , term_recs, hitset, recdict, rec_termcount, verbose, quick=None)
+            if import_numpy:
+                (recdict, rec_termcount) = calculate_record_relevance_arrays((term, int(term_recs["Gi"][1])), term_recs, hitset_mask, recdict, rec_termcount, verbose, quick=None)
+            else:
+                (recdict, rec_termcount) = calculate_record_relevance((term, int(term_recs["Gi"][1])) , term_recs, hitset, recdict, rec_termcount, verbose, quick=None)
             del term_recs
 
-    if len(recdict) == 0 or (len(lwords) == 1 and lwords[0] == ""):
+    if import_numpy:
+        nothing_ranked = not rec_termcount.any()
+    else:
+        nothing_ranked = len(recdict) == 0
+    if nothing_ranked or (len(lwords) == 1 and lwords[0] == ""):
         return (None, "Records not ranked. The query is not detailed enough, or not enough records found, for ranking to be possible.", "", voutput)
+    elif import_numpy:
+        (reclist, hitset) = sort_record_relevance_arrays(recdict, rec_termcount, hitset, rank_limit_relevance, verbose, ranked_result_amount)
     else: #sort if we got something to sort
         (reclist, hitset) = sort_record_relevance(recdict, rec_termcount, hitset, rank_limit_relevance, verbose)
 
@@ -298,6 +322,104 @@ def sort_record_relevance(recdict, rec_termcount, hitset, rank_limit_relevance,
         voutput += "Sort time: %s<br />" % (str(time.time() - startCreate))
     return (reclist, hitset)
 
+def get_hitset_mask(hitset):
+    """Return boolean array telling for every recid whether it is in hitset."""
+    recids = numpy.fromiter(hitset, dtype=numpy.int64, count=len(hitset))
+    hitset_mask = numpy.zeros(len(recids) and recids.max() + 1 or 1, dtype=bool)
+    hitset_mask[recids] = True
+    return hitset_mask
+
+def calculate_record_relevance_arrays(term, invidx, hitset_mask, recdict, rec_termcount, verbose, quick=None):
+    """Array version of calculate_record_relevance, calculates only one word
+    term - (term, query term factor) the term and its importance in the overall search
+    invidx - {recid: tf, Gi: norm value} The Gi value is used as a idf value
+    hitset_mask - boolean array of records that are allowed to be ranked, see get_hitset_mask
+    recdict - array of current rank values indexed by recid, is updated in place
+    rec_termcount - array indexed by recid of the number of terms in the record that match the query
+    verbose - verbose value
+    quick - if quick=yes only terms with a positive qtf is used, to limit the number of records to sort"""
+
+    (t, qtf) = term
+    if "Gi" in invidx:#Gi = weigth for this term, created by bibrank_word_indexer
+        Gi = invidx["Gi"][1]
+        del invidx["Gi"]
+    else: #if not existing, bibrank should be run with -R
+        return (recdict, rec_termcount)
+
+    #posting list of the term as parallel arrays, in the dictionary order
+    recids = numpy.fromiter(invidx.iterkeys(), dtype=numpy.int64, count=len(invidx))
+    tfs = numpy.array(invidx.values(), dtype=numpy.float64).reshape(len(invidx), 2)
+    in_range = recids < len(hitset_mask)
+    (recids, tfs) = (recids[in_range], tfs[in_range])
+
+    if not quick or (qtf >= 0 or (qtf < 0 and not rec_termcount.any())):
+        #Only accept records existing in the hitset received from the search engine
+        in_hitset = hitset_mask[recids]
+        (recids, tfs) = (recids[in_hitset], tfs[in_hitset])
+        weights = tfs[:, 0] * Gi * tfs[:, 1] * qtf
+        invalid = numpy.flatnonzero(~(numpy.isfinite(weights) & (weights > 0)))
+        if len(invalid):
+            #the dictionary version stops at the first record whose
+            #rank value cannot be calculated
+            (recids, weights) = (recids[:invalid[0]], weights[:invalid[0]])
+        recdict[recids] += numpy.log(weights).astype(numpy.int64)
+        rec_termcount[recids] += 1 #number of terms from query in document
+    elif quick: #much used term, do not include all records, only use already existing ones
+        ranked = rec_termcount[recids] > 0
+        (recids, tfs) = (recids[ranked], tfs[ranked])
+        weights = tfs[:, 0] * Gi * tfs[:, 1] * qtf
+        if not (weights > 0).all():
+            raise ValueError("math domain error")
+        recdict[recids] += numpy.log(weights).astype(numpy.int64)
+        rec_termcount[recids] += 1 #number of terms from query in document
+
+    return (recdict, rec_termcount)
+
+def sort_record_relevance_arrays(recdict, rec_termcount, hitset, rank_limit_relevance, verbose, ranked_result_amount=None):
+    """Array version of sort_record_relevance, returns records with a relevance higher than the given value.
+    recdict - array of rank values indexed by recid
+    rec_termcount - array indexed by recid of the number of query terms in the record
+    rank_limit_relevance - a value > 0 usually
+    verbose - verbose value
+    ranked_result_amount - if given, only this many records with the highest
+                           scores are sorted, by argpartition, and put at the
+                           end of the list; the others come before them in
+                           recid order"""
+
+    startCreate = time.time()
+    voutput = ""
+
+    recids = numpy.flatnonzero(rec_termcount)
+
+    #remove all ranked documents so that unranked can be added to the end
+    hitset -= intbitset(recids.tolist())
+
+    #gives each record a score between 0-100
+    scores = recdict[recids]
+    divideby = scores.max()
+    if divideby == 0:
+        raise ZeroDivisionError("integer division or modulo by zero")
+    scores = scores * 100 // divideby
+    above_limit = scores >= rank_limit_relevance
+    (recids, scores) = (recids[above_limit], scores[above_limit])
+
+    #sort scores, ties by recid
+    if ranked_result_amount and ranked_result_amount < len(recids):
+        keys = scores * (recids[-1] + 1) + recids
+        split = len(recids) - ranked_result_amount
+        best = numpy.argpartition(keys, split)[split:]
+        rest = numpy.ones(len(recids), dtype=bool)
+        rest[best] = False
+        order = numpy.concatenate((numpy.flatnonzero(rest), best[numpy.argsort(keys[best])]))
+    else:
+        order = numpy.argsort(scores, kind='mergesort')
+    reclist = zip(recids[order].tolist(), scores[order].tolist())
+
+    if verbose > 0:
+        voutput += "Number of records sorted: %s<br />" % len(reclist)
+        voutput += "Sort time: %s<br />" % (str(time.time() - startCreate))
+    return (reclist, hitset)
+
 def rank_method_stat(rank_method_code, reclist, lwords):
     """Shows some statistics about the searchresult.
     rank_method_code - name field from rnkMETHOD
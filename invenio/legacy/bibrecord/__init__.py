@@ -92,6 +92,7 @@ bibrecord_tests.py and bibupload_regression_tests.py.
 import re
 import string
 import sys
+import time
 from six import StringIO
 
 if sys.hexversion < 0x2040000:
@@ -125,6 +126,9 @@ AVAILABLE_PARSERS = []
 # has been deleted.
 CFG_BIBRECORD_KEEP_SINGLETONS = True
 
+# Number of bytes read at a time by create_records_from_file().
+CFG_BIBRECORD_FILE_CHUNK_SIZE = 1024 * 1024
+
 from lxml import etree
 AVAILABLE_PARSERS.append('lxml')
 
@@ -155,7 +159,8 @@ def create_field(subfields=None, ind1=' ', ind2=' ', controlfield_value='',
 
 def create_records(marcxml, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
                    correct=CFG_BIBRECORD_DEFAULT_CORRECT, parser='',
-                   keep_singletons=CFG_BIBRECORD_KEEP_SINGLETONS):
+                   keep_singletons=CFG_BIBRECORD_KEEP_SINGLETONS,
+                   compact=False):
     """
     Create a list of records from the marcxml description.
 
@@ -167,14 +172,64 @@ def create_records(marcxml, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
     record_xmls = regex.findall(marcxml)
 
     return [create_record(record_xml, verbose=verbose, correct=correct,
-            parser=parser, keep_singletons=keep_singletons)
+            parser=parser, keep_singletons=keep_singletons, compact=compact)
             for record_xml in record_xmls]
 
 
+def create_records_from_file(marcxml_file,
+                             verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
+                             correct=CFG_BIBRECORD_DEFAULT_CORRECT, parser='',
+                             keep_singletons=CFG_BIBRECORD_KEEP_SINGLETONS):
+    """
+    Yield the records of a MARCXML file one at a time.
+
+    Only the record being parsed is kept in memory, so that files of any
+    size can be processed in constant memory.  The records found are the
+    same as the ones create_records() finds in the content of the file.
+
+    :param marcxml_file: file object to read the MARCXML from
+    :returns: an iterator over the tuples returned by create_record().
+              Please see that function's docstring.
+    """
+    for record_xml in split_records_from_file(marcxml_file):
+        yield create_record(record_xml, verbose=verbose, correct=correct,
+                            parser=parser, keep_singletons=keep_singletons)
+
+
+def split_records_from_file(marcxml_file,
+                            chunk_size=CFG_BIBRECORD_FILE_CHUNK_SIZE):
+    """
+    Yield the XML of the records of a MARCXML file one at a time.
+
+    The file is read incrementally, CHUNK_SIZE bytes at a time.
+    """
+    # Use the DOTALL flag to include newlines.
+    regex = re.compile('<record.*?>.*?</record>', re.DOTALL)
+    buf = ''
+    while True:
+        chunk = marcxml_file.read(chunk_size)
+        if not chunk:
+            break
+        buf += chunk
+        if buf.find('</record>', max(0, len(buf) - len(chunk) - 8)) == -1:
+            # no record can end in the chunk just read
+            continue
+        end = 0
+        for match in regex.finditer(buf):
+            yield match.group()
+            end = match.end()
+        # Keep only the part that may contain the beginning of a record.
+        start = buf.find('<record', end)
+        if start == -1:
+            start = max(end, len(buf) - len('<record') + 1)
+        buf = buf[start:]
+
+
 def create_record(marcxml, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
                   correct=CFG_BIBRECORD_DEFAULT_CORRECT, parser='',
                   sort_fields_by_indicators=False,
-                  keep_singletons=CFG_BIBRECORD_KEEP_SINGLETONS):
+                  keep_singletons=CFG_BIBRECORD_KEEP_SINGLETONS,
+                  compact=False):
     """Create a record object from the marcxml description.
 
     Uses the best parser available in CFG_BIBRECORD_PARSERS_AVAILABLE or
@@ -223,6 +278,8 @@ def create_record(marcxml, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
     :param verbose: the level of verbosity: 0 (silent), 1-2 (warnings),
                     3(strict:stop when errors)
     :param correct: 1 to enable correction of marcxml syntax. Else 0.
+    :param compact: True to return a read-only CompactRecord, e.g. to
+                    format big records.
     :return: a tuple (record, status_code, list_of_errors), where status
              code is 0 where there are errors, 1 when no errors
     """
@@ -247,9 +304,150 @@ def create_record(marcxml, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
         # Correct the structure of the record.
         errs = _correct_record(rec)
 
+    if compact:
+        rec = CompactRecord(rec)
+
     return (rec, int(not errs), errs)
 
 
+class CompactRecord(dict):
+    """
+    Read-only record structure using less memory than create_record().
+
+    The structure is the one described in create_record(), except that
+    the lists of fields and of subfields are tuples, that the tags,
+    indicators and subfield codes are interned and that equal values and
+    subfields (e.g. the affiliations of the authors) are stored once per
+    record.
+    The fields are indexed by tag and indicators and the values by
+    subfield code, so that record_get_field_instances() and
+    record_get_field_value(s)() only visit the matching fields and
+    values.
+
+    All the functions reading records accept compact records.  Use
+    to_dict() to get a record that can be modified.
+    """
+
+    __slots__ = ('_fields_index', '_values_index')
+
+    def __init__(self, rec=None):
+        """Create the compact copy of the record REC."""
+        share = {}.setdefault
+        compact_rec = {}
+        fields_index = {}
+        for tag, fields in (rec or {}).iteritems():
+            tag = _intern(tag)
+            compact_fields = []
+            for subfields, ind1, ind2, value, position in fields:
+                field = (tuple([share(tuple(subfield), tuple(subfield))
+                                for subfield in subfields]),
+                         _intern(ind1), _intern(ind2), share(value, value),
+                         position)
+                compact_fields.append(field)
+                fields_index.setdefault((tag, field[1], field[2]),
+                                        []).append(field)
+            compact_rec[tag] = tuple(compact_fields)
+        dict.__init__(self, compact_rec)
+        self._fields_index = fields_index
+        self._values_index = {}
+
+    def _read_only(self, *args, **kwargs):
+        """Refuse to modify the record."""
+        raise TypeError("CompactRecord is read-only, use to_dict() to get "
+                        "a record that can be modified")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+        update = _read_only
+
+    def __reduce__(self):
+        return (CompactRecord, (self.to_dict(), ))
+
+    def to_dict(self):
+        """Return the record as created by create_record()."""
+        return dict((tag, [(list(field[0]), field[1], field[2], field[3],
+                            field[4])
+                           for field in fields])
+                    for tag, fields in self.iteritems())
+
+    def get_fields(self, tag, ind1, ind2):
+        """Return the fields of TAG having the (washed) indicators.
+
+        The indicators may be the wildcard %.  The returned list must
+        not be modified.
+        """
+        if ind1 != '%' and ind2 != '%':
+            return self._fields_index.get((tag, ind1, ind2), ())
+        return [field for field in self.get(tag, ())
+                if ind1 in ('%', field[1]) and ind2 in ('%', field[2])]
+
+    def get_values(self, tag, ind1, ind2, code):
+        """Return the values of the fields of TAG as returned by
+        record_get_field_values(), without filtering.
+
+        The returned list must not be modified.
+        """
+        key = (tag, ind1, ind2, code)
+        values = self._values_index.get(key)
+        if values is None:
+            fields = self.get_fields(tag, ind1, ind2)
+            if code == '':
+                values = [field[3] for field in fields if field[3]]
+            elif code == '%':
+                values = [subfield[1] for field in fields
+                          for subfield in field[0]]
+            else:
+                values = [subfield[1] for field in fields
+                          for subfield in field[0] if subfield[0] == code]
+            self._values_index[key] = values
+        return values
+
+
+def compact_record_benchmark(nb_authors=10000, nb_repeats=10):
+    """
+    Compare the memory footprint and the speed of (compact) records.
+
+    A collaboration record of NB_AUTHORS authors affiliated to a hundred
+    institutes is created and its authors are read NB_REPEATS times.
+    Example:
+
+        >>> compact_record_benchmark(10000)
+
+    :return: dictionary with, for 'record' and 'compact record', the size
+             of the record structure in bytes, the time to create it and
+             the time to read the authors once, in seconds
+    """
+    marcxml = ['<record>',
+               '<controlfield tag="001">1</controlfield>',
+               '<datafield tag="245" ind1=" " ind2=" ">'
+               '<subfield code="a">Observation of a new boson</subfield>'
+               '</datafield>']
+    for i in range(nb_authors):
+        marcxml.append('<datafield tag="%s" ind1=" " ind2=" ">'
+                       '<subfield code="a">Author, %d.</subfield>'
+                       '<subfield code="u">Institute %d</subfield>'
+                       '<subfield code="i">AUTHOR-%d</subfield>'
+                       '</datafield>' % (i and '700' or '100', i, i % 100, i))
+    marcxml.append('</record>')
+    marcxml = '\n'.join(marcxml)
+
+    stats = {}
+    for name, compact in (('record', False), ('compact record', True)):
+        t1 = time.time()
+        rec = create_record(marcxml, compact=compact)[0]
+        create_time = time.time() - t1
+        size = _get_deep_size(rec)
+        t1 = time.time()
+        for dummy in range(nb_repeats):
+            record_get_field_value(rec, '245', code='a')
+            record_get_field_values(rec, '700', code='a')
+            record_get_field_values(rec, '700', code='u')
+            record_get_field_instances(rec, '700')
+        stats[name] = {'size': size,
+                       'create_time': create_time,
+                       'read_time': (time.time() - t1) / nb_repeats}
+    return stats
+
+
 def filter_field_instances(field_instances, filter_subcode, filter_value,
                            filter_mode='e'):
     """Filter the given field.
@@ -416,6 +614,8 @@ def record_get_field_instances(rec, tag="", ind1=" ", ind2=" "):
                         if (ind1 in ('%', possible_field_instance[1]) and
                                 ind2 in ('%', possible_field_instance[2])):
                             out.append(possible_field_instance)
+        elif isinstance(rec, CompactRecord):
+            out = list(rec.get_fields(tag, ind1, ind2))
         else:
             # Completely defined tag. Use dict
             for possible_field_instance in rec.get(tag, []):
@@ -1009,6 +1209,10 @@ def record_get_field_value(rec, tag, ind1=" ", ind2=" ", code=""):
     # functions or doing tests inside loops)
     ind1, ind2 = _wash_indicators(ind1, ind2)
 
+    if isinstance(rec, CompactRecord) and '%' not in tag:
+        values = rec.get_values(tag, ind1, ind2, code)
+        return values and values[0] or ""
+
     if '%' in tag:
         # Wild card in tag. Must find all corresponding fields
         if code == '':
@@ -1096,6 +1300,10 @@ def record_get_field_values(rec, tag, ind1=" ", ind2=" ", code="",
 
     ind1, ind2 = _wash_indicators(ind1, ind2)
 
+    if (isinstance(rec, CompactRecord) and '%' not in tag and
+            not filter_subfield_code):
+        return list(rec.get_values(tag, ind1, ind2, code))
+
     if filter_subfield_code and filter_subfield_mode == "r":
         reg_exp = re.compile(filter_subfield_value)
 
@@ -2114,6 +2322,34 @@ def _get_children_as_string_rxp(node):
     return ''.join(out)
 
 
+def _get_deep_size(obj):
+    """Return the memory used by OBJ and the objects it contains, in bytes."""
+    size = 0
+    seen = set()
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        if isinstance(obj, CompactRecord):
+            stack.extend((obj._fields_index, obj._values_index))
+    return size
+
+
+def _intern(value):
+    """Return the interned VALUE if it is a byte string."""
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
 def _wash_indicators(*indicators):
     """
     Wash the values of the indicators.
@@ -24,10 +24,11 @@ XML MARC lint - check your XML MARC files.
 from __future__ import print_function
 
 import getopt
+import os
 import string
 
 from invenio.legacy.bibrecord import (
-    create_records,
+    create_records_from_file,
     print_recs
 )
 
@@ -45,7 +46,7 @@ def main():
 
     verbose = 0
     badrecords = []
-    listofrecs = []
+    nb_records = 0
 
     try:
         opts, args = getopt.getopt(
@@ -72,29 +73,31 @@ def main():
         sys.exit(0)
 
     try:
-        xmltext = open(xmlfile, 'r').read()
+        xmlfile_object = open(xmlfile, 'r')
     except IOError:
         print("[ERROR] File %s not found." % xmlfile)
         import sys
         sys.exit(1)
 
-    listofrecs = create_records(xmltext, 0, 1)
-    badr = filter((lambda x: x[1] == 0), listofrecs)
-    badrecords = map((lambda x: x[0]), badr)
-
     s = ''
     errors = []
 
-    if xmltext and not listofrecs:
+    # records are checked one at a time to handle files of any size
+    for rec in create_records_from_file(xmlfile_object, 0, 1):
+        nb_records += 1
+        if rec[1] == 0:
+            badrecords.append(rec[0])
+        if verbose and rec[2]:
+            errors.append(rec[2])
+    xmlfile_object.close()
+
+    if os.path.getsize(xmlfile) and not nb_records:
         print("[ERROR] No valid record detected.")
         sys.exit(1)
 
     if verbose:
-        if verbose <= 3:
-            errors.extend(map((lambda x: x[2]), listofrecs))
-        else:
+        if verbose > 3:
             s = print_recs(badrecords)
-            errors.extend(map((lambda x: x[2]), listofrecs))
     else:
         if badrecords:
             print(
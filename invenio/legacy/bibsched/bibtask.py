@@ -70,7 +70,8 @@ from invenio.config import CFG_PREFIX, \
                            CFG_TMPDIR, \
                            CFG_SITE_SUPPORT_EMAIL, \
                            CFG_VERSION, \
-                           CFG_BIBSCHED_FLUSH_LOGS
+                           CFG_BIBSCHED_FLUSH_LOGS, \
+                           CFG_BIBSCHED_BIBUPLOAD_LANES
 from invenio.ext.logging import register_exception
 
 from invenio.modules.access.local_config import CFG_EXTERNAL_AUTH_USING_SSO, \
@@ -81,13 +82,15 @@ from invenio.legacy.bibsched.bibtask_config import (
     CFG_BIBTASK_DEFAULT_TASK_SETTINGS,
     CFG_BIBTASK_FIXEDTIMETASKS,
     CFG_BIBTASK_DEFAULT_GLOBAL_TASK_SETTINGS,
+    CFG_BIBTASK_GLOBAL_PARAMS,
     CFG_BIBSCHED_LOGDIR,
     CFG_BIBTASK_LOG_FORMAT)
 from invenio.utils.date import parse_runtime_limit
 from invenio.utils.shell import escape_shell_arg
 from invenio.ext.email import send_email
 from invenio.legacy.bibsched.cli import bibsched_set_host, \
-                             bibsched_get_host
+                             bibsched_get_host, \
+                             bibsched_notify_queue_change
 
 
 # Global _TASK_PARAMS dictionary.
@@ -148,6 +151,28 @@ def get_sleeptime(argv):
     return sleeptime
 
 
+def get_submission_footprint(name, argv):
+    """Return the footprint of the task NAME about to be submitted with
+    the command line ARGV, or None if BibSched does not need it (see
+    CFG_BIBSCHED_BIBUPLOAD_LANES) or it cannot be computed."""
+    if name != 'bibupload' or CFG_BIBSCHED_BIBUPLOAD_LANES <= 1:
+        return None
+    try:
+        from invenio.legacy.bibupload.footprint import get_argv_footprint
+        return get_argv_footprint(argv)
+    except Exception:
+        register_exception()
+        return None
+
+
+def store_submission_footprint(task_id, footprint):
+    """Store the FOOTPRINT returned by get_submission_footprint() for the
+    newly submitted task TASK_ID."""
+    if footprint is not None:
+        from invenio.legacy.bibupload.footprint import store_task_footprint
+        store_task_footprint(task_id, footprint)
+
+
 def task_low_level_submission(name, user, *argv):
     """Let special lowlevel enqueuing of a task on the bibsche queue.
     @param name: is the name of the bibtask. It must be a valid executable under
@@ -297,6 +322,7 @@ def task_low_level_submission(name, user, *argv):
         sequenceid = get_sequenceid(argv)
         host = get_host(argv)
         argv = tuple([os.path.join(CFG_BINDIR, name)] + list(argv))
+        footprint = get_submission_footprint(name, argv)
 
         if special_name:
             name = '%s:%s' % (name, special_name)
@@ -309,6 +335,8 @@ def task_low_level_submission(name, user, *argv):
             VALUES (%s,%s,%s,%s,%s,'WAITING',%s,%s,%s,%s)""",
             (name, host, user, runtime, sleeptime, verbose_argv,
              marshal.dumps(argv), priority, sequenceid))
+        store_submission_footprint(task_id, footprint)
+        bibsched_notify_queue_change()
 
     except Exception:
         register_exception(alert_admin=True)
@@ -652,26 +680,9 @@ def _task_build_params(task_name,
     # set user-defined options:
     try:
         (short_params, long_params) = specific_params
-        opts, args = getopt.gnu_getopt(argv[1:], "hVv:u:s:t:P:N:L:I:" +
-            short_params, [
-                "help",
-                "version",
-                "verbose=",
-                "user=",
-                "sleep=",
-                "runtime=",
-                "priority=",
-                "name=",
-                "limit=",
-                "profile=",
-                "post-process=",
-                "sequence-id=",
-                "stop-on-error",
-                "continue-on-error",
-                "fixed-time",
-                "email-logs-to=",
-                "host=",
-            ] + long_params)
+        opts, args = getopt.gnu_getopt(argv[1:],
+            CFG_BIBTASK_GLOBAL_PARAMS[0] + short_params,
+            CFG_BIBTASK_GLOBAL_PARAMS[1] + long_params)
     except getopt.GetoptError as err:
         raise InvalidParams(err)
     try:
@@ -783,8 +794,10 @@ def task_update_status(val):
     """Updates status information in the BibSched task table."""
     write_message("Updating task status to %s." % val, verbose=9)
     if "task_id" in _TASK_PARAMS:
-        return run_sql("UPDATE schTASK SET status=%s where id=%s",
+        ret = run_sql("UPDATE schTASK SET status=%s where id=%s",
             (val, _TASK_PARAMS["task_id"]))
+        bibsched_notify_queue_change()
+        return ret
 
 def task_read_status():
     """Read status information in the BibSched task table."""
@@ -995,6 +1008,7 @@ def _task_submit(argv, authorization_action, authorization_msg):
         task_name = _TASK_PARAMS['task_name']
     write_message("storing task options %s\n" % argv, verbose=9)
     verbose_argv = 'Will execute: %s' % ' '.join([escape_shell_arg(str(arg)) for arg in argv])
+    footprint = get_submission_footprint(task_name, argv)
     _TASK_PARAMS['task_id'] = run_sql("""INSERT INTO schTASK (proc,user,
                                            runtime,sleeptime,status,progress,arguments,priority,sequenceid,host)
                                          VALUES (%s,%s,%s,%s,'WAITING',%s,%s,%s,%s,%s)""",
@@ -1002,6 +1016,8 @@ def _task_submit(argv, authorization_action, authorization_msg):
          _TASK_PARAMS["sleeptime"], verbose_argv[:255], marshal.dumps(argv),
          _TASK_PARAMS['priority'], _TASK_PARAMS['sequence-id'],
          _TASK_PARAMS['host']))
+    store_submission_footprint(_TASK_PARAMS['task_id'], footprint)
+    bibsched_notify_queue_change()
 
     ## update task number:
     write_message("Task #%d submitted." % _TASK_PARAMS['task_id'])
@@ -1131,6 +1147,7 @@ def _task_run(task_run_fnc):
                 ## Also postponing other dependent tasks.
                 run_sql("UPDATE schTASK SET runtime=%s, progress=%s WHERE sequenceid=%s AND status='WAITING'", (new_runtime, 'Postponed as task %s' % _TASK_PARAMS['task_id'], _TASK_PARAMS['sequence-id'])) # kwalitee: disable=sql
             run_sql("UPDATE schTASK SET runtime=%s, status='WAITING', progress=%s, host='' WHERE id=%s", (new_runtime, 'Postponed %d time(s)' % (postponed_times + 1), _TASK_PARAMS['task_id'])) # kwalitee: disable=sql
+            bibsched_notify_queue_change()
             write_message("Task #%d postponed because outside of runtime limit" % _TASK_PARAMS['task_id'])
             return True
 
@@ -1197,6 +1214,8 @@ def _task_run(task_run_fnc):
             write_message("Task #%d finished. [%s]" % (_TASK_PARAMS['task_id'], task_status))
         ## Removing the pid
         os.remove(pidfile_name)
+        ## Let BibSched know that the task is over (and maybe resubmitted)
+        bibsched_notify_queue_change()
 
     #Lets call the post-process tasklets
     if task_get_task_param("post-process"):
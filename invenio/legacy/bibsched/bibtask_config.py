@@ -49,6 +49,28 @@ CFG_BIBTASK_FIXEDTIMETASKS = ("oaiharvest", )
 # Task that should not be reinstatiated
 CFG_BIBTASK_NON_REPETITIVE_TASK = ('bibupload', )
 
+## Command line parameters accepted by any bibtask, in the same
+## (short_params, long_params) format as the specific_params of task_init
+CFG_BIBTASK_GLOBAL_PARAMS = ("hVv:u:s:t:P:N:L:I:", [
+    "help",
+    "version",
+    "verbose=",
+    "user=",
+    "sleep=",
+    "runtime=",
+    "priority=",
+    "name=",
+    "limit=",
+    "profile=",
+    "post-process=",
+    "sequence-id=",
+    "stop-on-error",
+    "continue-on-error",
+    "fixed-time",
+    "email-logs-to=",
+    "host=",
+])
+
 ## Default options for any bibtasks
 ## This is then overridden by each specific BibTask in
 ## CFG_BIBTASK_DEFAULT_TASK_SETTINGS
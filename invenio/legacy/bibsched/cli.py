@@ -42,6 +42,9 @@ from invenio.config import \
     CFG_PREFIX, \
     CFG_TMPSHAREDDIR, \
     CFG_BIBSCHED_REFRESHTIME, \
+    CFG_BIBSCHED_QUEUE_CHECK_INTERVAL, \
+    CFG_BIBSCHED_MAX_IDLE_TIME, \
+    CFG_BIBSCHED_BIBUPLOAD_LANES, \
     CFG_BINDIR, \
     CFG_LOGDIR, \
     CFG_RUNDIR, \
@@ -316,11 +319,14 @@ def bibsched_get_status(task_id):
 def bibsched_set_status(task_id, status, when_status_is=None):
     """Update the status of task_id."""
     if when_status_is is None:
-        return run_sql("UPDATE schTASK SET status=%s WHERE id=%s",
-                       (status, task_id))
+        ret = run_sql("UPDATE schTASK SET status=%s WHERE id=%s",
+                      (status, task_id))
     else:
-        return run_sql("UPDATE schTASK SET status=%s WHERE id=%s AND status=%s",
-                       (status, task_id, when_status_is))
+        ret = run_sql("UPDATE schTASK SET status=%s WHERE id=%s AND status=%s",
+                      (status, task_id, when_status_is))
+    if ret:
+        bibsched_notify_queue_change()
+    return ret
 
 
 def bibsched_set_progress(task_id, progress):
@@ -330,7 +336,9 @@ def bibsched_set_progress(task_id, progress):
 
 def bibsched_set_priority(task_id, priority):
     """Update the priority of task_id."""
-    return run_sql("UPDATE schTASK SET priority=%s WHERE id=%s", (priority, task_id))
+    ret = run_sql("UPDATE schTASK SET priority=%s WHERE id=%s", (priority, task_id))
+    bibsched_notify_queue_change()
+    return ret
 
 def bibsched_set_name(task_id, name):
     """Update the name of task_id."""
@@ -343,7 +351,48 @@ def bibsched_set_sleeptime(task_id, sleeptime):
 
 def bibsched_set_runtime(task_id, runtime):
     """Update the sleeptime of task_id."""
-    return run_sql("UPDATE schTASK SET runtime=%s WHERE id=%s", (runtime, task_id))
+    ret = run_sql("UPDATE schTASK SET runtime=%s WHERE id=%s", (runtime, task_id))
+    bibsched_notify_queue_change()
+    return ret
+
+
+def bibsched_notify_queue_change():
+    """Wake up BibSched, since the queue has changed.
+
+    To be called after submitting a task or changing its status,
+    priority or runtime.  BibSched, when idle, only watches the
+    queue_version counter in schSTATUS, which is incremented here.
+    """
+    if not run_sql('UPDATE schSTATUS SET value = value + 1 '
+                   'WHERE name = "queue_version"'):
+        run_sql('INSERT IGNORE INTO schSTATUS (name, value) '
+                'VALUES ("queue_version", "1")')
+
+
+def bibsched_get_queue_version():
+    """Return the current value of the queue_version counter."""
+    res = run_sql('SELECT value FROM schSTATUS WHERE name = "queue_version"')
+    if res:
+        return res[0][0]
+
+
+def bibsched_get_queue_latencies():
+    """Return the queue latency statistics of every BibSched node.
+
+    @return: dictionary of hostname -> dictionary with the number of
+        started tasks (count), the sum (total), the maximum (max) and
+        the last (last) of their delays, in seconds, between the
+        moment they were due and the moment they were started.
+    """
+    res = run_sql('SELECT name, value FROM schSTATUS WHERE name LIKE %s',
+                  ('queue_latency:%', ))
+    ret = {}
+    for name, value in res:
+        try:
+            ret[name.split(':', 1)[1]] = marshal.loads(value)
+        except (ValueError, EOFError, TypeError):
+            pass
+    return ret
 
 
 def bibsched_send_signal(task_id, sig):
@@ -437,6 +486,14 @@ class BibSched(object):
 
         self.allowed_task_types = CFG_BIBSCHED_NODE_TASKS.get(self.hostname, CFG_BIBTASK_VALID_TASKS)
 
+        ## Version of the queue the tasks lists were computed from
+        self.queue_version = None
+        self.last_crashed_tasks_check = time.time()
+        self.queue_latency = {'count': 0, 'total': 0.0, 'max': 0.0,
+                              'last': 0.0}
+        ## Footprints of the bibupload tasks (see bibupload lanes)
+        self.bibupload_footprints = {}
+
     def tie_task_to_host(self, task_id):
         """Sets the hostname of a task to the machine executing this script
         @return: True if the scheduling was successful, False otherwise,
@@ -478,6 +535,92 @@ class BibSched(object):
 
         return task1.proc != task2.proc
 
+    def is_bibupload_lane(self, task1, task2):
+        """Return True when the two tasks are bibuploads that may run
+        concurrently on different lanes (see CFG_BIBSCHED_BIBUPLOAD_LANES)."""
+        return CFG_BIBSCHED_BIBUPLOAD_LANES > 1 and \
+            task1.proc == task2.proc == 'bibupload'
+
+    def count_used_resources(self, task):
+        """Return the number of resources used on this node by the
+        active tasks, from the point of view of TASK.
+
+        All the bibuploads running on parallel lanes use a single
+        resource, which TASK shares if it is a bibupload too."""
+        used_resources = len(self.node_active_tasks)
+        if CFG_BIBSCHED_BIBUPLOAD_LANES > 1:
+            bibuploads = len([t for t in self.node_active_tasks
+                              if t.proc == 'bibupload'])
+            if bibuploads:
+                used_resources -= bibuploads
+                if task.proc != 'bibupload':
+                    used_resources += 1
+        return used_resources
+
+    def get_bibupload_footprint(self, task_id):
+        """Return the (cached) footprint of the bibupload task TASK_ID,
+        as stored when the task was submitted."""
+        if task_id not in self.bibupload_footprints:
+            from invenio.legacy.bibupload.footprint import get_task_footprint
+            footprint = get_task_footprint(task_id)
+            Log("Footprint of bibupload #%s: %s" % (task_id, footprint),
+                self.debug)
+            if footprint is None:
+                ## it may still be being stored
+                return None
+            self.bibupload_footprints[task_id] = footprint
+        return self.bibupload_footprints[task_id]
+
+    def calculate_bibupload_lanes(self):
+        """Return the bibupload tasks that may be started or woken up now.
+
+        Bibupload tasks that do not affect the same records may run
+        concurrently, up to CFG_BIBSCHED_BIBUPLOAD_LANES of them.  In
+        order to preserve the order of the uploads of every record, a
+        bibupload may not run while a bibupload submitted before it
+        and affecting some of the same records did not finish.  A
+        bibupload whose footprint is unknown runs alone, as in the
+        serial mode.  The footprints are computed when the tasks are
+        submitted, the input files are not read here.
+        """
+        tasks = Task.from_resultset(run_sql(
+            """SELECT id, proc, runtime, status, priority, host, sequenceid
+               FROM schTASK WHERE proc = 'bibupload'
+               AND (status IN ('RUNNING', 'CONTINUING', 'SCHEDULED',
+                               'ABOUT TO STOP', 'ABOUT TO SLEEP',
+                               'SLEEPING')
+                    OR (status = 'WAITING' AND runtime <= NOW()))
+               ORDER BY FIELD(status, 'SLEEPING', 'WAITING'), id ASC"""))
+        active_tasks = [t for t in tasks if t.status in ACTIVE_STATUS]
+        free_lanes = CFG_BIBSCHED_BIBUPLOAD_LANES - len(active_tasks)
+        ## records affected by the tasks coming first
+        busy_keys = set()
+        for task in active_tasks:
+            footprint = self.get_bibupload_footprint(task.id)
+            if footprint is None:
+                return ()
+            busy_keys |= footprint
+
+        runnable_tasks = []
+        for i, task in enumerate(t for t in tasks
+                                 if t.status not in ACTIVE_STATUS):
+            if len(runnable_tasks) >= free_lanes:
+                break
+            footprint = self.get_bibupload_footprint(task.id)
+            if footprint is None:
+                if not active_tasks and i == 0:
+                    runnable_tasks.append(task)
+                break
+            if not footprint & busy_keys:
+                runnable_tasks.append(task)
+            busy_keys |= footprint
+
+        ids = set(t.id for t in tasks)
+        for task_id in self.bibupload_footprints.keys():
+            if task_id not in ids:
+                del self.bibupload_footprints[task_id]
+        return tuple(runnable_tasks)
+
     def is_task_non_concurrent(self, task1, task2):
         for non_concurrent_tasks in CFG_BIBSCHED_NON_CONCURRENT_TASKS:
             if (task1.proc.split(':')[0] in non_concurrent_tasks
@@ -556,6 +699,8 @@ class BibSched(object):
             # check if we need to sleep ourselves for monotasks
             # to be able to run
             for t in self.mono_tasks_all_nodes:
+                if self.is_bibupload_lane(task, t):
+                    continue
                 # 2 cases here
                 # If a monotask is running, we want to sleep
                 # If a monotask is waiting, we want to sleep if our priority
@@ -641,6 +786,7 @@ class BibSched(object):
                         ## If there is a task with same sequence number then do not run the current task
                         return False
 
+            higher = [t for t in higher if not self.is_bibupload_lane(task, t)]
             if is_monotask(task.proc) and higher:
                 ## This is a monotask
                 Log("Cannot run because this is a monotask and there are higher priority tasks: %s" % (higher, ), debug)
@@ -648,6 +794,8 @@ class BibSched(object):
 
             ## Check for monotasks wanting to run
             for t in self.mono_tasks_all_nodes:
+                if self.is_bibupload_lane(task, t):
+                    continue
                 if task.priority < t.priority:
                     Log("Cannot run because there is a monotask with higher priority: %s %s" % (t.id, t.proc), debug)
                     return False
@@ -671,12 +819,19 @@ class BibSched(object):
 
             procname = task.proc.split(':')[0]
             if not tasks_to_stop and not tasks_to_sleep:
-                if is_monotask(task.proc) and self.active_tasks_all_nodes:
-                    Log("Cannot run because this is a monotask and there are other tasks running: %s" % (self.active_tasks_all_nodes, ), debug)
+                ## Bibuploads running on other lanes (which were checked
+                ## by calculate_bibupload_lanes()) do not prevent the task
+                ## from running, and all the lanes use a single resource.
+                other_active_tasks = [t for t in self.active_tasks_all_nodes
+                                      if not self.is_bibupload_lane(task, t)]
+                used_resources = self.count_used_resources(task)
+
+                if is_monotask(task.proc) and other_active_tasks:
+                    Log("Cannot run because this is a monotask and there are other tasks running: %s" % (other_active_tasks, ), debug)
                     return False
 
-                if task.proc not in CFG_BIBTASK_FIXEDTIMETASKS and len(self.node_active_tasks) >= CFG_BIBSCHED_MAX_NUMBER_CONCURRENT_TASKS:
-                    Log("Cannot run because all resources (%s) are used (%s), active: %s" % (CFG_BIBSCHED_MAX_NUMBER_CONCURRENT_TASKS, len(self.node_active_tasks), self.node_active_tasks), debug)
+                if task.proc not in CFG_BIBTASK_FIXEDTIMETASKS and used_resources >= CFG_BIBSCHED_MAX_NUMBER_CONCURRENT_TASKS:
+                    Log("Cannot run because all resources (%s) are used (%s), active: %s" % (CFG_BIBSCHED_MAX_NUMBER_CONCURRENT_TASKS, used_resources, self.node_active_tasks), debug)
                     return False
 
                 for t in self.waiting_tasks_all_nodes:
@@ -714,21 +869,22 @@ class BibSched(object):
                     command = "%s %s %s" % (program, str(task.id), exit_str)
                     ### Set the task to scheduled and tie it to this host
                     if self.tie_task_to_host(task.id):
-                        Log("Task #%d (%s) started" % (task.id, task.proc))
+                        latency = self.update_queue_latency(task)
+                        Log("Task #%d (%s) started (queue latency: %.1fs)"
+                            % (task.id, task.proc, latency))
                         ### Relief the lock for the BibTask, it is safe now to do so
                         spawn_task(command, wait=is_monotask(task.proc))
-                        count = 10
+                        deadline = time.time() + 10 * CFG_BIBSCHED_REFRESHTIME
                         while run_sql("""SELECT status FROM schTASK
                                          WHERE id=%s AND status='SCHEDULED'""",
                                       (task.id, )):
                             ## Polling to wait for the task to really start,
                             ## in order to avoid race conditions.
-                            if count <= 0:
+                            if time.time() > deadline:
                                 Log("Process %s (task_id: %s) was launched but seems not to be able to reach RUNNING status." % (task.proc, task.id))
                                 bibsched_set_status(task.id, "ERROR", "SCHEDULED")
                                 return True
-                            time.sleep(CFG_BIBSCHED_REFRESHTIME)
-                            count -= 1
+                            time.sleep(CFG_BIBSCHED_QUEUE_CHECK_INTERVAL)
                     return True
                 else:
                     raise StandardError("%s is not in the allowed modules" % procname)
@@ -754,6 +910,53 @@ class BibSched(object):
                     time.sleep(CFG_BIBSCHED_REFRESHTIME)
                 return changes
 
+    def update_queue_latency(self, task):
+        """Account for the queue latency of TASK, which is being started.
+
+        The queue latency is the delay between the moment the task was
+        due (its runtime) and now.  The statistics are stored in
+        schSTATUS, see bibsched_get_queue_latencies().
+        @return: the queue latency of TASK in seconds.
+        """
+        latency = 0.0
+        if isinstance(task.runtime, datetime.datetime):
+            delta = datetime.datetime.now() - task.runtime
+            latency = max(0.0, delta.days * 86400 + delta.seconds +
+                          delta.microseconds / 1000000.0)
+        stats = self.queue_latency
+        stats['count'] += 1
+        stats['total'] += latency
+        stats['max'] = max(stats['max'], latency)
+        stats['last'] = latency
+        run_sql('REPLACE INTO schSTATUS (name, value) VALUES (%s, %s)',
+                (('queue_latency:%s' % self.hostname)[:50],
+                 marshal.dumps(stats)))
+        return latency
+
+    def wait_for_queue_change(self):
+        """Sleep until the queue changes or the next task is due.
+
+        Instead of recomputing the tasks lists every
+        CFG_BIBSCHED_REFRESHTIME seconds, only the queue_version counter
+        (see bibsched_notify_queue_change()) is checked every
+        CFG_BIBSCHED_QUEUE_CHECK_INTERVAL seconds.  As a safety net,
+        e.g. for tasks updated by hand in the database, BibSched never
+        sleeps more than CFG_BIBSCHED_MAX_IDLE_TIME seconds.
+        """
+        timeout = CFG_BIBSCHED_MAX_IDLE_TIME
+        next_runtime = run_sql("""SELECT TIMESTAMPDIFF(SECOND, NOW(), MIN(runtime))
+                                  FROM schTASK WHERE status = 'WAITING'
+                                  AND runtime > NOW()""")[0][0]
+        if next_runtime is not None:
+            timeout = min(timeout, max(next_runtime, 1))
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if bibsched_get_queue_version() != self.queue_version:
+                Log("Queue changed, waking up", self.debug)
+                return
+            time.sleep(max(0, min(CFG_BIBSCHED_QUEUE_CHECK_INTERVAL,
+                                  deadline - time.time())))
+
     def check_errors(self):
         errors = run_sql("""SELECT id,proc,status FROM schTASK
                             WHERE status = 'ERROR'
@@ -807,13 +1010,17 @@ class BibSched(object):
 
         # The bibupload tasks are sorted by id,
         # which means by the order they were scheduled
-        self.node_relevant_bibupload_tasks = Task.from_resultset(run_sql(
-            """SELECT id, proc, runtime, status, priority, host, sequenceid
-               FROM schTASK WHERE status IN ('WAITING', 'SLEEPING')
-               AND proc = 'bibupload'
-               AND runtime <= NOW()
-               ORDER BY FIELD(status, 'SLEEPING', 'WAITING'),
-                        id ASC LIMIT 1""", n=1))
+        if CFG_BIBSCHED_BIBUPLOAD_LANES > 1:
+            self.node_relevant_bibupload_tasks = \
+                self.calculate_bibupload_lanes()
+        else:
+            self.node_relevant_bibupload_tasks = Task.from_resultset(run_sql(
+                """SELECT id, proc, runtime, status, priority, host, sequenceid
+                   FROM schTASK WHERE status IN ('WAITING', 'SLEEPING')
+                   AND proc = 'bibupload'
+                   AND runtime <= NOW()
+                   ORDER BY FIELD(status, 'SLEEPING', 'WAITING'),
+                            id ASC LIMIT 1""", n=1))
         ## The other tasks are sorted by priority
         self.waiting_tasks_all_nodes = Task.from_resultset(run_sql(
             """SELECT id, proc, runtime, status, priority, host, sequenceid
@@ -880,6 +1087,11 @@ class BibSched(object):
                            WHERE id = %%s AND status IN (%s)"""
                                  % ','.join("'%s'" % s for s in ACTIVE_STATUS),
                         [task.id])
+                if task.proc == 'bibupload':
+                    ## the task could not remove its footprint itself
+                    from invenio.legacy.bibupload.footprint import \
+                        remove_task_footprint
+                    remove_task_footprint(task.id)
 
     def check_debug_mode(self):
         debug_mode = fetch_debug_mode()
@@ -896,7 +1108,11 @@ class BibSched(object):
 
         self.check_debug_mode()
 
-        if self.cycles_count % 50 == 0:
+        ## Tasks are not checked every 50 cycles anymore, since BibSched
+        ## may now sleep for a long time between two cycles.
+        if time.time() - self.last_crashed_tasks_check > \
+                50 * CFG_BIBSCHED_REFRESHTIME:
+            self.last_crashed_tasks_check = time.time()
             self.check_for_crashed_tasks()
 
         try:
@@ -906,6 +1122,9 @@ class BibSched(object):
                                                          % (CFG_SITE_URL, msg))
 
         # Update our tasks list (to know who is running, sleeping, etc.)
+        # The queue version is read first, so that any change happening
+        # while computing the lists will wake us up.
+        self.queue_version = bibsched_get_queue_version()
         self.calculate_rows()
 
         # Let's first handle running tasks running on this node.
@@ -916,6 +1135,15 @@ class BibSched(object):
             # If nothing has changed we can go on to run tasks.
             for task in self.node_relevant_waiting_tasks:
                 if task.proc == 'bibupload' \
+                   and CFG_BIBSCHED_BIBUPLOAD_LANES > 1:
+                    ## We run bibuploads on parallel lanes, which means
+                    ## we execute the bibuploads that do not conflict
+                    ## with the ones coming before them.
+                    if task in self.node_relevant_bibupload_tasks \
+                       and self.handle_task(task):
+                        ## Something has changed
+                        break
+                elif task.proc == 'bibupload' \
                    and self.node_relevant_bibupload_tasks:
                     ## We switch in bibupload serial mode!
                     ## which means we execute the first next bibupload.
@@ -926,7 +1154,7 @@ class BibSched(object):
                     ## Something has changed
                     break
             else:
-                time.sleep(CFG_BIBSCHED_REFRESHTIME)
+                self.wait_for_queue_change()
 
     def watch_loop(self):
         ## Cleaning up scheduled task not run because of bibsched being
@@ -1203,7 +1431,8 @@ def report_queue_status(verbose=True, status=None, since=None, tasks=None): # py
     daemon_status = server_pid() and "UP" or "DOWN"
     write_message("BibSched daemon status: %s" % daemon_status)
 
-    if run_sql("show tables like 'schSTATUS'"):
+    has_status_table = bool(run_sql("show tables like 'schSTATUS'"))
+    if has_status_table:
         r = run_sql('SELECT value FROM schSTATUS WHERE name = "auto_mode"')
         try:
             mode = bool(int(r[0][0]))
@@ -1214,6 +1443,14 @@ def report_queue_status(verbose=True, status=None, since=None, tasks=None): # py
 
     mode_str = mode and 'AUTOMATIC' or 'MANUAL'
     write_message("BibSched queue running mode: %s" % mode_str)
+    if has_status_table:
+        for host, stats in sorted(bibsched_get_queue_latencies().items()):
+            if stats['count']:
+                write_message("BibSched queue latency on %s: last %.1fs, "
+                              "average %.1fs, max %.1fs (%d tasks)"
+                              % (host, stats['last'],
+                                 stats['total'] / stats['count'],
+                                 stats['max'], stats['count']))
     if status is None:
         report_about_processes('Running', since, tasks)
         report_about_processes('Waiting', since, tasks)
@@ -32,5 +32,23 @@ CFG_BIBUPLOAD_DELETE_CODE = '0'
 
 CFG_BIBUPLOAD_DELETE_VALUE = "__DELETE_FIELDS__"
 
+## Command line parameters specific to bibupload (see task_init)
+CFG_BIBUPLOAD_TASK_PARAMS = ("ircazdnoS:", [
+    "insert",
+    "replace",
+    "correct",
+    "append",
+    "reference",
+    "delete",
+    "notimechange",
+    "holdingpen",
+    "pretend",
+    "force",
+    "callback-url=",
+    "nonce=",
+    "special-treatment=",
+    "stage=",
+])
+
 CFG_BIBUPLOAD_OPT_MODES = ['insert', 'replace', 'replace_or_insert', 'reference',
         'correct', 'append', 'holdingpen', 'delete']
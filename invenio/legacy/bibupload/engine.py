@@ -31,6 +31,7 @@ import re
 import sys
 import time
 from datetime import datetime
+from itertools import islice
 from six import iteritems
 from zlib import compress
 import socket
@@ -56,16 +57,21 @@ from invenio.config import CFG_OAI_ID_FIELD, \
      CFG_BIBUPLOAD_DISABLE_RECORD_REVISIONS, \
      CFG_BIBUPLOAD_CONFLICTING_REVISION_TICKET_QUEUE, \
      CFG_CERN_SITE, \
-     CFG_BIBUPLOAD_MATCH_DELETED_RECORDS
+     CFG_BIBUPLOAD_MATCH_DELETED_RECORDS, \
+     CFG_BIBSCHED_BIBUPLOAD_LANES
 
 from invenio.utils.json import json, CFG_JSON_AVAILABLE
 from invenio.legacy.bibupload.config import CFG_BIBUPLOAD_CONTROLFIELD_TAGS, \
     CFG_BIBUPLOAD_SPECIAL_TAGS, \
     CFG_BIBUPLOAD_DELETE_CODE, \
     CFG_BIBUPLOAD_DELETE_VALUE, \
-    CFG_BIBUPLOAD_OPT_MODES
+    CFG_BIBUPLOAD_OPT_MODES, \
+    CFG_BIBUPLOAD_TASK_PARAMS
+from invenio.legacy.bibupload.footprint import remove_task_footprint
 from invenio.legacy.dbquery import run_sql
 from invenio.legacy.bibrecord import create_records, \
+                              create_records_from_file, \
+                              split_records_from_file, \
                               record_add_field, \
                               record_delete_field, \
                               record_xml_output, \
@@ -820,12 +826,10 @@ def print_out_bibupload_statistics():
     write_message(out)
 
 def open_marc_file(path):
-    """Open a file and return the data"""
+    """Open a file and return the file object to read the data from"""
     try:
         # open the file containing the marc document
         marc_file = open(path, 'r')
-        marc = marc_file.read()
-        marc_file.close()
     except IOError as erro:
         write_message("ERROR: %s" % erro, verbose=1, stream=sys.stderr)
         if erro.errno == 2:
@@ -835,12 +839,46 @@ def open_marc_file(path):
         else:
             e = StandardError('File not accessible: %s' % path)
         raise e
-    return marc
+    return marc_file
+
+class MarcFileRecords(object):
+    """Records of a MARCXML file, created lazily while they are iterated
+    over, so that files of any size can be uploaded in constant memory.
+
+    Every iteration parses the file again, so the records should be
+    iterated over only once."""
+
+    def __init__(self, marc_file):
+        self.marc_file = marc_file
+        self._len = None
+
+    def __iter__(self):
+        self.marc_file.seek(0)
+        for rec in create_records_from_file(self.marc_file, 1, 1):
+            yield rec[0]
+
+    def __len__(self):
+        if self._len is None:
+            # only split the file, the records are not parsed
+            self.marc_file.seek(0)
+            self._len = sum(1 for dummy in
+                            split_records_from_file(self.marc_file))
+        return self._len
 
 def xml_marc_to_records(xml_marc):
-    """create the records"""
+    """create the records
+
+    XML_MARC is either the MARCXML string, in which case the list of
+    records is returned, or the MARCXML file object, in which case the
+    records are read from the file as they are iterated over.
+    """
     # Creation of the records from the xml Marc in argument
-    recs = create_records(xml_marc, 1, 1)
+    if isinstance(xml_marc, basestring):
+        recs = create_records(xml_marc, 1, 1)
+    else:
+        recs = create_records_from_file(xml_marc, 1, 1)
+        # only check the first record, the others are parsed when needed
+        recs = list(islice(recs, 1))
     if recs == []:
         msg = "ERROR: Cannot parse MARCXML file."
         write_message(msg, verbose=1, stream=sys.stderr)
@@ -849,6 +887,8 @@ def xml_marc_to_records(xml_marc):
         msg = "ERROR: MARCXML file has wrong format: %s" % recs
         write_message(msg, verbose=1, stream=sys.stderr)
         raise RecoverableError(msg)
+    elif not isinstance(xml_marc, basestring):
+        return MarcFileRecords(xml_marc)
     else:
         recs = map((lambda x:x[0]), recs)
         return recs
@@ -1297,16 +1337,12 @@ def insert_bibfmt(id_bibrec, marc, bibformat, modification_date='1970-01-01 00:0
     else:
         return 1
 
-def insert_record_bibxxx(tag, value, pretend=False):
-    """Insert the record into bibxxx"""
-    # determine into which table one should insert the record
-    table_name = 'bib'+tag[0:2]+'x'
-
-    # check if the tag, value combination exists in the table
+def find_record_bibxxx(table_name, tag, value):
+    """Return the id of the tag, value combination in the bibxxx table
+    TABLE_NAME, or None if it is not there."""
     query = """SELECT id,value FROM %s """ % table_name
     query += """ WHERE tag=%s AND value=%s"""
     params = (tag, value)
-    res = None
     res = run_sql(query, params)
 
     # Note: compare now the found values one by one and look for
@@ -1317,12 +1353,22 @@ def insert_record_bibxxx(tag, value, pretend=False):
     # etc; this approach checks all matched values in Python, not in
     # MySQL, which is less cool, but more conservative, so it should
     # work better on most setups.
-    if res:
-        for row in res:
-            row_id = row[0]
-            row_value = row[1]
-            if row_value == value:
-                return (table_name, row_id)
+    for row_id, row_value in res:
+        if row_value == value:
+            return row_id
+    return None
+
+def insert_record_bibxxx(tag, value, pretend=False):
+    """Insert the record into bibxxx"""
+    # determine into which table one should insert the record
+    table_name = 'bib'+tag[0:2]+'x'
+
+    # check if the tag, value combination exists in the table
+    row_id = find_record_bibxxx(table_name, tag, value)
+    if row_id is not None:
+        return (table_name, row_id)
+    if pretend:
+        return (table_name, 1)
 
     # We got here only when the tag, value combination was not found,
     # so it is now necessary to insert the tag, value combination into
@@ -1330,10 +1376,21 @@ def insert_record_bibxxx(tag, value, pretend=False):
     query = """INSERT INTO %s """ % table_name
     query += """ (tag, value) values (%s , %s)"""
     params = (tag, value)
-    if not pretend:
-        row_id = run_sql(query, params)
-    else:
-        return (table_name, 1)
+    if CFG_BIBSCHED_BIBUPLOAD_LANES <= 1:
+        return (table_name, run_sql(query, params))
+
+    # Bibuploads running on parallel lanes may insert the same tag,
+    # value combination at the same time, and the table has no unique
+    # key to prevent it: the check and the insertion must be atomic.
+    lock_name = 'bibupload_%s' % table_name
+    if not run_sql("SELECT GET_LOCK(%s, 60)", (lock_name, ))[0][0]:
+        raise StandardError("Could not get the %s lock" % lock_name)
+    try:
+        row_id = find_record_bibxxx(table_name, tag, value)
+        if row_id is None:
+            row_id = run_sql(query, params)
+    finally:
+        run_sql("SELECT RELEASE_LOCK(%s)", (lock_name, ))
     return (table_name, row_id)
 
 def insert_record_bibrec_bibxxx(table_name, id_bibxxx,
@@ -2679,23 +2736,7 @@ Examples:
 \t\t\tinside a form field called "results".
 """,
             version=__revision__,
-            specific_params=("ircazdnoS:",
-                 [
-                   "insert",
-                   "replace",
-                   "correct",
-                   "append",
-                   "reference",
-                   "delete",
-                   "notimechange",
-                   "holdingpen",
-                   "pretend",
-                   "force",
-                   "callback-url=",
-                   "nonce=",
-                   "special-treatment=",
-                   "stage=",
-                 ]),
+            specific_params=CFG_BIBUPLOAD_TASK_PARAMS,
             task_submit_elaborate_specific_parameter_fnc=task_submit_elaborate_specific_parameter,
             task_run_fnc=task_run_core,
             task_submit_check_options_fnc=task_submit_check_options)
@@ -2892,6 +2933,10 @@ def bibupload_records(records, opt_mode=None, opt_notimechange=0,
         ## NOTE: reference mode has been deprecated in favour of 'correct'
         opt_mode = 'correct'
 
+    # The records that need the second phase, as modified by the first one.
+    # Records read from a file are parsed only once, so they are kept here.
+    post_phase_records = []
+
     record = None
     for record in records:
         record_id = record_extract_oai_id(record)
@@ -2911,6 +2956,10 @@ def bibupload_records(records, opt_mode=None, opt_notimechange=0,
                 tmp_ids = tmp_ids,
                 tmp_vers = tmp_vers)
             results.append(error)
+            if record is not None and \
+                    (extract_tag_from_record(record, "BDR") is not None or
+                     extract_tag_from_record(record, "BDM") is not None):
+                post_phase_records.append(record)
             if error[0] == 1:
                 if record:
                     write_message(lambda: record_xml_output(record),
@@ -2948,7 +2997,7 @@ def bibupload_records(records, opt_mode=None, opt_notimechange=0,
     write_message("Identifiers table after processing: %s  versions: %s" % (str(tmp_ids), str(tmp_vers)), verbose=2)
     write_message("Uploading BDR and BDM fields")
     if opt_mode != "holdingpen":
-        for record in records:
+        for record in post_phase_records:
             record_id = retrieve_rec_id(record, opt_mode, pretend=pretend, post_phase = True)
             bibupload_post_phase(record,
                                  rec_id = record_id,
@@ -2962,41 +3011,50 @@ def bibupload_records(records, opt_mode=None, opt_notimechange=0,
 
 def task_run_core():
     """ Reimplement to add the body of the task."""
-    write_message("Input file '%s', input mode '%s'." %
-            (task_get_option('file_path'), task_get_option('mode')))
-    write_message("STAGE 0:", verbose=2)
-
-    if task_get_option('file_path') is not None:
-        write_message("start preocessing", verbose=3)
-        task_update_progress("Reading XML input")
-        recs = xml_marc_to_records(open_marc_file(task_get_option('file_path')))
-        stat['nb_records_to_upload'] = len(recs)
-        write_message("   -Open XML marc: DONE", verbose=2)
-        task_sleep_now_if_required(can_stop_too=True)
-        write_message("Entering records loop", verbose=3)
-        callback_url = task_get_option('callback_url')
-        results_for_callback = {'results': []}
-
-        if recs is not None:
-            # We proceed each record by record
-            bibupload_records(records=recs, opt_mode=task_get_option('mode'),
-                              opt_notimechange=task_get_option('notimechange'),
-                              pretend=task_get_option('pretend'),
-                              callback_url=callback_url,
-                              results_for_callback=results_for_callback)
-        else:
-            write_message("   ERROR: bibupload failed: No record found",
-                        verbose=1, stream=sys.stderr)
-        callback_url = task_get_option("callback_url")
-        if callback_url:
-            nonce = task_get_option("nonce")
-            if nonce:
-                results_for_callback["nonce"] = nonce
-            post_results_to_callback_url(results_for_callback, callback_url)
-
-    if task_get_task_param('verbose') >= 1:
-        # Print out the statistics
-        print_out_bibupload_statistics()
+    try:
+        write_message("Input file '%s', input mode '%s'." %
+                (task_get_option('file_path'), task_get_option('mode')))
+        write_message("STAGE 0:", verbose=2)
+
+        if task_get_option('file_path') is not None:
+            write_message("start preocessing", verbose=3)
+            task_update_progress("Reading XML input")
+            marc_file = open_marc_file(task_get_option('file_path'))
+            try:
+                recs = xml_marc_to_records(marc_file)
+                stat['nb_records_to_upload'] = len(recs)
+                write_message("   -Open XML marc: DONE", verbose=2)
+                task_sleep_now_if_required(can_stop_too=True)
+                write_message("Entering records loop", verbose=3)
+                callback_url = task_get_option('callback_url')
+                results_for_callback = {'results': []}
+
+                if recs is not None:
+                    # We proceed each record by record
+                    bibupload_records(records=recs, opt_mode=task_get_option('mode'),
+                                      opt_notimechange=task_get_option('notimechange'),
+                                      pretend=task_get_option('pretend'),
+                                      callback_url=callback_url,
+                                      results_for_callback=results_for_callback)
+                else:
+                    write_message("   ERROR: bibupload failed: No record found",
+                                verbose=1, stream=sys.stderr)
+            finally:
+                marc_file.close()
+            callback_url = task_get_option("callback_url")
+            if callback_url:
+                nonce = task_get_option("nonce")
+                if nonce:
+                    results_for_callback["nonce"] = nonce
+                post_results_to_callback_url(results_for_callback, callback_url)
+
+        if task_get_task_param('verbose') >= 1:
+            # Print out the statistics
+            print_out_bibupload_statistics()
+    finally:
+        # BibSched does not need the footprint of the task any longer,
+        # whether it succeeded or not
+        remove_task_footprint(task_get_task_param('task_id'))
 
     # Check if they were errors
     return not stat['nb_errors'] >= 1
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Footprint of BibUpload tasks, i.e. the records they affect.
+
+The footprint of a task is the set of keys (such as 'recid:12' or
+'extoaiid:oai:arXiv.org:1234.5678') identifying the records of its
+input file.  Two BibUpload tasks with disjoint footprints cannot
+modify the same record, hence BibSched may run them concurrently (see
+CFG_BIBSCHED_BIBUPLOAD_LANES).  Records without any identifier are new
+records and do not appear in the footprint.
+
+The footprint is computed when the task is submitted and stored in a
+file of CFG_BIBUPLOAD_FOOTPRINT_DIR, where BibSched reads it.  Input
+files bigger than CFG_BIBSCHED_BIBUPLOAD_LANES_MAX_FILE_SIZE are not
+read, their tasks having no footprint.
+"""
+
+import getopt
+import marshal
+import os
+
+from invenio.config import CFG_OAI_ID_FIELD, \
+     CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG, \
+     CFG_BIBUPLOAD_EXTERNAL_OAIID_TAG, \
+     CFG_TMPSHAREDDIR, \
+     CFG_BIBSCHED_BIBUPLOAD_LANES_MAX_FILE_SIZE
+from invenio.legacy.bibrecord import create_records_from_file, \
+     record_get_field_values, record_extract_dois
+from invenio.legacy.bibsched.bibtask_config import CFG_BIBTASK_GLOBAL_PARAMS
+from invenio.legacy.bibupload.config import CFG_BIBUPLOAD_TASK_PARAMS
+
+## (key prefix, MARC tag) of the external identifiers bibupload matches
+## records with
+CFG_BIBUPLOAD_FOOTPRINT_TAGS = (
+    ('sysno', CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG),
+    ('extoaiid', CFG_BIBUPLOAD_EXTERNAL_OAIID_TAG),
+    ('oaiid', CFG_OAI_ID_FIELD),
+)
+
+## directory of the footprints of the submitted tasks, shared by all the
+## BibSched nodes
+CFG_BIBUPLOAD_FOOTPRINT_DIR = os.path.join(CFG_TMPSHAREDDIR,
+                                           'bibupload_footprints')
+
+
+def get_bibupload_mode_and_file(argv):
+    """Return the mode and the input file of a bibupload command line.
+
+    @param argv: the arguments of the task, as stored in schTASK.
+    @return: (mode, file_path), each of them possibly None.
+    @raise getopt.GetoptError: if ARGV is not a valid command line.
+    """
+    opts, args = getopt.gnu_getopt(
+        argv[1:],
+        CFG_BIBTASK_GLOBAL_PARAMS[0] + CFG_BIBUPLOAD_TASK_PARAMS[0],
+        CFG_BIBTASK_GLOBAL_PARAMS[1] + CFG_BIBUPLOAD_TASK_PARAMS[1])
+    mode = None
+    for key, dummy_value in opts:
+        if key in ("-i", "--insert"):
+            mode = mode == 'replace' and 'replace_or_insert' or 'insert'
+        elif key in ("-r", "--replace"):
+            mode = mode == 'insert' and 'replace_or_insert' or 'replace'
+        elif key in ("-o", "--holdingpen"):
+            mode = 'holdingpen'
+        elif key in ("-c", "--correct", "-z", "--reference"):
+            mode = 'correct'
+        elif key in ("-a", "--append"):
+            mode = 'append'
+        elif key in ("-d", "--delete"):
+            mode = 'delete'
+    return mode, args and args[0] or None
+
+
+def get_record_footprint(record, opt_mode):
+    """Return the set of keys identifying RECORD.
+
+    Besides its identifiers, records without 001 that bibupload would
+    match to an existing record are identified by the record ID found.
+    """
+    recids = record_get_field_values(record, '001')
+    footprint = set('recid:%s' % recid for recid in recids)
+    for prefix, tag in CFG_BIBUPLOAD_FOOTPRINT_TAGS:
+        for value in record_get_field_values(record, tag[0:3],
+                                             tag[3:4] != "_" and tag[3:4] or "",
+                                             tag[4:5] != "_" and tag[4:5] or "",
+                                             tag[5:6]):
+            footprint.add('%s:%s' % (prefix, value))
+    for doi in record_extract_dois(record):
+        footprint.add('doi:%s' % doi.lower())
+    if footprint and not recids and \
+            opt_mode not in ('insert', 'holdingpen'):
+        from invenio.legacy.bibupload.engine import retrieve_rec_id
+        recid = retrieve_rec_id(record, opt_mode, pretend=True)
+        if recid and recid > 0:
+            footprint.add('recid:%s' % recid)
+    return footprint
+
+
+def get_file_footprint(file_path, opt_mode):
+    """Return the footprint of the records of the MARCXML file FILE_PATH."""
+    footprint = set()
+    marcxml_file = open(file_path)
+    try:
+        for record in create_records_from_file(marcxml_file):
+            if record[0]:
+                footprint |= get_record_footprint(record[0], opt_mode)
+    finally:
+        marcxml_file.close()
+    return frozenset(footprint)
+
+
+def get_argv_footprint(argv):
+    """Return the footprint of the bibupload command line ARGV.
+
+    @return: a frozenset of keys, or None if the footprint could not be
+        computed (e.g. unreadable or too big input file), in which case
+        the task should be assumed to affect any record.
+    """
+    try:
+        opt_mode, file_path = get_bibupload_mode_and_file(argv)
+        if opt_mode is None or file_path is None:
+            return None
+        if os.path.getsize(file_path) > \
+                CFG_BIBSCHED_BIBUPLOAD_LANES_MAX_FILE_SIZE:
+            return None
+        return get_file_footprint(file_path, opt_mode)
+    except (OSError, IOError, getopt.GetoptError):
+        return None
+
+
+def get_footprint_path(task_id):
+    """Return the path of the file storing the footprint of TASK_ID."""
+    return os.path.join(CFG_BIBUPLOAD_FOOTPRINT_DIR, 'task_%s' % task_id)
+
+
+def store_task_footprint(task_id, footprint):
+    """Store FOOTPRINT, as returned by get_argv_footprint(), as the
+    footprint of the bibupload task TASK_ID."""
+    if footprint is None:
+        return
+    if not os.path.isdir(CFG_BIBUPLOAD_FOOTPRINT_DIR):
+        try:
+            os.makedirs(CFG_BIBUPLOAD_FOOTPRINT_DIR)
+        except OSError:
+            ## created in the meantime by another process
+            pass
+    path = get_footprint_path(task_id)
+    ## BibSched must never read a partially written footprint
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    tmp_file = open(tmp_path, 'wb')
+    try:
+        marshal.dump(sorted(footprint), tmp_file)
+    finally:
+        tmp_file.close()
+    os.rename(tmp_path, path)
+
+
+def get_task_footprint(task_id):
+    """Return the stored footprint of the bibupload task TASK_ID.
+
+    @return: a frozenset of keys, or None if the footprint is not known
+        (e.g. the task was submitted without lanes or the footprint is
+        still being computed), in which case the task should be assumed
+        to affect any record.
+    """
+    try:
+        footprint_file = open(get_footprint_path(task_id), 'rb')
+    except IOError:
+        return None
+    try:
+        return frozenset(marshal.load(footprint_file))
+    except (TypeError, ValueError, EOFError):
+        return None
+    finally:
+        footprint_file.close()
+
+
+def remove_task_footprint(task_id):
+    """Remove the stored footprint of the bibupload task TASK_ID."""
+    try:
+        os.remove(get_footprint_path(task_id))
+    except OSError:
+        pass
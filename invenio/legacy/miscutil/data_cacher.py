@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 ## This file is part of Invenio.
-## Copyright (C) 2007, 2008, 2009, 2010, 2011 CERN.
+## Copyright (C) 2007, 2008, 2009, 2010, 2011, 2014 CERN.
 ##
 ## Invenio is free software; you can redistribute it and/or
 ## modify it under the terms of the GNU General Public License as
@@ -20,15 +20,137 @@
 """
 Tool for caching important infos, which are slow to rebuild, but that
 rarely change.
+
+Caches may be shared between processes as snapshots (see
+CFG_DATACACHER_SNAPSHOT_STORE): the first process noticing that a
+cache is out of date rebuilds it and stores it, together with its
+timestamp, in the snapshot store; the other processes load the
+snapshot instead of rebuilding the cache themselves.  Snapshots are
+pickled, hence intbitsets are serialized with their fastdump().
 """
 
-from invenio.legacy.dbquery import run_sql, get_table_update_time
+import fcntl
+import os
+import tempfile
 import time
+import uuid
+from contextlib import contextmanager
+
+from six.moves import cPickle
+
+from invenio.config import CFG_CACHEDIR, CFG_DATACACHER_CHECK_INTERVAL, \
+    CFG_DATACACHER_SNAPSHOT_STORE
+from invenio.legacy.dbquery import run_sql, get_table_update_time
+from invenio.utils.redis import get_redis, DummyRedisClient
 
 class InvenioDataCacherError(Exception):
     """Error raised by data cacher."""
     pass
 
+class FileSnapshotStore(object):
+    """Snapshots stored as files in CFG_CACHEDIR/datacacher."""
+
+    def __init__(self, cache_dir=os.path.join(CFG_CACHEDIR, 'datacacher')):
+        self.cache_dir = cache_dir
+
+    def load(self, name):
+        """Return the snapshot NAME, or None if it does not exist."""
+        try:
+            return cPickle.load(open(os.path.join(self.cache_dir, name)))
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return None
+
+    def dump(self, name, snapshot):
+        """Store SNAPSHOT under NAME, replacing the former one atomically."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir,
+                                        prefix='%s.' % name)
+        try:
+            snapshot_file = os.fdopen(fd, 'w')
+            try:
+                cPickle.dump(snapshot, snapshot_file, -1)
+            finally:
+                snapshot_file.close()
+            os.rename(tmp_path, os.path.join(self.cache_dir, name))
+        except:
+            os.remove(tmp_path)
+            raise
+
+    @contextmanager
+    def lock(self, name):
+        """Prevent other processes from rebuilding the snapshot NAME."""
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        lock_file = open(os.path.join(self.cache_dir, '%s.lock' % name), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+        finally:
+            lock_file.close()
+
+class RedisSnapshotStore(object):
+    """Snapshots stored in the default Redis namespace."""
+
+    snapshot_key = 'datacacher::%s'
+    lock_key = 'datacacher_lock::%s'
+    # time after which the lock of a process that died is released:
+    lock_timeout = 300
+
+    def __init__(self, redis=None):
+        self.redis = redis or get_redis()
+
+    def load(self, name):
+        """Return the snapshot NAME, or None if it does not exist."""
+        value = self.redis.get(self.snapshot_key % name)
+        if value is None:
+            return None
+        return cPickle.loads(value)
+
+    def dump(self, name, snapshot):
+        """Store SNAPSHOT under NAME."""
+        self.redis.set(self.snapshot_key % name, cPickle.dumps(snapshot, -1))
+
+    @contextmanager
+    def lock(self, name):
+        """Prevent other processes from rebuilding the snapshot NAME.
+
+        The lock expires after lock_timeout seconds, in case its process
+        died; a process waiting for it longer than that rebuilds the
+        snapshot without the lock.
+        """
+        key = self.lock_key % name
+        token = uuid.uuid4().hex
+        deadline = time.time() + self.lock_timeout
+        locked = self.redis.set(key, token, nx=True, ex=self.lock_timeout)
+        while not locked and time.time() < deadline:
+            time.sleep(0.1)
+            locked = self.redis.set(key, token, nx=True, ex=self.lock_timeout)
+        try:
+            yield
+        finally:
+            # our lock may have expired and been taken by another process
+            if locked and self.redis.get(key) == token:
+                self.redis.delete(key)
+
+CFG_DATACACHER_SNAPSHOT_STORES = {
+    'file': FileSnapshotStore,
+    'redis': RedisSnapshotStore,
+}
+
+_SNAPSHOT_STORE = []
+
+def get_snapshot_store():
+    """Return the store configured by CFG_DATACACHER_SNAPSHOT_STORE,
+    or None if caches are not shared.  The 'redis' store falls back to
+    the 'file' store when no Redis host is configured."""
+    if not CFG_DATACACHER_SNAPSHOT_STORE:
+        return None
+    if not _SNAPSHOT_STORE:
+        store = CFG_DATACACHER_SNAPSHOT_STORE
+        if store == 'redis' and isinstance(get_redis(), DummyRedisClient):
+            store = 'file'
+        _SNAPSHOT_STORE.append(CFG_DATACACHER_SNAPSHOT_STORES[store]())
+    return _SNAPSHOT_STORE[0]
+
 class DataCacher(object):
     """
     DataCacher is an abstract cacher system, for caching informations
@@ -39,10 +161,24 @@ class DataCacher(object):
     use cases use a dict internal structure for .cache, but some use
     lists.
     """
-    def __init__(self, cache_filler, timestamp_verifier):
+
+    # Set to True to date the cache from before it is filled, so that
+    # changes happening meanwhile, even in the same second, cause the
+    # cache to be recreated (possibly once more than needed).
+    timestamp_before_fill = False
+
+    def __init__(self, cache_filler, timestamp_verifier, check_interval=None,
+                 snapshot_name=None):
         """ @param cache_filler: a function that fills the cache dictionary.
             @param timestamp_verifier: a function that returns a timestamp for
                    checking if something has changed after cache creation.
+            @param check_interval: minimal number of seconds between two
+                   calls of timestamp_verifier, CFG_DATACACHER_CHECK_INTERVAL
+                   by default.
+            @param snapshot_name: unique name under which the cache is
+                   shared with the other processes, if snapshots are
+                   enabled.  The cache must then be picklable and must
+                   not be filled lazily by clients.
         """
         self.timestamp = 0 # WARNING: may be exposed to clients
         self.cache = {} # WARNING: may be exposed to clients; lazy
@@ -53,6 +189,11 @@ class DataCacher(object):
         if not callable(timestamp_verifier):
             raise InvenioDataCacherError, "timestamp_verifier is not callable"
         self.timestamp_verifier = timestamp_verifier
+        if check_interval is None:
+            check_interval = CFG_DATACACHER_CHECK_INTERVAL
+        self.check_interval = check_interval
+        self.last_check = 0
+        self.snapshot_name = snapshot_name
         self.is_ok_p = True
         self.create_cache()
 
@@ -62,17 +203,58 @@ class DataCacher(object):
 
     def create_cache(self):
         """
-        Create and populate cache by calling cache filler.  Called on
-        startup and used later during runtime as needed by clients.
+        Create and populate cache by calling cache filler, or by loading
+        its shared snapshot if it is up to date.  Called on startup and
+        used later during runtime as needed by clients.
         """
+        snapshot_store = self.snapshot_name and get_snapshot_store()
+        if snapshot_store is None:
+            self.fill_cache()
+            return
+        snapshot = self.load_snapshot(snapshot_store)
+        if snapshot is None:
+            with snapshot_store.lock(self.snapshot_name):
+                # another process may have built the snapshot meanwhile:
+                snapshot = self.load_snapshot(snapshot_store)
+                if snapshot is None:
+                    self.fill_cache()
+                    snapshot_store.dump(self.snapshot_name,
+                                        (self.timestamp, self.cache))
+                    return
+        self.timestamp, self.cache = snapshot
+        self.last_check = time.time()
+
+    def fill_cache(self):
+        """Populate cache by calling cache filler."""
+        if self.timestamp_before_fill:
+            # the second before the filling starts, since
+            # recreate_cache_if_needed() looks for later changes:
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S",
+                                      time.localtime(time.time() - 1))
         self.cache = self.cache_filler()
-        self.timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        if not self.timestamp_before_fill:
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        self.timestamp = timestamp
+        self.last_check = time.time()
+
+    def load_snapshot(self, snapshot_store):
+        """Return the shared snapshot (timestamp, cache) if it is up to
+        date, None otherwise."""
+        snapshot = snapshot_store.load(self.snapshot_name)
+        if snapshot is not None and self.timestamp_verifier() <= snapshot[0]:
+            return snapshot
+        return None
 
     def recreate_cache_if_needed(self):
         """
         Recreate cache if needed, by verifying the cache timestamp
-        against the timestamp verifier function.
+        against the timestamp verifier function.  The verifier is
+        called at most every check_interval seconds.
         """
+        now = time.time()
+        if now - self.last_check < self.check_interval:
+            return
+        self.last_check = now
         if self.timestamp_verifier() > self.timestamp:
             self.create_cache()
 
@@ -101,6 +283,3 @@ class SQLDataCacher(DataCacher):
                 for table in self.affected_tables])
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
-
-
-
@@ -3346,6 +3346,16 @@ CREATE TABLE IF NOT EXISTS oaiREPOSITORY (
   PRIMARY KEY (id)
 ) ENGINE=MyISAM;
 
+CREATE TABLE IF NOT EXISTS oaiRESUMPTIONTOKEN (
+  token varchar(255) NOT NULL,
+  set_spec varchar(255) NOT NULL default '',
+  expiration_date datetime NOT NULL default '1900-01-01 00:00:00',
+  value longblob,
+  PRIMARY KEY (token),
+  KEY set_spec (set_spec),
+  KEY expiration_date (expiration_date)
+) ENGINE=MyISAM;
+
 CREATE TABLE IF NOT EXISTS oaiHARVEST (
   id mediumint(9) unsigned NOT NULL auto_increment,
   baseurl varchar(255) NOT NULL default '',
@@ -417,6 +417,7 @@ DROP TABLE IF EXISTS collectionboxname;
 DROP TABLE IF EXISTS oaiREPOSITORY;
 DROP TABLE IF EXISTS oaiHARVEST;
 DROP TABLE IF EXISTS oaiHARVESTLOG;
+DROP TABLE IF EXISTS oaiRESUMPTIONTOKEN;
 DROP TABLE IF EXISTS bibHOLDINGPEN;
 DROP TABLE IF EXISTS bibARXIVPDF;
 DROP TABLE IF EXISTS collection_collection;
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Storage of the OAI-PMH resumption tokens.
+
+The state of a harvest (request arguments, cursor and compact list of
+matching records) is stored under its resumption token by one of the
+following backends, chosen by CFG_OAI_RESUMPTION_TOKEN_STORE:
+
+  - 'file': one pickle per token in CFG_CACHEDIR/RTdata;
+
+  - 'sql': the oaiRESUMPTIONTOKEN table, with indexed expiration date
+    and set spec;
+
+  - 'redis': the default Redis namespace (see invenio.utils.redis),
+    relying on the native expiration of the keys.  The 'file' store is
+    used instead when CFG_REDIS_HOSTS is not set.
+
+Tokens are valid for CFG_OAI_EXPIRE seconds.  Loading a token that is
+unknown, expired or invalidated raises IOError with errno ENOENT.
+Expired tokens are removed by the bst_oai_cache_gc tasklet, outside of
+the request path.
+"""
+
+import errno
+import os
+import tempfile
+import time
+import uuid
+import warnings
+
+from six.moves import cPickle
+
+from invenio.config import CFG_CACHEDIR, CFG_OAI_EXPIRE, \
+    CFG_OAI_RESUMPTION_TOKEN_STORE
+from invenio.legacy.dbquery import run_sql
+from invenio.utils.redis import get_redis, DummyRedisClient
+
+
+def get_set_spec_and_parents(set_spec):
+    """Return SET_SPEC, its parent sets and the global set ''.
+
+    Records of a set are part of its parent sets too, hence tokens of
+    all these sets become invalid when SET_SPEC is modified.
+    """
+    ret = []
+    while set_spec:
+        ret.append(set_spec)
+        if ':' not in set_spec:
+            break
+        set_spec = set_spec.rsplit(":", 1)[0]
+    ret.append('')
+    return ret
+
+
+def _token_not_found(resumption_token):
+    """Return the exception raised for an unknown RESUMPTION_TOKEN."""
+    return IOError(errno.ENOENT, "Resumption token not found",
+                   resumption_token)
+
+
+class FileResumptionTokenStore(object):
+
+    """Resumption tokens stored as files in CFG_CACHEDIR/RTdata."""
+
+    def __init__(self, cache_dir=os.path.join(CFG_CACHEDIR, 'RTdata')):
+        self.cache_dir = cache_dir
+
+    def generate(self, set_spec):
+        """Return a new unique resumption token for SET_SPEC."""
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        fd, name = tempfile.mkstemp(dir=self.cache_dir,
+                                    prefix='%s___' % set_spec)
+        os.close(fd)
+        return os.path.basename(name)
+
+    def dump(self, resumption_token, cache):
+        """Store CACHE under RESUMPTION_TOKEN."""
+        cPickle.dump(cache, open(os.path.join(self.cache_dir,
+                                              resumption_token), 'w'), -1)
+
+    def load(self, resumption_token):
+        """Return the cache stored under RESUMPTION_TOKEN."""
+        fullpath = os.path.join(self.cache_dir, resumption_token)
+        if os.path.dirname(os.path.abspath(fullpath)) != \
+                os.path.abspath(self.cache_dir):
+            raise ValueError("Invalid path")
+        try:
+            mtime = os.path.getmtime(fullpath)
+        except OSError:
+            raise _token_not_found(resumption_token)
+        if time.time() - mtime > CFG_OAI_EXPIRE:
+            raise _token_not_found(resumption_token)
+        return cPickle.load(open(fullpath))
+
+    def invalidate_set(self, set_spec):
+        """Delete the tokens made invalid by a modification of SET_SPEC."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        prefixes = tuple('%s___' % aset
+                         for aset in get_set_spec_and_parents(set_spec))
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(prefixes):
+                self._remove(name)
+
+    def gc(self):
+        """Delete the expired tokens and return their number."""
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+            return 0
+        count = 0
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            try:
+                # cache entry expires when not modified during a
+                # specified period of time
+                expired = now - os.path.getmtime(
+                    os.path.join(self.cache_dir, name)) > CFG_OAI_EXPIRE
+            except OSError:
+                continue
+            if expired and self._remove(name):
+                count += 1
+        return count
+
+    def _remove(self, name):
+        """Remove the file NAME of the cache directory, if it exists."""
+        try:
+            os.remove(os.path.join(self.cache_dir, name))
+            return True
+        except OSError:
+            # Most probably the cache was already deleted
+            return False
+
+
+class SQLResumptionTokenStore(object):
+
+    """Resumption tokens stored in the oaiRESUMPTIONTOKEN table."""
+
+    def generate(self, set_spec):
+        """Return a new unique resumption token for SET_SPEC."""
+        return uuid.uuid4().hex
+
+    def dump(self, resumption_token, cache):
+        """Store CACHE under RESUMPTION_TOKEN."""
+        run_sql("""INSERT INTO oaiRESUMPTIONTOKEN
+                   (token, set_spec, expiration_date, value)
+                   VALUES (%s, %s, DATE_ADD(NOW(), INTERVAL %s SECOND), %s)""",
+                (resumption_token, cache['argd'].get('set', ''),
+                 CFG_OAI_EXPIRE, cPickle.dumps(cache, -1)))
+
+    def load(self, resumption_token):
+        """Return the cache stored under RESUMPTION_TOKEN."""
+        res = run_sql("""SELECT value FROM oaiRESUMPTIONTOKEN
+                         WHERE token=%s AND expiration_date>=NOW()""",
+                      (resumption_token, ))
+        if not res:
+            raise _token_not_found(resumption_token)
+        return cPickle.loads(str(res[0][0]))
+
+    def invalidate_set(self, set_spec):
+        """Delete the tokens made invalid by a modification of SET_SPEC."""
+        set_specs = get_set_spec_and_parents(set_spec)
+        run_sql("DELETE FROM oaiRESUMPTIONTOKEN WHERE set_spec IN (%s)" %
+                ', '.join(['%s'] * len(set_specs)), tuple(set_specs))
+
+    def gc(self):
+        """Delete the expired tokens and return their number."""
+        return run_sql("DELETE FROM oaiRESUMPTIONTOKEN "
+                       "WHERE expiration_date<NOW()")
+
+
+class RedisResumptionTokenStore(object):
+
+    """Resumption tokens stored in Redis with native expiration.
+
+    Redis cannot cheaply look keys up by set, so modifying a set stores
+    its modification time instead, and tokens created before it are
+    refused when loaded.
+    """
+
+    token_key = 'oai_resumption_token::%s'
+    set_key = 'oai_resumption_token_set::%s'
+
+    def __init__(self, redis=None):
+        self.redis = redis or get_redis()
+
+    def generate(self, set_spec):
+        """Return a new unique resumption token for SET_SPEC."""
+        return uuid.uuid4().hex
+
+    def dump(self, resumption_token, cache):
+        """Store CACHE under RESUMPTION_TOKEN."""
+        value = (cache['argd'].get('set', ''), time.time(), cache)
+        self.redis.set(self.token_key % resumption_token,
+                       cPickle.dumps(value, -1), CFG_OAI_EXPIRE)
+
+    def load(self, resumption_token):
+        """Return the cache stored under RESUMPTION_TOKEN."""
+        value = self.redis.get(self.token_key % resumption_token)
+        if value is None:
+            raise _token_not_found(resumption_token)
+        set_spec, creation_time, cache = cPickle.loads(value)
+        modification_time = self.redis.get(self.set_key % set_spec)
+        if modification_time is not None and \
+                float(modification_time) >= creation_time:
+            raise _token_not_found(resumption_token)
+        return cache
+
+    def invalidate_set(self, set_spec):
+        """Refuse the tokens made invalid by a modification of SET_SPEC."""
+        now = repr(time.time())
+        for aset in get_set_spec_and_parents(set_spec):
+            self.redis.set(self.set_key % aset, now, CFG_OAI_EXPIRE)
+
+    def gc(self):
+        """Nothing to do: Redis expires the tokens by itself."""
+        return 0
+
+
+CFG_OAI_RESUMPTION_TOKEN_STORES = {
+    'file': FileResumptionTokenStore,
+    'sql': SQLResumptionTokenStore,
+    'redis': RedisResumptionTokenStore,
+}
+
+_RESUMPTION_TOKEN_STORE = []
+
+
+def get_resumption_token_store():
+    """Return the store configured by CFG_OAI_RESUMPTION_TOKEN_STORE."""
+    if not _RESUMPTION_TOKEN_STORE:
+        store = CFG_OAI_RESUMPTION_TOKEN_STORE
+        if store == 'redis' and isinstance(get_redis(), DummyRedisClient):
+            # every token would be "not found"
+            warnings.warn("CFG_OAI_RESUMPTION_TOKEN_STORE is 'redis' but "
+                          "CFG_REDIS_HOSTS is not set: storing resumption "
+                          "tokens as files.")
+            store = 'file'
+        _RESUMPTION_TOKEN_STORE.append(
+            CFG_OAI_RESUMPTION_TOKEN_STORES[store]())
+    return _RESUMPTION_TOKEN_STORE[0]
@@ -19,17 +19,9 @@
 
 __revision__ = "$Id$"
 
-from six.moves import cPickle
-import os
 import re
 import time
-import tempfile
-import sys
 import datetime
-if sys.hexversion < 0x2050000:
-    from glob import glob as iglob
-else:
-    from glob import iglob
 from flask import url_for
 from six import iteritems
 
@@ -42,7 +34,6 @@ from invenio.config import \
      CFG_OAI_SET_FIELD, \
      CFG_OAI_PREVIOUS_SET_FIELD, \
      CFG_OAI_METADATA_FORMATS, \
-     CFG_CACHEDIR, \
      CFG_SITE_NAME, \
      CFG_SITE_SUPPORT_EMAIL, \
      CFG_SITE_URL, \
@@ -57,16 +48,21 @@ from invenio.config import \
      CFG_OAI_PROVENANCE_METADATANAMESPACE_SUBFIELD, \
      CFG_OAI_PROVENANCE_ORIGINDESCRIPTION_SUBFIELD, \
      CFG_OAI_PROVENANCE_HARVESTDATE_SUBFIELD, \
-     CFG_OAI_PROVENANCE_ALTERED_SUBFIELD
+     CFG_OAI_PROVENANCE_ALTERED_SUBFIELD, \
+     CFG_BIBUPLOAD_SERIALIZE_RECORD_STRUCTURE
 
 from intbitset import intbitset
 from invenio.utils.html import X, EscapedXMLString
-from invenio.legacy.dbquery import run_sql, wash_table_column_name
+from invenio.legacy.dbquery import run_sql, wash_table_column_name, \
+     deserialize_via_marshal
 from invenio.legacy.search_engine import record_exists, get_all_restricted_recids, get_all_field_values, search_unit_in_bibxxx, get_record, search_pattern
-from invenio.modules.formatter import format_record
+from invenio.modules.formatter import format_record, filter_hidden_fields
+from invenio.legacy.bibformat.dblayer import get_preformatted_records
 from invenio.legacy.bibrecord import record_get_field_instances
 from invenio.ext.logging import register_exception
 from invenio.legacy.oairepository.config import CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC
+from invenio.legacy.oairepository.resumption_tokens import \
+     get_resumption_token_store
 from invenio.utils.date import localtime_to_utc, utc_to_localtime
 from invenio.base.globals import cfg
 
@@ -173,6 +169,32 @@ def get_field(recid, field):
 
     return [row[0] for row in run_sql(query, (recid, field))]
 
+def get_field_of_records(recids, field):
+    """
+    Gets lists of field 'field' for the records with 'recids' system
+    numbers, in one query.  Field 'field' may contain wildcard %.
+
+    Returns dictionary recid -> list of values, for the records having
+    the field.
+    """
+    if not recids:
+        return {}
+
+    digit = field[0:2]
+
+    bibbx = "bib%sx" % digit
+    bibx  = "bibrec_bib%sx" % digit
+    if '%' in field:
+        operator = 'LIKE'
+    else:
+        operator = '='
+    query = "SELECT bibx.id_bibrec, bx.value FROM %s AS bx, %s AS bibx WHERE bibx.id_bibrec IN (%s) AND bx.id=bibx.id_bibxxx AND bx.tag %s %%s" % (wash_table_column_name(bibbx), wash_table_column_name(bibx), ','.join(['%s'] * len(recids)), operator)
+
+    out = {}
+    for recid, value in run_sql(query, tuple(recids) + (field, )):
+        out.setdefault(recid, []).append(value)
+    return out
+
 def get_modification_date(recid):
     """Returns the date of last modification for the record 'recid'.
     Return empty string if no record or modification date in UTC.
@@ -228,12 +250,14 @@ def normalize_date(date, dtime="T00:00:00Z"):
 
     return date
 
-def get_record_provenance(recid):
+def get_record_provenance(recid, record=None):
     """
     Return the provenance XML representation of a record, suitable to be put
-    in the about tag.
+    in the about tag.  The structure of the record can be passed as
+    'record' when already known.
     """
-    record = get_record(recid)
+    if record is None:
+        record = get_record(recid)
     provenances = record_get_field_instances(record, CFG_BIBUPLOAD_EXTERNAL_OAIID_TAG[:3], CFG_BIBUPLOAD_EXTERNAL_OAIID_TAG[3], CFG_BIBUPLOAD_EXTERNAL_OAIID_TAG[4])
     out = ""
     for provenance in provenances:
@@ -298,7 +322,58 @@ def get_record_rights(dummy):
             #elif code == CFG_OAI_LICENSE_URI_SUBFIELD:
                 #license_uri = value
 
-def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set_last_updated=None):
+def get_records_context(recids, prefix='marcxml', verb='ListRecords'):
+    """
+    Returns what print_record() needs to know about the records 'recids',
+    fetched in a few queries for all the records: existence (as
+    returned by record_exists()), sets, OAI identifiers and modification
+    date, plus for ListRecords and GetRecord the preformatted metadata
+    in format 'prefix' and the record structure, when available.
+
+    Returns dictionary recid -> context of the record.
+    """
+    recids = list(recids)
+    context = dict((recid, {'exists': 0,
+                            'sets': [],
+                            'idents': [],
+                            'modification_date': '',
+                            'formatted': None,
+                            'record': None}) for recid in recids)
+    if not recids:
+        return context
+
+    res = run_sql("SELECT id, DATE_FORMAT(modification_date,'%%Y-%%m-%%d %%H:%%i:%%s') FROM bibrec WHERE id IN (%s)" % ','.join(['%s'] * len(recids)), tuple(recids))
+    for recid, modification_date in res:
+        context[recid]['exists'] = 1
+        if modification_date:
+            context[recid]['modification_date'] = localtime_to_utc(modification_date)
+    for recid, dbcollids in iteritems(get_field_of_records(recids, "980__%")):
+        if ("DELETED" in dbcollids) or (CFG_CERN_SITE and "DUMMY" in dbcollids):
+            context[recid]['exists'] = -1 # exists, but marked as deleted
+    for recid, sets in iteritems(get_field_of_records(recids, CFG_OAI_SET_FIELD)):
+        context[recid]['sets'] = sets
+    for recid, idents in iteritems(get_field_of_records(recids, CFG_OAI_ID_FIELD)):
+        context[recid]['idents'] = idents
+
+    if verb == 'ListIdentifiers':
+        return context
+
+    of = CFG_OAI_METADATA_FORMATS[prefix][0]
+    for recid, (formatted, needs_2nd_pass) in iteritems(get_preformatted_records(recids, of)):
+        if needs_2nd_pass:
+            ## leave the second pass to format_record()
+            continue
+        if of.lower() == 'xm':
+            ## filter the hidden fields the way format_record() does
+            ## (without user_info, as for print_record())
+            formatted = filter_hidden_fields(formatted, None)
+        context[recid]['formatted'] = formatted
+    if CFG_BIBUPLOAD_SERIALIZE_RECORD_STRUCTURE:
+        for recid, (record, dummy) in iteritems(get_preformatted_records(recids, 'recstruct', decompress=deserialize_via_marshal)):
+            context[recid]['record'] = record
+    return context
+
+def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set_last_updated=None, context=None):
     """Prints record 'recid' formatted according to 'prefix'.
 
     - if record does not exist, return nothing.
@@ -310,11 +385,16 @@ def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set
     - if record has been deleted and CFG_OAI_DELETED_POLICY is 'no',
       then return nothing.
 
+    The information about the record is taken from 'context', as
+    returned by get_records_context(), or fetched if not given.
     """
 
-    record_exists_result = record_exists(recid) == 1
+    if context is None:
+        context = get_records_context([recid], prefix, verb)[recid]
+
+    record_exists_result = context['exists'] == 1
     if record_exists_result:
-        sets = get_field(recid, CFG_OAI_SET_FIELD)
+        sets = context['sets']
         if set_spec is not None and not set_spec in sets and not [set_ for set_ in sets if set_.startswith("%s:" % set_spec)]:
             ## the record is not in the requested set, and is not
             ## in any subset
@@ -328,7 +408,7 @@ def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set
     if not record_exists_result and CFG_OAI_DELETED_POLICY not in ('persistent', 'transient'):
         return ""
 
-    idents = get_field(recid, CFG_OAI_ID_FIELD)
+    idents = context['idents']
     if not idents:
         return ""
     ## FIXME: Move these checks in a bibtask
@@ -346,10 +426,10 @@ def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set
     header_body = EscapedXMLString('')
     header_body += X.identifier()(ident)
     if set_last_updated:
-        header_body += X.datestamp()(max(get_modification_date(recid), set_last_updated))
+        header_body += X.datestamp()(max(context['modification_date'], set_last_updated))
     else:
-        header_body += X.datestamp()(get_modification_date(recid))
-    for set_spec in get_field(recid, CFG_OAI_SET_FIELD):
+        header_body += X.datestamp()(context['modification_date'])
+    for set_spec in context['sets']:
         if set_spec and set_spec != CFG_OAI_REPOSITORY_GLOBAL_SET_SPEC:
             # Print only if field not empty
             header_body += X.setSpec()(set_spec)
@@ -360,9 +440,11 @@ def print_record(recid, prefix='marcxml', verb='ListRecords', set_spec=None, set
         return header
     else:
         if record_exists_result:
-            metadata_body = format_record(recid, CFG_OAI_METADATA_FORMATS[prefix][0])
+            metadata_body = context['formatted']
+            if metadata_body is None:
+                metadata_body = format_record(recid, CFG_OAI_METADATA_FORMATS[prefix][0])
             metadata = X.metadata(body=metadata_body)
-            provenance_body = get_record_provenance(recid)
+            provenance_body = get_record_provenance(recid, context['record'])
             if provenance_body:
                 provenance = X.about(body=provenance_body)
             else:
@@ -408,10 +490,18 @@ def oai_list_records_or_identifiers(req, argd):
         resumption_token_was_specified = True
         try:
             cache = oai_cache_load(argd['resumptionToken'])
-            last_recid = cache['last_recid']
             argd = cache['argd']
-            complete_list = cache['complete_list']
-            complete_list = filter_out_based_on_date_range(complete_list, argd.get('from', ''), argd.get('until', ''))
+            ## The records were already filtered by set and date range
+            ## when the harvest started.
+            complete_list = intbitset(cache['complete_list'])
+            cursor = cache.get('cursor')
+            if cursor is None:
+                ## Resumption token generated before the cursor was stored
+                cursor = len([recid for recid in complete_list if recid <= cache['last_recid']])
+            if 'set_last_updated' in cache:
+                set_last_updated = cache['set_last_updated']
+            else:
+                set_last_updated = get_set_last_update(argd.get('set', ""))
         except Exception, e:
             # Ignore cache not found errors
             if not isinstance(e, IOError) or e.errno != 2:
@@ -419,32 +509,30 @@ def oai_list_records_or_identifiers(req, argd):
             req.write(oai_error(argd, [("badResumptionToken", "ResumptionToken expired or invalid: %s" % argd['resumptionToken'])]))
             return
     else:
-        last_recid = 0
+        cursor = 0
         complete_list = oai_get_recid_list(argd.get('set', ""), argd.get('from', ""), argd.get('until', ""))
 
         if not complete_list: # noRecordsMatch error
             req.write(oai_error(argd, [("noRecordsMatch", "no records correspond to the request")]))
             return
+        set_last_updated = get_set_last_update(argd.get('set', ""))
 
-    cursor = 0
-    for cursor, recid in enumerate(complete_list):
-        ## Let's fast-forward the cursor to point after the last recid that was
-        ## disseminated successfully
-        if recid > last_recid:
-            break
-
-    set_last_updated = get_set_last_update(argd.get('set', ""))
+    ## Only the records of the page are extracted from the list
+    recids = complete_list[cursor:cursor+CFG_OAI_LOAD]
 
     req.write(oai_header(argd, verb))
-    for recid in list(complete_list)[cursor:cursor+CFG_OAI_LOAD]:
-        req.write(print_record(recid, argd['metadataPrefix'], verb=verb, set_spec=argd.get('set'), set_last_updated=set_last_updated))
+    records_context = get_records_context(recids, argd['metadataPrefix'], verb)
+    for recid in recids:
+        req.write(print_record(recid, argd['metadataPrefix'], verb=verb, set_spec=argd.get('set'), set_last_updated=set_last_updated, context=records_context[recid]))
 
-    if list(complete_list)[cursor+CFG_OAI_LOAD:]:
+    if cursor + len(recids) < len(complete_list):
         resumption_token = oai_generate_resumption_token(argd.get('set', ''))
         cache = {
             'argd': argd,
-            'last_recid': recid,
+            'last_recid': recids[-1],
+            'cursor': cursor + len(recids),
             'complete_list': complete_list.fastdump(),
+            'set_last_updated': set_last_updated,
         }
         oai_cache_dump(resumption_token, cache)
         expdate = oai_get_response_date(CFG_OAI_EXPIRE)
@@ -453,7 +541,6 @@ def oai_list_records_or_identifiers(req, argd):
         ## Since a resumptionToken was used we shall put a last empty resumptionToken
         req.write(X.resumptionToken(cursor=cursor, completeListSize=len(complete_list))(""))
     req.write(oai_footer(verb))
-    oai_cache_gc()
 
 def oai_list_sets(argd):
     """
@@ -656,56 +743,35 @@ def oai_get_recid_list(set_spec="", fromdate="", untildate=""):
 
 def oai_generate_resumption_token(set_spec):
     """Generates unique ID for resumption token management."""
-    fd, name = tempfile.mkstemp(dir=os.path.join(CFG_CACHEDIR, 'RTdata'), prefix='%s___' % set_spec)
-    os.close(fd)
-    return os.path.basename(name)
+    return get_resumption_token_store().generate(set_spec)
 
 def oai_delete_resumption_tokens_for_set(set_spec):
     """
     In case a set is modified by the admin interface, this will delete
     any resumption token that is now invalid.
     """
-    aset = set_spec
-    while aset:
-        for name in iglob(os.path.join(CFG_CACHEDIR, 'RTdata', '%s___*' % set_spec)):
-            os.remove(name)
-        aset = aset.rsplit(":", 1)[0]
-    for name in iglob(os.path.join(CFG_CACHEDIR, 'RTdata', '___*')):
-        os.remove(name)
+    get_resumption_token_store().invalidate_set(set_spec)
 
 def oai_cache_dump(resumption_token, cache):
     """
     Given a resumption_token and the cache, stores the cache.
     """
-    cPickle.dump(cache, open(os.path.join(CFG_CACHEDIR, 'RTdata', resumption_token), 'w'), -1)
+    get_resumption_token_store().dump(resumption_token, cache)
 
 def oai_cache_load(resumption_token):
     """
     Restores the cache from the resumption_token.
     """
-    fullpath = os.path.join(CFG_CACHEDIR, 'RTdata', resumption_token)
-    if os.path.dirname(os.path.abspath(fullpath)) != os.path.abspath(os.path.join(CFG_CACHEDIR, 'RTdata')):
-        raise ValueError("Invalid path")
-    return cPickle.load(open(fullpath))
+    return get_resumption_token_store().load(resumption_token)
 
 def oai_cache_gc():
     """
     OAI Cache Garbage Collector.
-    """
-    cache_dir = os.path.join(CFG_CACHEDIR, 'RTdata')
-
-    if not os.path.isdir(cache_dir):
-        os.makedirs(cache_dir)
 
-    for file_ in os.listdir(cache_dir):
-        filename = os.path.join(cache_dir, file_)
-        # cache entry expires when not modified during a specified period of time
-        if ((time.time() - os.path.getmtime(filename)) > CFG_OAI_EXPIRE):
-            try:
-                os.remove(filename)
-            except OSError as e:
-                # Most probably the cache was already deleted
-                pass
+    Deletes the expired resumption tokens and returns their number.
+    Runs periodically as the bst_oai_cache_gc tasklet.
+    """
+    return get_resumption_token_store().gc()
 
 def get_all_sets():
     """
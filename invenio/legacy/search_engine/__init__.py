@@ -29,6 +29,7 @@ __revision__ = "$Id$"
 import cgi
 import cStringIO
 import copy
+import heapq
 import os
 import re
 import time
@@ -38,19 +39,15 @@ import urlparse
 import zlib
 import sys
 
-try:
-    ## import optional module:
-    import numpy
-    CFG_NUMPY_IMPORTABLE = True
-except ImportError:
-    CFG_NUMPY_IMPORTABLE = False
-
 if sys.hexversion < 0x2040000:
     # pylint: disable=W0622
     from sets import Set as set
     # pylint: enable=W0622
 
 from six import iteritems
+from collections import Counter
+from itertools import groupby
+from operator import itemgetter
 
 ## import Invenio stuff:
 from invenio.base.globals import cfg
@@ -72,6 +69,7 @@ from invenio.config import \
      CFG_WEBSEARCH_FULLTEXT_SNIPPETS, \
      CFG_WEBSEARCH_DISPLAY_NEAREST_TERMS, \
      CFG_WEBSEARCH_WILDCARD_LIMIT, \
+     CFG_WEBSEARCH_FIELD_VALUES_BATCH_SIZE, \
      CFG_WEBSEARCH_IDXPAIRS_FIELDS,\
      CFG_WEBSEARCH_IDXPAIRS_EXACT_SEARCH, \
      CFG_BIBUPLOAD_SERIALIZE_RECORD_STRUCTURE, \
@@ -101,6 +99,7 @@ from invenio.modules.search.errors import \
 from invenio.legacy.bibrecord import (get_fieldvalues,
                                       get_fieldvalues_alephseq_like)
 from .utils import record_exists
+from .hitlist_cache import hitlist_cache
 from invenio.legacy.bibrecord import create_record, record_xml_output
 from invenio.legacy.bibrank.record_sorter import (
     get_bibrank_methods,
@@ -112,14 +111,14 @@ from invenio.legacy.bibindex.engine_stemmer import stem
 from invenio.modules.indexer.tokenizers.BibIndexDefaultTokenizer import BibIndexDefaultTokenizer
 from invenio.modules.indexer.tokenizers.BibIndexCJKTokenizer import BibIndexCJKTokenizer, is_there_any_CJK_character_in_text
 from invenio.legacy.bibindex.engine_utils import author_name_requires_phrase_search, \
-    get_field_tags
+    get_field_tags, get_collation_key
 from invenio.legacy.bibindex.engine_washer import wash_index_term, lower_index_term, wash_author_name
 from invenio.legacy.bibindex.engine_config import CFG_BIBINDEX_SYNONYM_MATCH_TYPE
 from invenio.legacy.bibindex.adminlib import get_idx_indexer
 from invenio.modules.formatter import format_record, format_records, get_output_format_content_type, create_excel
 from invenio.legacy.bibrank.downloads_grapher import create_download_history_graph_and_box
 from invenio.modules.knowledge.api import get_kbr_values
-from invenio.legacy.miscutil.data_cacher import DataCacher
+from invenio.legacy.miscutil.data_cacher import DataCacher, get_snapshot_store
 from invenio.legacy.websearch_external_collections import print_external_results_overview, perform_external_collection_search
 from invenio.modules.access.control import acc_get_action_id
 from invenio.modules.access.local_config import VIEWRESTRCOLL, \
@@ -128,7 +127,8 @@ from invenio.modules.access.local_config import VIEWRESTRCOLL, \
 from invenio.legacy.websearch.adminlib import get_detailed_page_tabs, get_detailed_page_tabs_counts
 from intbitset import intbitset
 from invenio.legacy.dbquery import DatabaseError, deserialize_via_marshal, InvenioDbQueryWildcardLimitError
-from invenio.modules.access.engine import acc_authorize_action
+from invenio.modules.access.engine import acc_authorize_action, \
+    acc_authorize_actions
 from invenio.ext.logging import register_exception
 from invenio.ext.cache import cache
 from invenio.utils.text import encode_for_xml, wash_for_utf8, strip_accents
@@ -230,7 +230,8 @@ class RestrictedCollectionDataCacher(DataCacher):
         def timestamp_verifier():
             return max(get_table_update_time('accROLE_accACTION_accARGUMENT'), get_table_update_time('accARGUMENT'))
 
-        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+        DataCacher.__init__(self, cache_filler, timestamp_verifier,
+                            snapshot_name='restricted_collection')
 
 def collection_restricted_p(collection, recreate_cache_if_needed=True):
     if recreate_cache_if_needed:
@@ -263,18 +264,19 @@ def ziplist(*lists):
     return map(l, *lists)
 
 
-def get_permitted_restricted_collections(user_info, recreate_cache_if_needed=True):
+def get_permitted_restricted_collections(user_info, recreate_cache_if_needed=True, user_roles=None):
     """Return a list of collection that are restricted but for which the user
-    is authorized."""
+    is authorized.  USER_ROLES are the roles of the user, if already
+    known (see acc_get_user_roles_from_user_info())."""
     if recreate_cache_if_needed:
         restricted_collection_cache.recreate_cache_if_needed()
     ret = []
 
-    auths = acc_authorize_action(
+    auths = acc_authorize_actions(
         user_info,
-        'viewrestrcoll',
-        batch_args=True,
-        collection=restricted_collection_cache.cache
+        [('viewrestrcoll', {'collection': collection})
+         for collection in restricted_collection_cache.cache],
+        user_roles=user_roles
     )
 
     for collection, auth in zip(restricted_collection_cache.cache, auths):
@@ -287,10 +289,7 @@ def get_all_restricted_recids():
     Return the set of all the restricted recids, i.e. the ids of those records
     which belong to at least one restricted collection.
     """
-    ret = intbitset()
-    for collection in restricted_collection_cache.cache:
-        ret |= get_collection_reclist(collection)
-    return ret
+    return intbitset(get_records_that_cannot_be_displayed((), 'ALL'))
 
 def get_restricted_collections_for_recid(recid, recreate_cache_if_needed=True):
     """
@@ -498,6 +497,13 @@ class CollectionRecListDataCacher(DataCacher):
     def __init__(self):
         def cache_filler():
             ret = {}
+            if get_snapshot_store() is not None:
+                # reclists are shared with the other processes, hence
+                # they cannot be filled lazily:
+                res = run_sql("SELECT name, reclist FROM collection")
+                for name, reclist in res:
+                    ret[name] = reclist and intbitset(reclist) or intbitset()
+                return ret
             res = run_sql("SELECT name FROM collection")
             for name in res:
                 ret[name[0]] = None # this will be filled later during runtime by calling get_collection_reclist(coll)
@@ -506,7 +512,8 @@ class CollectionRecListDataCacher(DataCacher):
         def timestamp_verifier():
             return get_table_update_time('collection')
 
-        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+        DataCacher.__init__(self, cache_filler, timestamp_verifier,
+                            snapshot_name='collection_reclist')
 
 try:
     if not collection_reclist_cache.is_ok_p:
@@ -532,6 +539,59 @@ def get_collection_reclist(coll, recreate_cache_if_needed=True):
     # finally, return reclist:
     return collection_reclist_cache.cache[coll]
 
+# maximum number of permission profiles whose not displayable records
+# are kept by get_records_that_cannot_be_displayed():
+NOT_DISPLAYABLE_RECIDS_CACHE_MAX_ENTRIES = 100
+
+# (policy, frozenset of permitted restricted collections) -> intbitset
+# of not displayable records, valid for the collection reclists and
+# restricted collections referenced by not_displayable_recids_version:
+not_displayable_recids_cache = {}
+not_displayable_recids_version = [None, None]
+
+def get_records_that_cannot_be_displayed(permitted_restricted_collections,
+                                         policy):
+    """
+    Return records that cannot be displayed to users having access to
+    the restricted collections PERMITTED_RESTRICTED_COLLECTIONS,
+    according to CFG_WEBSEARCH_VIEWRESTRCOLL_POLICY POLICY.
+
+    Most users share the same few permitted restricted collections,
+    hence the result is cached until the collection reclists or the
+    restricted collections change.  It must not be modified.
+    """
+    restricted_collection_cache.recreate_cache_if_needed()
+    collection_reclist_cache.recreate_cache_if_needed()
+    if not_displayable_recids_version[0] is not collection_reclist_cache.cache \
+       or not_displayable_recids_version[1] is not restricted_collection_cache.cache:
+        not_displayable_recids_cache.clear()
+        not_displayable_recids_version[:] = [collection_reclist_cache.cache,
+                                             restricted_collection_cache.cache]
+    permitted_restricted_collections = frozenset(
+        permitted_restricted_collections).intersection(
+        restricted_collection_cache.cache)
+    key = (policy, permitted_restricted_collections)
+    if key in not_displayable_recids_cache:
+        return not_displayable_recids_cache[key]
+
+    notpermitted_recids = intbitset()
+    permitted_recids = intbitset()
+    for collection in restricted_collection_cache.cache:
+        if collection not in permitted_restricted_collections:
+            notpermitted_recids |= get_collection_reclist(collection, recreate_cache_if_needed=False)
+        elif policy == 'ANY':
+            permitted_recids |= get_collection_reclist(collection, recreate_cache_if_needed=False)
+    if policy == 'ANY':
+        # the user needs to have access to at least one collection that
+        # restricts the records, so records that are both in a permitted
+        # and not permitted collection can be displayed:
+        notpermitted_recids -= permitted_recids
+
+    if len(not_displayable_recids_cache) >= NOT_DISPLAYABLE_RECIDS_CACHE_MAX_ENTRIES:
+        not_displayable_recids_cache.clear()
+    not_displayable_recids_cache[key] = notpermitted_recids
+    return notpermitted_recids
+
 def get_available_output_formats(visible_only=False):
     """
     Return the list of available output formats.  When visible_only is
@@ -584,7 +644,8 @@ class CollectionI18nNameDataCacher(DataCacher):
         def timestamp_verifier():
             return get_table_update_time('collectionname')
 
-        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+        DataCacher.__init__(self, cache_filler, timestamp_verifier,
+                            snapshot_name='collection_i18nname')
 
 try:
     if not collection_i18nname_cache.is_ok_p:
@@ -641,7 +702,8 @@ class FieldI18nNameDataCacher(DataCacher):
         def timestamp_verifier():
             return get_table_update_time('fieldname')
 
-        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+        DataCacher.__init__(self, cache_filler, timestamp_verifier,
+                            snapshot_name='field_i18nname')
 
 try:
     if not field_i18nname_cache.is_ok_p:
@@ -1914,7 +1976,8 @@ class CollectionAllChildrenDataCacher(DataCacher):
         def timestamp_verifier():
             return max(get_table_update_time('collection'), get_table_update_time('collection_collection'))
 
-        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+        DataCacher.__init__(self, cache_filler, timestamp_verifier,
+                            snapshot_name='collection_allchildren')
 
 try:
     if not collection_allchildren_cache.is_ok_p:
@@ -2123,6 +2186,19 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
     if can_see_hidden:
         myhiddens = []
 
+    # fetch exact word units targeting the same index all at once:
+    bibwords_terms = [get_bibwords_exact_term(bsu_p, bsu_f, bsu_m)
+                      for dummy_o, bsu_p, bsu_f, bsu_m in basic_search_units]
+    bibwords_hitsets, bibwords_stats = search_units_in_bibwords(
+        [bibwords_term for bibwords_term in bibwords_terms if bibwords_term])
+    if verbose and of.startswith("h"):
+        for bibwordsX, nb_terms, db_time in bibwords_stats:
+            write_warning("Search stage 2: fetching %d terms from %s took %.2f seconds." %
+                          (nb_terms, bibwordsX, db_time), req=req)
+        if verbose >= 9:
+            write_warning("Search stage 2: hitlist cache statistics: %s" %
+                          cgi.escape(repr(hitlist_cache.get_stats())), req=req)
+
     if CFG_INSPIRE_SITE and of.startswith('h'):
         # fulltext/caption search warnings for INSPIRE:
         fields_to_be_searched = [f for dummy_o, p, f, m in basic_search_units]
@@ -2143,7 +2219,10 @@ def search_pattern(req=None, p=None, f=None, m=None, ap=0, of="id", verbose=0, l
             if of.startswith("h") and verbose:
                 write_warning(_('Instead searching %(x_name)s.', x_name=str([bsu_o, bsu_p, bsu_f, bsu_m])), req=req)
         try:
-            basic_search_unit_hitset = search_unit(bsu_p, bsu_f, bsu_m, wl)
+            if bibwords_terms[idx_unit] in bibwords_hitsets:
+                basic_search_unit_hitset = bibwords_hitsets[bibwords_terms[idx_unit]]
+            else:
+                basic_search_unit_hitset = search_unit(bsu_p, bsu_f, bsu_m, wl)
         except InvenioWebSearchWildcardLimitError as excp:
             basic_search_unit_hitset = excp.res
             if of.startswith("h"):
@@ -2492,11 +2571,126 @@ def get_idxpair_field_ids():
     return [index_dict[field] for field in index_dict if field in cfg['CFG_WEBSEARCH_IDXPAIRS_FIELDS']]
 
 
+def get_bibwords_exact_term(p, f, m):
+    """Return (bibwordsX, term) when the basic search unit (p, f, m)
+       would be answered by search_unit() through a single exact term
+       lookup in search_unit_in_bibwords(), return None otherwise.
+
+       'term' is washed the very same way search_unit_in_bibwords()
+       washes it, so that the hitlist of (bibwordsX, term) is exactly
+       the hitset search_unit() would return for (p, f, m).
+    """
+    if not p or m in ('a', 'r'):
+        return None
+    if f and len(f) < 2:
+        # search_pattern() searches such units in all fields
+        f = ''
+    if f in ('datecreated', 'datemodified', 'refersto',
+             'referstoexcludingselfcites', 'cataloguer', 'rawref',
+             'citedby', 'citedbyexcludingselfcites', 'collection', 'tag',
+             'subject'):
+        return None
+    if f == 'fulltext' and \
+           ((get_idx_indexer('fulltext') == 'SOLR' and CFG_SOLR_URL) or \
+            (get_idx_indexer('fulltext') == 'XAPIAN' and CFG_XAPIAN_ENABLED)):
+        return None
+    if p.startswith("cited:") or p.startswith("citedexcludingselfcites:"):
+        return None
+    if CFG_WEBSEARCH_SYNONYM_KBRS.has_key(f or 'anyfield'):
+        return None
+    if get_field_tokenizer_type(f) == "BibIndexCJKTokenizer" and \
+           is_there_any_CJK_character_in_text(p):
+        return None
+    f = f or 'anyfield'
+    if '*' in p or '%' in p or '->' in p or \
+           (f.endswith('count') and p.endswith('+')):
+        # wildcard and span queries are left to search_unit_in_bibwords()
+        return None
+    index_id = get_index_id_from_field(f)
+    if not index_id:
+        return None
+    word = p
+    if f != 'journal':
+        word = re_word.sub('', word)
+    stemming_language = get_index_stemming_language(index_id)
+    if stemming_language:
+        word = lower_index_term(word)
+        word = stem(word, stemming_language)
+    return ("idxWORD%02dF" % index_id, wash_index_term(word))
+
+def search_units_in_bibwords(bibwords_terms):
+    """Fetch hitsets of several exact terms at once.
+
+       'bibwords_terms' is a list of (bibwordsX, term) tuples as
+       returned by get_bibwords_exact_term().  Terms are grouped by
+       word table and every table that is asked for more than one
+       distinct term is queried only once.  Each hitlist is
+       decompressed only once, whatever the number of occurrences of
+       its term.  Hitlists found in the hitlist cache are not fetched
+       at all.
+
+       Return tuple (hitsets, stats) where 'hitsets' is a dictionary
+       {(bibwordsX, term): hitset} and 'stats' is a list of
+       (bibwordsX, number of terms, DB time) tuples, one per query.
+       Terms that the table collation considers equal, such as 'Ellis'
+       and 'ellis', get the same hitset.  Terms that could not be
+       fetched safely (for example because the collation matched them
+       with a term that cannot be related to any of them) are not
+       present in 'hitsets' and have to be searched one by one.
+    """
+    hitsets = {}
+    stats = []
+    terms_by_table = {}
+    for bibwordsX, term in bibwords_terms:
+        if (bibwordsX, term) in hitsets:
+            continue
+        hitset = hitlist_cache.get(bibwordsX, term)
+        if hitset is not None:
+            hitsets[(bibwordsX, term)] = hitset
+        else:
+            terms_by_table.setdefault(bibwordsX, set()).add(term)
+    for bibwordsX, terms in terms_by_table.iteritems():
+        if len(terms) < 2:
+            continue
+        terms = list(terms)
+        t1 = os.times()[4]
+        res = run_sql("SELECT term,hitlist FROM %s WHERE term IN (%s)" %
+                      (bibwordsX, ','.join(['%s'] * len(terms))), terms)
+        stats.append((bibwordsX, len(terms), os.times()[4] - t1))
+        # the table collation matches terms such as 'Ellis' and 'ellis'
+        # with the same row, so group the terms the way it does:
+        terms_by_key = {}
+        for term in terms:
+            terms_by_key.setdefault(get_collation_key(term), []).append(term)
+        hitlists_by_key = {}
+        for term, hitlist in res:
+            key = get_collation_key(term)
+            if key not in terms_by_key:
+                # the collation matched a term we cannot relate to any
+                # of ours; leave this table to search_unit_in_bibwords():
+                break
+            hitlists_by_key.setdefault(key, []).append(hitlist)
+        else:
+            for key, key_terms in terms_by_key.iteritems():
+                hitlists = hitlists_by_key.get(key, [])
+                if len(hitlists) > 1 and len(key_terms) > 1:
+                    # several rows for several terms: we cannot tell
+                    # which row each term matched, search them one by one
+                    continue
+                hitset = intbitset()
+                for hitlist in hitlists:
+                    hitset.union_update(intbitset(hitlist))
+                for term in key_terms:
+                    hitsets[(bibwordsX, term)] = intbitset(hitset)
+                    hitlist_cache.set(bibwordsX, term, hitset)
+    return hitsets, stats
+
 def search_unit_in_bibwords(word, f, decompress=zlib.decompress, wl=0):
     """Searches for 'word' inside bibwordsX table for field 'f' and returns hitset of recIDs."""
     hitset = intbitset() # will hold output result set
     set_used = 0 # not-yet-used flag, to be able to circumvent set operations
     limit_reached = 0 # flag for knowing if the query limit has been reached
+    cached_term = None # exact term whose hitlist goes to the hitlist cache
 
     # if no field is specified, search in the global index.
     f = f or 'anyfield'
@@ -2558,8 +2752,13 @@ def search_unit_in_bibwords(word, f, decompress=zlib.decompress, wl=0):
                     res = excp.res
                     limit_reached = 1 # set the limit reached flag to true
         else:
+            cached_term = wash_index_term(word)
+            hitset = hitlist_cache.get(bibwordsX, cached_term)
+            if hitset is not None:
+                return hitset
+            hitset = intbitset()
             res = run_sql("SELECT term,hitlist FROM %s WHERE term=%%s" % bibwordsX,
-                          (wash_index_term(word),))
+                          (cached_term,))
     # fill the result set:
     for word, hitlist in res:
         hitset_bibwrd = intbitset(hitlist)
@@ -2569,6 +2768,8 @@ def search_unit_in_bibwords(word, f, decompress=zlib.decompress, wl=0):
         else:
             hitset = hitset_bibwrd
             set_used = 1
+    if cached_term is not None:
+        hitlist_cache.set(bibwordsX, cached_term, hitset)
     #check to see if the query limit was reached
     if limit_reached:
         #raise an exception, so we can print a nice message to the user
@@ -2750,6 +2951,11 @@ def search_unit_in_idxphrases(p, f, search_type, wl=0):
             res = excp.res
             limit_reached = 1 # set the limit reached flag to true
     else:
+        # exact phrase: look it up in the hitlist cache first
+        hitset = hitlist_cache.get(idxphraseX, query_params[0])
+        if hitset is not None:
+            return hitset
+        hitset = intbitset()
         res = run_sql("SELECT term,hitlist FROM %s WHERE term %s" % (idxphraseX, query_addons), query_params)
     # fill the result set:
     for dummy_word, hitlist in res:
@@ -2760,6 +2966,8 @@ def search_unit_in_idxphrases(p, f, search_type, wl=0):
         else:
             hitset = hitset_bibphrase
             set_used = 1
+    if not use_query_limit:
+        hitlist_cache.set(idxphraseX, query_params[0], hitset)
     #check to see if the query limit was reached
     if limit_reached:
         #raise an exception, so we can print a nice message to the user
@@ -3074,23 +3282,9 @@ def get_records_that_can_be_displayed(user_info,
     colls_to_be_displayed = [coll for coll in current_coll_children if coll in colls or coll in permitted_restricted_collections]
     colls_to_be_displayed.extend([coll for coll in colls if coll not in colls_to_be_displayed])
 
-    if policy == 'ANY':# the user needs to have access to at least one collection that restricts the records
-        #we need this to be able to remove records that are both in a public and restricted collection
-        permitted_recids = intbitset()
-        notpermitted_recids = intbitset()
-        for collection in restricted_collection_cache.cache:
-            if collection in permitted_restricted_collections:
-                permitted_recids |= get_collection_reclist(collection)
-            else:
-                notpermitted_recids |= get_collection_reclist(collection)
-        records_that_can_be_displayed = hitset_in_any_collection - (notpermitted_recids - permitted_recids)
-
-    else:# the user needs to have access to all collections that restrict a records
-        notpermitted_recids = intbitset()
-        for collection in restricted_collection_cache.cache:
-            if collection not in permitted_restricted_collections:
-                notpermitted_recids |= get_collection_reclist(collection)
-        records_that_can_be_displayed = hitset_in_any_collection - notpermitted_recids
+    records_that_can_be_displayed = hitset_in_any_collection - \
+        get_records_that_cannot_be_displayed(permitted_restricted_collections,
+                                             policy)
 
     if records_that_can_be_displayed.is_infinite():
         # We should not return infinite results for user.
@@ -4118,6 +4312,7 @@ class BibSortDataCacher(DataCacher):
             except IndexError:
                 data_dict_ordered = {}
             alldicts['data_dict_ordered'] = data_dict_ordered # recid: weight
+            alldicts['data_recids'] = intbitset(data_dict_ordered.keys())
             if not res_buckets:
                 alldicts['bucket_data'] = {}
                 return alldicts
@@ -4146,7 +4341,8 @@ class BibSortDataCacher(DataCacher):
                 update_time_buckets = '1970-01-01 00:00:00'
             return max(update_time_methoddata, update_time_buckets)
 
-        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+        DataCacher.__init__(self, cache_filler, timestamp_verifier,
+                            snapshot_name='bibsort_%s' % method_name)
 
 def get_sorting_methods():
     res = run_sql("""SELECT m.name, m.definition
@@ -4210,6 +4406,14 @@ def rank_records(req, rank_method_code, rank_limit_relevance, hitset_global, pat
     else:
         related_to = pattern
 
+    # only the best records are going to be displayed, so there is
+    # no need to sort the others, unless the ranked list is kept for
+    # the previous/next hit navigation:
+    ranked_result_amount = None
+    if sort_order == 'd' and rg > 0 and \
+           len(hitset_global) >= CFG_WEBSEARCH_PREV_NEXT_HIT_LIMIT:
+        ranked_result_amount = (jrec or 0) + rg
+
     solution_recs, solution_scores, prefix, suffix, comment = \
         rank_records_bibrank(rank_method_code=rank_method_code,
                              rank_limit_relevance=rank_limit_relevance,
@@ -4218,7 +4422,8 @@ def rank_records(req, rank_method_code, rank_limit_relevance, hitset_global, pat
                              field=field,
                              related_to=related_to,
                              rg=rg,
-                             jrec=jrec)
+                             jrec=jrec,
+                             ranked_result_amount=ranked_result_amount)
 
     # Solution recs can be None, in case of error or other cases
     # which should be all be changed to return an empty list.
@@ -4327,52 +4532,76 @@ def sort_records_bibsort(req, recIDs, sort_method, sort_field='', sort_order='d'
                                        sort_order, '', verbose, of, ln, rg,
                                        jrec)
 
+    bucket_numbers.sort()
     if sort_order == 'd':
         bucket_numbers.reverse()
+    # buckets hold consecutive weight intervals, so we only collect
+    # the records of the buckets we need, and count the others:
+    buckets = []
     for bucket_no in bucket_numbers:
-        solution.union_update(input_recids & sort_cache['bucket_data'][bucket_no])
+        bucket = input_recids & sort_cache['bucket_data'][bucket_no]
+        solution.union_update(bucket)
+        buckets.append(bucket)
         if len(solution) >= irec_max:
             break
 
-    dict_solution = {}
-    missing_records = intbitset()
-    for recid in solution:
-        try:
-            dict_solution[recid] = sort_cache['data_dict_ordered'][recid]
-        except KeyError:
-            #recid is in buckets, but not in the bsrMETHODDATA,
-            #maybe because the value has been deleted, but the change has not yet been propagated to the buckets
-            missing_records.add(recid)
+    data_dict_ordered = sort_cache['data_dict_ordered']
+    data_recids = sort_cache['data_recids']
+    #recids in buckets, but not in the bsrMETHODDATA, maybe because the
+    #value has been deleted, but the change has not yet been propagated
+    #to the buckets
+    missing_records = solution - data_recids
     #check if there are recids that are not in any bucket -> to be added at the end/top, ordered by insertion date
     if len(solution) < irec_max:
         #some records have not been yet inserted in the bibsort structures
         #or, some records have no value for the sort_method
         missing_records += input_recids - solution
-    #the records need to be sorted in reverse order for the print record function
-    #the return statement should be equivalent with the following statements
-    #(these are clearer, but less efficient, since they revert the same list twice)
-    #sorted_solution = (missing_records + sorted(dict_solution, key=dict_solution.__getitem__, reverse=sort_order=='d'))[:irec_max]
-    #sorted_solution.reverse()
-    #return sorted_solution
+    #the records are ordered bucket after bucket by their weight, the
+    #missing records come first, except for the latest first sorting
+    #where they come last (by decreasing recid); the result is
+    #equivalent with the following statements, but only the records
+    #we are going to display get sorted:
+    #dict_solution = dict((recid, data_dict_ordered[recid]) for recid in solution & data_recids)
+    #sorted_solution = sorted(missing_records) + sorted(dict_solution, key=dict_solution.__getitem__, reverse=sort_order=='d')
+    #return sorted_solution[jrec-1:jrec-1+rg]
     reverse = sort_order == 'd'
-
-    if sort_method.strip().lower().startswith('latest') and reverse:
-        # If we want to sort the records on their insertion date, add the missing records at the top
-        solution = sorted(dict_solution, key=dict_solution.__getitem__, reverse=True) + sorted(missing_records, reverse=True)
+    latest_first = sort_method.strip().lower().startswith('latest') and reverse
+    if latest_first:
+        parts = buckets + [missing_records]
     else:
-        solution = sorted(missing_records) + sorted(dict_solution, key=dict_solution.__getitem__, reverse=reverse)
+        parts = [missing_records] + buckets
 
     # Only keep records, we are going to display
     index_min = jrec - 1
     if rg:
         index_max = index_min + rg
-        solution = solution[index_min:index_max]
     else:
-        solution = solution[index_min:]
+        index_max = len(input_recids)
+    solution = []
+    offset = 0
+    for part in parts:
+        if part is not missing_records:
+            part = part & data_recids
+        nb_part = len(part)
+        if offset + nb_part > index_min and offset < index_max:
+            part_min = max(index_min - offset, 0)
+            part_max = min(index_max - offset, nb_part)
+            if part is missing_records:
+                part = part.tolist()
+                if latest_first:
+                    part.reverse()
+                solution.extend(part[part_min:part_max])
+            elif reverse:
+                solution.extend(heapq.nlargest(part_max, part, key=data_dict_ordered.__getitem__)[part_min:])
+            else:
+                solution.extend(heapq.nsmallest(part_max, part, key=data_dict_ordered.__getitem__)[part_min:])
+        offset += nb_part
+        if offset >= index_max:
+            break
 
     if sort_or_rank == 'r':
         # We need the recids, with their ranking score
-        return solution, [dict_solution.get(record, 0) for record in solution]
+        return solution, [data_dict_ordered.get(record, 0) for record in solution]
     else:
         return solution
 
@@ -4404,8 +4633,7 @@ def sort_records_bibxxx(req, recIDs, tags, sort_field='', sort_order='d', sort_p
             write_warning(_("Sorry, sorting is allowed on sets of up to %(x_name)d records only. Using default sort order.", x_name=CFG_WEBSEARCH_NB_RECORDS_TO_SORT), "Warning", req=req)
         return slice_records(recIDs, jrec, rg)
 
-    recIDs_dict = {}
-    recIDs_out = []
+    recIDs_values = []
 
     if not tags:
         # tags have not been camputed yet
@@ -4448,20 +4676,22 @@ def sort_records_bibxxx(req, recIDs, tags, sort_field='', sort_order='d', sort_p
                 # no sort pattern defined, so join them all together
                 val = ''.join(vals)
             val = strip_accents(val.lower()) # sort values regardless of accents and case
-            if val in recIDs_dict:
-                recIDs_dict[val].append(recID)
-            else:
-                recIDs_dict[val] = [recID]
-
-        # create output array:
-        for k in sorted(recIDs_dict.keys()):
-            recIDs_out.extend(recIDs_dict[k])
+            # records with the same value keep their original order:
+            recIDs_values.append((val, len(recIDs_values), recID))
 
-        # ascending or descending?
-        if sort_order == 'd':
-            recIDs_out.reverse()
+        # ascending or descending?  when displaying one page only, do
+        # not sort the records that come after it:
+        if not jrec:
+            jrec = 1
+        if rg:
+            if sort_order == 'd':
+                recIDs_values = heapq.nlargest(jrec - 1 + rg, recIDs_values)
+            else:
+                recIDs_values = heapq.nsmallest(jrec - 1 + rg, recIDs_values)
+        else:
+            recIDs_values.sort(reverse=sort_order == 'd')
 
-        recIDs = recIDs_out
+        recIDs = [recID for dummy_val, dummy_pos, recID in recIDs_values]
 
     # return only up to the maximum that we need
     return slice_records(recIDs, jrec, rg)
@@ -6956,7 +7186,37 @@ def get_all_field_values(tag):
     return [row[0] for row in run_sql("SELECT DISTINCT(value) FROM %s WHERE tag=%%s" % table, (tag, ))]
 
 
-def get_most_popular_field_values(recids, tags, exclude_values=None, count_repetitive_values=True, split_by=0):
+def get_fieldvalues_in_batches(recids, tags, batch_size=CFG_WEBSEARCH_FIELD_VALUES_BATCH_SIZE):
+    """
+    Iterate over (recid, value) pairs of TAGS in RECIDS.
+
+    The bibXXx tables are read in batches of BATCH_SIZE records, so
+    that at most one batch of field values is kept in memory at any
+    time.  Pairs are sorted by recid within a batch, so that all the
+    values of a record come one after the other.
+    """
+    recids = list(recids)
+    for i in xrange(0, len(recids), batch_size):
+        batch = recids[i:i + batch_size]
+        pairs = []
+        for tag in tags:
+            if tag == "001___":
+                # tag 001 (=recID) is not stored in bibXXx tables
+                pairs.extend([(recid, str(recid)) for recid in batch])
+                continue
+            digits = tag[0:2]
+            if not digits.isdigit():
+                # invalid tag value asked for
+                continue
+            pairs.extend(run_sql("SELECT bibx.id_bibrec, bx.value FROM bib%sx AS bx, bibrec_bib%sx AS bibx "
+                                 "WHERE bibx.id_bibrec IN (%s) AND bx.id=bibx.id_bibxxx "
+                                 "AND bx.tag LIKE %%s" % (digits, digits, ','.join(['%s'] * len(batch))),
+                                 tuple(batch) + (tag,)))
+        pairs.sort(key=itemgetter(0))
+        for pair in pairs:
+            yield pair
+
+def get_most_popular_field_values(recids, tags, exclude_values=None, count_repetitive_values=True, split_by=0, limit=None):
     """
     Analyze RECIDS and look for TAGS and return most popular values
     and the frequency with which they occur sorted according to
@@ -6970,6 +7230,13 @@ def get_most_popular_field_values(recids, tags, exclude_values=None, count_repet
     (But, if the same value occurs in another record, we count it, of
     course.)
 
+    Field values are read in batches of SPLIT_BY records (or of
+    CFG_WEBSEARCH_FIELD_VALUES_BATCH_SIZE records if SPLIT_BY is not
+    positive) and only their frequencies are kept, so that memory
+    grows with the number of distinct values, not with the number of
+    occurrences.  If LIMIT is set, return only the LIMIT most popular
+    values.
+
     @return: list of tuples containing tag and its frequency
 
     Example:
@@ -6980,81 +7247,43 @@ def get_most_popular_field_values(recids, tags, exclude_values=None, count_repet
      >>> get_most_popular_field_values(range(11,20), ('100__a', '700__a'), ('Ellis, J'))
      [('Ellis, N', 7), ...]
     """
-
-    def _get_most_popular_field_values_helper_sorter(val1, val2):
-        """Compare VAL1 and VAL2 according to, firstly, frequency, then
-        secondly, alphabetically."""
-        compared_via_frequencies = cmp(valuefreqdict[val2],
-                                       valuefreqdict[val1])
-        if compared_via_frequencies == 0:
-            return cmp(val1.lower(), val2.lower())
-        else:
-            return compared_via_frequencies
-
-    valuefreqdict = {}
     ## sanity check:
     if not exclude_values:
         exclude_values = []
     if isinstance(tags, str):
         tags = (tags,)
-    ## find values to count:
-    vals_to_count = []
+    if isinstance(recids, (int, long)):
+        recids = [recids]
+    if split_by <= 0:
+        split_by = CFG_WEBSEARCH_FIELD_VALUES_BATCH_SIZE
+    valuefreqdict = Counter()
     displaytmp = {}
+    pairs = get_fieldvalues_in_batches(recids, tags, split_by)
     if count_repetitive_values:
-        # counting technique A: can look up many records at once: (very fast)
-        for tag in tags:
-            vals_to_count.extend(get_fieldvalues(recids, tag, sort=False,
-                                                 split_by=split_by))
+        # counting technique A: count every occurrence
+        for dummy_recid, val in pairs:
+            valuefreqdict[val] += 1
     else:
-        # counting technique B: must count record-by-record: (slow)
-        for recid in recids:
-            vals_in_rec = []
-            for tag in tags:
-                for val in get_fieldvalues(recid, tag, False):
-                    vals_in_rec.append(val)
-            # do not count repetitive values within this record
-            # (even across various tags, so need to unify again):
-            dtmp = {}
-            for val in vals_in_rec:
-                dtmp[val.lower()] = 1
+        # counting technique B: count values once per record, even
+        # across various tags, regardless of the case:
+        for dummy_recid, rec_pairs in groupby(pairs, key=itemgetter(0)):
+            vals_in_rec = set()
+            for dummy_recid, val in rec_pairs:
+                vals_in_rec.add(val.lower())
                 displaytmp[val.lower()] = val
-            vals_in_rec = dtmp.keys()
-            vals_to_count.extend(vals_in_rec)
-    ## are we to exclude some of found values?
-    for val in vals_to_count:
-        if val not in exclude_values:
-            if val in valuefreqdict:
+            for val in vals_in_rec:
                 valuefreqdict[val] += 1
-            else:
-                valuefreqdict[val] = 1
-    ## sort by descending frequency of values:
-    if not CFG_NUMPY_IMPORTABLE:
-        ## original version
-        out = []
-        vals = valuefreqdict.keys()
-        vals.sort(_get_most_popular_field_values_helper_sorter)
-        for val in vals:
-            tmpdisplv = ''
-            if val in displaytmp:
-                tmpdisplv = displaytmp[val]
-            else:
-                tmpdisplv = val
-            out.append((tmpdisplv, valuefreqdict[val]))
-        return out
+    ## are we to exclude some of found values?
+    for val in [val for val in valuefreqdict if val in exclude_values]:
+        del valuefreqdict[val]
+    ## sort by descending frequency of values and then by lowercased
+    ## values:
+    sort_key = lambda item: (-item[1], item[0].lower())
+    if limit is not None:
+        vals = heapq.nsmallest(limit, iteritems(valuefreqdict), key=sort_key)
     else:
-        f = []   # frequencies
-        n = []   # original names
-        ln = []  # lowercased names
-        ## build lists within one iteration
-        for (val, freq) in iteritems(valuefreqdict):
-            f.append(-1 * freq)
-            if val in displaytmp:
-                n.append(displaytmp[val])
-            else:
-                n.append(val)
-            ln.append(val.lower())
-        ## sort by frequency (desc) and then by lowercased name.
-        return [(n[i], -1 * f[i]) for i in numpy.lexsort([ln, f])]
+        vals = sorted(iteritems(valuefreqdict), key=sort_key)
+    return [(displaytmp.get(val, val), freq) for val, freq in vals]
 
 
 def profile(p="", f="", c=CFG_SITE_NAME):
@@ -7066,6 +7295,39 @@ def profile(p="", f="", c=CFG_SITE_NAME):
     p.strip_dirs().sort_stats("cumulative").print_stats()
     return 0
 
+def sort_records_benchmark(sort_method, c=CFG_SITE_NAME, sort_order='d', rg=10, nb_repeats=10):
+    """Benchmark BibSort sorting of the first and of a deep results page.
+
+    Times sort_records_bibsort() asked for one page of RG records only
+    against sorting all the records of collection C and slicing the
+    page afterwards.  Example:
+
+      >>> sort_records_benchmark('latest first')
+
+    @return: dictionary with, for 'first page' and 'deep page', the
+        jrec of the page and the average time of the full and of the
+        partial sort, in seconds
+    """
+    recids = get_collection_reclist(c)
+    stats = {}
+    for page_name, jrec in (('first page', 1),
+                            ('deep page', max(len(recids) // 2, 1))):
+        timings = []
+        for page_rg in (None, rg):
+            t1 = os.times()[4]
+            for dummy in xrange(nb_repeats):
+                solution = sort_records_bibsort(None, recids, sort_method,
+                                                sort_order=sort_order,
+                                                rg=page_rg, jrec=jrec)
+                if page_rg is None:
+                    solution = slice_records(solution, 1, rg)
+            t2 = os.times()[4]
+            timings.append((t2 - t1) / nb_repeats)
+        stats[page_name] = {'jrec': jrec,
+                            'full sort': timings[0],
+                            'partial sort': timings[1]}
+    return stats
+
 
 def perform_external_collection_search_with_em(req, current_collection, pattern_list, field,
         external_collection, verbosity_level=0, lang=CFG_SITE_LANG,
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Process-local cache of decoded word and phrase index hitlists.
+
+Usage example::
+
+    hitset = hitlist_cache.get('idxWORD01F', 'higgs')
+    if hitset is None:
+        hitset = ... # read from the database
+        hitlist_cache.set('idxWORD01F', 'higgs', hitset)
+
+The cache is bounded by CFG_WEBSEARCH_HITLIST_CACHE_SIZE bytes and
+evicts the least recently used hitlists first.  Cached hitlists of an
+index table are dropped when the table is flushed by BibIndex in the
+same process (see invalidate()) or when the update time of the table,
+checked at most every CFG_WEBSEARCH_HITLIST_CACHE_CHECK_INTERVAL
+seconds, changes.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+from intbitset import intbitset
+
+from invenio.config import CFG_WEBSEARCH_HITLIST_CACHE_SIZE, \
+    CFG_WEBSEARCH_HITLIST_CACHE_CHECK_INTERVAL
+from invenio.legacy.dbquery import get_table_update_time
+
+# number of bytes accounted for every cached hitlist on top of its
+# bit vector (key, dictionary slot and intbitset object overhead):
+HITLIST_CACHE_ENTRY_OVERHEAD = 200
+
+
+def get_hitset_size(hitset):
+    """Return estimated memory footprint of HITSET in bytes."""
+    if not hitset:
+        return HITLIST_CACHE_ENTRY_OVERHEAD
+    # intbitset keeps a bit vector up to its largest element:
+    return hitset[-1] // 8 + HITLIST_CACHE_ENTRY_OVERHEAD
+
+
+class HitlistCache(object):
+    """Bounded LRU cache of hitsets keyed by (index table, term).
+
+    Hitsets are copied on the way in and on the way out, so that the
+    callers can freely modify them in place.
+    """
+
+    def __init__(self, max_size=CFG_WEBSEARCH_HITLIST_CACHE_SIZE,
+                 check_interval=CFG_WEBSEARCH_HITLIST_CACHE_CHECK_INTERVAL):
+        """Initialise an empty cache of at most MAX_SIZE bytes."""
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Drop all cached hitlists and reset the counters."""
+        self.entries = OrderedDict() # (table, term) -> (hitset, size)
+        self.table_terms = {} # table -> set of cached terms
+        self.table_update_times = {} # table -> (update time, check time)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, table, term):
+        """Return a copy of the cached hitset of TERM in TABLE, or None."""
+        if self.max_size <= 0:
+            return None
+        self.verify_table(table)
+        with self.lock:
+            entry = self.entries.pop((table, term), None)
+            if entry is None:
+                self.misses += 1
+                return None
+            # re-insert to mark the entry as the most recently used one:
+            self.entries[(table, term)] = entry
+            self.hits += 1
+            return intbitset(entry[0])
+
+    def set(self, table, term, hitset):
+        """Cache a copy of HITSET as the hitlist of TERM in TABLE."""
+        if self.max_size <= 0:
+            return
+        size = get_hitset_size(hitset)
+        if size > self.max_size:
+            return
+        with self.lock:
+            if table not in self.table_update_times:
+                # do not cache anything before knowing the table version
+                return
+            old_entry = self.entries.pop((table, term), None)
+            if old_entry is not None:
+                self.size -= old_entry[1]
+            self.entries[(table, term)] = (intbitset(hitset), size)
+            self.table_terms.setdefault(table, set()).add(term)
+            self.size += size
+            while self.size > self.max_size:
+                (old_table, old_term), old_entry = \
+                    self.entries.popitem(last=False)
+                self.table_terms[old_table].discard(old_term)
+                self.size -= old_entry[1]
+                self.evictions += 1
+
+    def invalidate(self, table=None):
+        """Drop cached hitlists of TABLE, or of all tables if TABLE is None."""
+        with self.lock:
+            if table is None:
+                tables = set(self.table_terms.keys()) | \
+                         set(self.table_update_times.keys())
+            else:
+                tables = [table]
+            for table in tables:
+                for term in self.table_terms.pop(table, ()):
+                    self.size -= self.entries.pop((table, term))[1]
+                self.table_update_times.pop(table, None)
+                self.invalidations += 1
+
+    def verify_table(self, table):
+        """Drop cached hitlists of TABLE if the table was updated.
+
+        The update time of TABLE is read from the database at most
+        every check_interval seconds.  Update times have a resolution
+        of one second, so hitlists of a table updated during the last
+        two seconds are kept only until the next check.
+        """
+        now = time.time()
+        update_time, check_time = self.table_update_times.get(table,
+                                                              (None, 0))
+        if now - check_time < self.check_interval:
+            return
+        new_update_time = get_table_update_time(table)
+        if new_update_time != update_time:
+            self.invalidate(table)
+        if new_update_time >= time.strftime("%Y-%m-%d %H:%M:%S",
+                                            time.localtime(now - 2)):
+            # the table may still change within the same second, so
+            # make the next check drop whatever gets cached meanwhile:
+            new_update_time = None
+        with self.lock:
+            self.table_update_times[table] = (new_update_time, now)
+
+    def get_stats(self):
+        """Return dictionary with the cache counters.
+
+        The values may be used to tune CFG_WEBSEARCH_HITLIST_CACHE_SIZE
+        per worker: many evictions and a low hits/misses ratio mean
+        that the cache is too small for the workload.
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self.entries),
+                'size': self.size,
+                'max_size': self.max_size}
+
+hitlist_cache = HitlistCache()
@@ -36,18 +36,21 @@ if sys.hexversion < 0x2040000:
 from six import iteritems
 
 from invenio.base.i18n import gettext_set_language
-from invenio.config import CFG_SITE_ADMIN_EMAIL, CFG_SITE_LANG, CFG_SITE_RECORD
+from invenio.config import CFG_SITE_ADMIN_EMAIL, CFG_SITE_LANG, \
+    CFG_SITE_RECORD, CFG_ACCESS_CONTROL_AUTHORIZATIONS_CHECK_INTERVAL
 from invenio.modules.access.local_config import CFG_ACC_EMPTY_ROLE_DEFINITION_SER, \
     CFG_ACC_EMPTY_ROLE_DEFINITION_SRC, DELEGATEADDUSERROLE, SUPERADMINROLE, \
     DEF_USERS, DEF_ROLES, DEF_AUTHS, CFG_ACC_ACTIVITIES_URLS
 from invenio.ext import principal
-from invenio.legacy.dbquery import run_sql, ProgrammingError
+from invenio.legacy.dbquery import run_sql, ProgrammingError, \
+    get_table_update_time
+from invenio.legacy.miscutil.data_cacher import DataCacher
 from invenio.modules.access.firerole import compile_role_definition, \
     acc_firerole_check_user, serialize, deserialize, load_role_definition
 from intbitset import intbitset
 from invenio.ext.sqlalchemy import db
-from invenio.modules.access.models import AccAuthorization, AccACTION, \
-                                    AccARGUMENT, UserAccROLE
+from invenio.modules.access.models import AccACTION, AccARGUMENT, \
+                                    UserAccROLE
 
 CFG_SUPERADMINROLE_ID = 0
 try:
@@ -1419,28 +1422,122 @@ def acc_find_possible_actions_argument_listid(id_role, id_action, arglistid):
     return res2
 
 
-def acc_find_possible_roles(name_action, always_add_superadmin=True, batch_args=False, **arguments):
-    """Find all the possible roles that are enabled to action_name with
-    given arguments. roles is a list of role_id
+def acc_compile_authorizations(authorizations):
+    """Compile AUTHORIZATIONS for acc_find_compiled_roles().
+
+    @param authorizations: iterable of (name_action, id_role,
+        argumentlistid, keyword, value) tuples.
+    @return: dictionary mapping the name of every action to a pair
+        (roles, keywords), where ROLES is the intbitset of the roles
+        authorized without arguments, and KEYWORDS maps every keyword
+        to a pair (values, keyword_roles), VALUES mapping every value
+        (including '*') to the intbitset of the roles authorized with
+        it, and KEYWORD_ROLES being the union of these roles.
     """
-    query_roles_without_args = \
-        db.select([AccAuthorization.id_accROLE], db.and_(
-            AccAuthorization.argumentlistid <= 0,
-            AccAuthorization.id_accACTION == db.bindparam('id_action')))
+    compiled = {}
+    for name_action, id_role, argumentlistid, keyword, value in \
+            authorizations:
+        roles, keywords = compiled.setdefault(name_action, (intbitset(), {}))
+        if argumentlistid <= 0:
+            roles.add(id_role)
+        elif keyword is not None:
+            values, keyword_roles = keywords.setdefault(keyword,
+                                                        ({}, intbitset()))
+            values.setdefault(value, intbitset()).add(id_role)
+            keyword_roles.add(id_role)
+    return compiled
+
+
+def acc_find_compiled_roles(compiled_action, arguments):
+    """Return the roles authorized to an action with ARGUMENTS.
+
+    A role is authorized when it is authorized without arguments, or
+    when one of its arguments has the value of the corresponding
+    keyword in ARGUMENTS, or has the value '*', or its keyword is
+    missing from ARGUMENTS or has the value '*' there.
+
+    @param compiled_action: the compiled authorizations of the action
+        (see acc_compile_authorizations()).
+    """
+    roles, keywords = compiled_action
+    roles = intbitset(roles)
+    for keyword, (values, keyword_roles) in iteritems(keywords):
+        value = arguments.get(keyword, '*')
+        if value == '*':
+            roles |= keyword_roles
+            continue
+        try:
+            if value in values:
+                roles |= values[value]
+        except TypeError:
+            ## unhashable value, which cannot match any argument
+            pass
+        if '*' in values:
+            roles |= values['*']
+    return roles
+
+
+class AuthorizationDataCacher(DataCacher):
+    """Compiled authorizations of all the actions.
+
+    The cache is the result of acc_compile_authorizations() and is
+    checked for changes of the authorizations at most every
+    CFG_ACCESS_CONTROL_AUTHORIZATIONS_CHECK_INTERVAL seconds.
+    """
+
+    ## authorizations modified while the table is compiled must not be
+    ## missed until the next modification
+    timestamp_before_fill = True
+
+    def __init__(self):
+        def cache_filler():
+            return acc_compile_authorizations(run_sql(
+                """SELECT a.name, raa.id_accROLE, raa.argumentlistid,
+                          ar.keyword, ar.value
+                   FROM accROLE_accACTION_accARGUMENT raa
+                   JOIN accACTION a ON raa.id_accACTION = a.id
+                   LEFT JOIN accARGUMENT ar ON raa.id_accARGUMENT = ar.id"""))
 
-    query_roles_with_args = \
-        AccAuthorization.query.filter(db.and_(
-            AccAuthorization.argumentlistid > 0,
-            AccAuthorization.id_accACTION == db.bindparam('id_action'))).\
-            join(AccAuthorization.argument)
+        def timestamp_verifier():
+            return max(get_table_update_time('accROLE_accACTION_accARGUMENT'),
+                       get_table_update_time('accARGUMENT'),
+                       get_table_update_time('accACTION'))
 
-    id_action = db.session.query(AccACTION.id).filter(AccACTION.name==name_action).scalar()
-    roles = intbitset(
-        db.engine.execute(query_roles_without_args.params(id_action=id_action)).\
-            fetchall())
+        DataCacher.__init__(self, cache_filler, timestamp_verifier,
+            check_interval=CFG_ACCESS_CONTROL_AUTHORIZATIONS_CHECK_INTERVAL)
 
-    if always_add_superadmin:
-        roles.add(CFG_SUPERADMINROLE_ID)
+authorization_cache = None
+
+
+def acc_get_compiled_authorizations():
+    """Return the compiled authorizations of all the actions."""
+    global authorization_cache
+    if authorization_cache is None:
+        authorization_cache = AuthorizationDataCacher()
+    else:
+        authorization_cache.recreate_cache_if_needed()
+    return authorization_cache.cache
+
+
+def acc_get_roles_signature(id_roles):
+    """Return a string identifying the authorizations of the roles
+    ID_ROLES, which changes whenever the authorizations are modified.
+
+    Users having the same roles have the same signature, hence what is
+    computed from their roles only may be cached under it.
+    """
+    acc_get_compiled_authorizations()
+    return '%s::%s' % (authorization_cache.timestamp,
+                       ','.join([str(id_role)
+                                 for id_role in sorted(id_roles)]))
+
+
+def acc_find_possible_roles(name_action, always_add_superadmin=True, batch_args=False, **arguments):
+    """Find all the possible roles that are enabled to action_name with
+    given arguments. roles is a list of role_id
+    """
+    compiled_action = acc_get_compiled_authorizations().get(name_action,
+                                                            ((), {}))
 
     # Unpack arguments
     if batch_args:
@@ -1454,17 +1551,11 @@ def acc_find_possible_roles(name_action, always_add_superadmin=True, batch_args=
     else:
         batch_arguments = [arguments]
 
-    acc_authorizations = query_roles_with_args.params(
-        id_action=id_action
-    ).all()
-
     result = []
     for arguments in batch_arguments:
-        batch_roles = roles.copy()
-        for auth in acc_authorizations:
-            if auth.id_accROLE not in batch_roles:
-                if not ((auth.argument.value != arguments.get(auth.argument.keyword, '*') != '*') and auth.argument.value != '*'):
-                    batch_roles.add(auth.id_accROLE)
+        batch_roles = acc_find_compiled_roles(compiled_action, arguments)
+        if always_add_superadmin:
+            batch_roles.add(CFG_SUPERADMINROLE_ID)
         result.append(batch_roles)
     return result if batch_args else result[0]
 
@@ -22,22 +22,17 @@ __revision__ = "$Id$"
 import cgi
 from urllib import quote
 
-from .control import acc_find_possible_roles, acc_is_user_in_any_role, acc_get_roles_emails
+from .control import acc_find_possible_roles, acc_is_user_in_any_role, \
+    acc_get_roles_emails, acc_get_user_roles_from_user_info
 from .local_config import CFG_WEBACCESS_WARNING_MSGS, CFG_WEBACCESS_MSGS
 from invenio.legacy.webuser import collect_user_info
 from invenio.modules.access.firerole import load_role_definition, acc_firerole_extract_emails
 from flask.ext.login import current_user
 
 
-def acc_authorize_action(req, name_action, authorized_if_no_roles=False, batch_args=False, **arguments):
-    """
-    Given the request object (or the user_info dictionary, or the uid), checks
-    if the user is allowed to run name_action with the given parameters.
-    If authorized_if_no_roles is True and no role exists (different
-    than superadmin) that are authorized to execute the given action, the
-    authorization will be granted.
-    Returns (0, msg) when the authorization is granted, (1, msg) when it's not.
-    """
+def _get_user_info(req):
+    """Return the user_info of the request object (or the user_info
+    dictionary, or the uid) REQ."""
     from invenio.ext.login import UserInfo
     from werkzeug.local import LocalProxy
     if isinstance(req, LocalProxy):
@@ -53,6 +48,41 @@ def acc_authorize_action(req, name_action, authorized_if_no_roles=False, batch_a
         user_info = collect_user_info(uid)  # FIXME
     else:
         user_info = collect_user_info(req)
+    return user_info
+
+
+def _get_authorization(user_info, name_action, roles, user_in_roles,
+                       authorized_if_no_roles):
+    """Return the (code, msg) answer of acc_authorize_action()."""
+    if user_in_roles:
+        ## User belong to at least one authorized role
+        ## or User is SUPERADMIN
+        return (0, CFG_WEBACCESS_WARNING_MSGS[0])
+    elif len(roles) <= 1:
+        ## No role is authorized for the given action/arguments
+        if authorized_if_no_roles:
+            ## User is authorized because no authorization exists for the given
+            ## action/arguments
+            return (0, CFG_WEBACCESS_WARNING_MSGS[0])
+        else:
+            ## User is not authorized.
+            return (20, CFG_WEBACCESS_WARNING_MSGS[20] % cgi.escape(name_action))
+    else:
+        ## User is not authorized
+        in_a_web_request_p = bool(user_info.get('uri', ''))
+        return (1, "%s %s" % (CFG_WEBACCESS_WARNING_MSGS[1], (in_a_web_request_p and "%s %s" % (CFG_WEBACCESS_MSGS[0] % quote(user_info.get('uri', '')), CFG_WEBACCESS_MSGS[1]) or "")))
+
+
+def acc_authorize_action(req, name_action, authorized_if_no_roles=False, batch_args=False, **arguments):
+    """
+    Given the request object (or the user_info dictionary, or the uid), checks
+    if the user is allowed to run name_action with the given parameters.
+    If authorized_if_no_roles is True and no role exists (different
+    than superadmin) that are authorized to execute the given action, the
+    authorization will be granted.
+    Returns (0, msg) when the authorization is granted, (1, msg) when it's not.
+    """
+    user_info = _get_user_info(req)
 
     roles_list = acc_find_possible_roles(name_action, always_add_superadmin=True, batch_args=batch_args, **arguments)
 
@@ -61,28 +91,45 @@ def acc_authorize_action(req, name_action, authorized_if_no_roles=False, batch_a
 
     result = []
     for roles in roles_list:
-        if acc_is_user_in_any_role(user_info, roles):
-            ## User belong to at least one authorized role
-            ## or User is SUPERADMIN
-            ret_val = (0, CFG_WEBACCESS_WARNING_MSGS[0])
-        elif len(roles) <= 1:
-            ## No role is authorized for the given action/arguments
-            if authorized_if_no_roles:
-                ## User is authorized because no authorization exists for the given
-                ## action/arguments
-                ret_val = (0, CFG_WEBACCESS_WARNING_MSGS[0])
-            else:
-                ## User is not authorized.
-                ret_val = (20, CFG_WEBACCESS_WARNING_MSGS[20] % cgi.escape(name_action))
-        else:
-            ## User is not authorized
-            in_a_web_request_p = bool(user_info.get('uri', ''))
-            ret_val = (1, "%s %s" % (CFG_WEBACCESS_WARNING_MSGS[1], (in_a_web_request_p and "%s %s" % (CFG_WEBACCESS_MSGS[0] % quote(user_info.get('uri', '')), CFG_WEBACCESS_MSGS[1]) or "")))
-        result.append(ret_val)
+        result.append(_get_authorization(
+            user_info, name_action, roles,
+            acc_is_user_in_any_role(user_info, roles),
+            authorized_if_no_roles))
     # FIXME removed CERN specific hack!
     return result if batch_args else result[0]
 
 
+def acc_authorize_actions(req, actions, authorized_if_no_roles=False,
+                          user_roles=None):
+    """
+    Check in a single pass if the user is allowed to run each of ACTIONS.
+
+    The roles of the user, explicit and implicit (FireRole), are
+    fetched once, instead of once per action as acc_authorize_action()
+    does, hence the authorizations are then computed without querying
+    the database.
+
+    @param req: the request object, the user_info dictionary or the uid.
+    @param actions: list of (name_action, arguments) pairs, ARGUMENTS
+        being the dictionary of the arguments of the action.
+    @param user_roles: the roles of the user, if already known (see
+        acc_get_user_roles_from_user_info()).
+    @return: the list of (code, msg) answers of acc_authorize_action()
+        for every action.
+    """
+    user_info = _get_user_info(req)
+    if user_roles is None:
+        user_roles = acc_get_user_roles_from_user_info(user_info)
+
+    result = []
+    for name_action, arguments in actions:
+        roles = acc_find_possible_roles(name_action, always_add_superadmin=True, **arguments)
+        result.append(_get_authorization(
+            user_info, name_action, roles, bool(roles & user_roles),
+            authorized_if_no_roles))
+    return result
+
+
 def acc_get_authorized_emails(name_action, **arguments):
     """
     Given the action and its arguments, try to retireve all the matching
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the compiled authorizations of access control."""
+
+from intbitset import intbitset
+
+from invenio.base.wrappers import lazy_import
+from invenio.testsuite import make_test_suite, run_test_suite, InvenioTestCase
+
+acc_compile_authorizations = lazy_import(
+    'invenio.modules.access.control:acc_compile_authorizations')
+acc_find_compiled_roles = lazy_import(
+    'invenio.modules.access.control:acc_find_compiled_roles')
+acc_get_roles_signature = lazy_import(
+    'invenio.modules.access.control:acc_get_roles_signature')
+acc_get_user_roles_from_user_info = lazy_import(
+    'invenio.modules.access.control:acc_get_user_roles_from_user_info')
+acc_authorize_action = lazy_import(
+    'invenio.modules.access.engine:acc_authorize_action')
+acc_authorize_actions = lazy_import(
+    'invenio.modules.access.engine:acc_authorize_actions')
+
+
+class AccessControlCompiledAuthorizationsTest(InvenioTestCase):
+    """Test the lookup of roles in compiled authorizations."""
+
+    def setUp(self):
+        """Compile authorizations of runwebcoll and viewrestrcoll."""
+        self.compiled = acc_compile_authorizations([
+            ('runwebcoll', 1, 0, None, None),
+            ('viewrestrcoll', 2, 1, 'collection', 'Theses'),
+            ('viewrestrcoll', 3, 1, 'collection', 'ALEPH Papers'),
+            ('viewrestrcoll', 4, 1, 'collection', '*'),
+            ('viewrestrcoll', 5, -1, None, None),
+        ])
+
+    def find_roles(self, name_action, **arguments):
+        """Return the roles authorized to NAME_ACTION with ARGUMENTS."""
+        return acc_find_compiled_roles(
+            self.compiled.get(name_action, ((), {})), arguments)
+
+    def test_roles_without_arguments(self):
+        """access control - compiled roles authorized without arguments"""
+        self.assertEqual(self.find_roles('runwebcoll'), intbitset([1]))
+        self.assertEqual(self.find_roles('runwebcoll', collection='Theses'),
+                         intbitset([1]))
+
+    def test_roles_with_argument_value(self):
+        """access control - compiled roles authorized for a value"""
+        self.assertEqual(self.find_roles('viewrestrcoll', collection='Theses'),
+                         intbitset([2, 4, 5]))
+        self.assertEqual(self.find_roles('viewrestrcoll', collection='Books'),
+                         intbitset([4, 5]))
+
+    def test_roles_with_missing_argument(self):
+        """access control - compiled roles of missing or '*' arguments"""
+        self.assertEqual(self.find_roles('viewrestrcoll'),
+                         intbitset([2, 3, 4, 5]))
+        self.assertEqual(self.find_roles('viewrestrcoll', collection='*'),
+                         intbitset([2, 3, 4, 5]))
+
+    def test_unknown_action(self):
+        """access control - compiled roles of an unknown action"""
+        self.assertEqual(self.find_roles('foo', collection='Theses'),
+                         intbitset())
+
+    def test_returned_roles_are_copies(self):
+        """access control - modifying found roles does not alter the cache"""
+        self.find_roles('runwebcoll').add(42)
+        self.assertEqual(self.find_roles('runwebcoll'), intbitset([1]))
+
+
+class DictCache(dict):
+    """Cache keeping the values in the dictionary itself."""
+
+    def set(self, key, value, timeout=None):
+        self[key] = value
+
+    def delete(self, key):
+        self.pop(key, None)
+
+
+class AccessControlUserRolesTest(InvenioTestCase):
+    """Test the authorizations computed from the roles of a user."""
+
+    roles = (('acctestexplicit', 'deny any'),
+             ('acctestfirerole', 'allow email /^acctest[12]@example.org$/'),
+             ('acctestother', 'deny any'))
+
+    actions = (('runbibedit', {'collection': 'Theses'}),
+               ('runbibedit', {'collection': 'Books'}),
+               ('runbibedit', {}),
+               ('runbibmerge', {}),
+               ('runbibeditmulti', {}),
+               ('runbibtaskex', {}))
+
+    def setUp(self):
+        """Create users having explicit and FireRole roles."""
+        from invenio.ext.login import legacy_user
+        from invenio.ext.sqlalchemy import db
+        from invenio.modules.access import control
+        from invenio.modules.access.firerole import compile_role_definition, \
+            serialize
+        from invenio.modules.accounts.models import User
+
+        self.users = [User(email='acctest%s@example.org' % i,
+                           nickname='acctest%s' % i) for i in (1, 2, 3)]
+        for user in self.users:
+            db.session.add(user)
+        db.session.commit()
+        self.uids = [user.id for user in self.users]
+
+        for name_role, definition in self.roles:
+            control.acc_add_role(
+                name_role, 'test role',
+                serialize(compile_role_definition(definition)), definition)
+        control.acc_add_authorization('acctestexplicit', 'runbibedit',
+                                      collection='Theses')
+        control.acc_add_authorization('acctestfirerole', 'runbibmerge')
+        control.acc_add_authorization('acctestother', 'runbibeditmulti')
+        for uid in self.uids:
+            control.acc_add_user_role(uid, name_role='acctestexplicit')
+        control.acc_add_user_role(self.uids[2], name_role='acctestother')
+        ## do not wait for the authorizations check interval
+        control.authorization_cache = None
+
+        self.cache = legacy_user.cache
+        legacy_user.cache = DictCache()
+
+    def tearDown(self):
+        """Remove the test users and roles."""
+        from invenio.ext.login import legacy_user
+        from invenio.ext.sqlalchemy import db
+        from invenio.modules.access import control
+
+        legacy_user.cache = self.cache
+        for name_role, dummy in self.roles:
+            control.acc_delete_role(name_role=name_role)
+        control.authorization_cache = None
+        for user in self.users:
+            db.session.delete(user)
+        db.session.commit()
+
+    def get_user_infos(self):
+        """Return the user_info of the test users and of a guest."""
+        from invenio.ext.login import UserInfo
+        return [UserInfo(uid) for uid in self.uids] + [UserInfo(None)]
+
+    def test_authorize_actions(self):
+        """access control - batch authorizations match single ones"""
+        for user_info in self.get_user_infos():
+            for authorized_if_no_roles in (False, True):
+                self.assertEqual(
+                    acc_authorize_actions(
+                        user_info, self.actions,
+                        authorized_if_no_roles=authorized_if_no_roles),
+                    [acc_authorize_action(
+                        user_info, name_action,
+                        authorized_if_no_roles=authorized_if_no_roles,
+                        **arguments)
+                     for name_action, arguments in self.actions])
+
+        user_info = self.get_user_infos()[0]
+        auths = acc_authorize_actions(user_info, self.actions)
+        ## explicit role
+        self.assertEqual(auths[0][0], 0)
+        ## FireRole role
+        self.assertEqual(auths[3][0], 0)
+        ## role of another user
+        self.assertNotEqual(auths[4][0], 0)
+
+    def test_precache_roles(self):
+        """access control - role based precached permissions are unchanged"""
+        from flask import current_app
+        from invenio.legacy.search_engine import restricted_collection_cache
+        from invenio.legacy.webuser import isUserReferee, isUserAdmin, \
+            isUserSuperAdmin
+        from invenio.modules.access.control import acc_get_role_id, \
+            acc_is_user_in_role
+
+        bibauthorid_enabled = current_app.config.get(
+            'CFG_BIBAUTHORID_ENABLED', False)
+        restricted_collection_cache.recreate_cache_if_needed()
+        for user_info in self.get_user_infos()[:-1]:
+            expected = {
+                'precached_permitted_restricted_collections': [
+                    collection for collection
+                    in restricted_collection_cache.cache
+                    if acc_authorize_action(user_info, 'viewrestrcoll',
+                                            collection=collection)[0] == 0],
+                'precached_useapprove': isUserReferee(user_info),
+                'precached_useadmin': isUserAdmin(user_info),
+                'precached_usesuperadmin': isUserSuperAdmin(user_info),
+                'precached_usepaperclaim': bool(
+                    bibauthorid_enabled and acc_is_user_in_role(
+                        user_info, acc_get_role_id('paperclaimviewers'))),
+                'precached_usepaperattribution': bool(
+                    bibauthorid_enabled and acc_is_user_in_role(
+                        user_info,
+                        acc_get_role_id('paperattributionviewers'))),
+            }
+            for key, name_action in (
+                    ('precached_usebaskets', 'usebaskets'),
+                    ('precached_useloans', 'useloans'),
+                    ('precached_usegroups', 'usegroups'),
+                    ('precached_usealerts', 'usealerts'),
+                    ('precached_usemessages', 'usemessages'),
+                    ('precached_usestats', 'runwebstatadmin'),
+                    ('precached_canseehiddenmarctags', 'runbibedit')):
+                expected[key] = \
+                    acc_authorize_action(user_info, name_action)[0] == 0
+            self.assertEqual(
+                user_info._precache_roles(
+                    user_info, acc_get_user_roles_from_user_info(user_info)),
+                expected)
+
+    def test_same_roles_share_cache(self):
+        """access control - users having the same roles share precache"""
+        from invenio.ext.login import legacy_user
+
+        user_infos = self.get_user_infos()
+        roles = [acc_get_user_roles_from_user_info(user_info)
+                 for user_info in user_infos[:-1]]
+        self.assertEqual(roles[0], roles[1])
+        self.assertNotEqual(roles[0], roles[2])
+        self.assertEqual(acc_get_roles_signature(roles[0]),
+                         acc_get_roles_signature(roles[1]))
+        self.assertNotEqual(acc_get_roles_signature(roles[0]),
+                            acc_get_roles_signature(roles[2]))
+
+        keys = [key for key in legacy_user.cache
+                if key.startswith('precached_roles::')]
+        self.assertEqual(len(keys), 2)
+
+
+TEST_SUITE = make_test_suite(AccessControlCompiledAuthorizationsTest,
+                             AccessControlUserRolesTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -22,12 +22,16 @@
 __revision__ = \
     "$Id$"
 
+from intbitset import intbitset
+
 from invenio.base.wrappers import lazy_import
 from invenio.testsuite import make_test_suite, run_test_suite, InvenioTestCase
 bibindex_engine = lazy_import('invenio.legacy.bibindex.engine')
 load_tokenizers = lazy_import('invenio.legacy.bibindex.engine_utils.load_tokenizers')
 list_union = lazy_import('invenio.legacy.bibindex.engine_utils.list_union')
 get_values_recursively = lazy_import('invenio.legacy.bibindex.engine_utils.get_values_recursively')
+get_index_id_from_index_name = lazy_import('invenio.legacy.bibindex.engine_utils.get_index_id_from_index_name')
+run_sql = lazy_import('invenio.legacy.dbquery.run_sql')
 
 
 class TestListSetOperations(InvenioTestCase):
@@ -261,6 +265,98 @@ class TestGetValuesFromRecjson(InvenioTestCase):
         self.assertEqual(phrases, ['name1', 'name2', 'name4'])
 
 
+class TestParallelIndexing(InvenioTestCase):
+    """Tests for tokenizing records in several worker processes."""
+
+    prefixes = ('tmp_serial_', 'tmp_parallel_')
+    table_types = (('WORD', 50), ('PAIR', 100), ('PHRASE', 0))
+
+    def setUp(self):
+        self.index_id = get_index_id_from_index_name('title')
+        for prefix in self.prefixes:
+            bibindex_engine.init_temporary_reindex_tables(self.index_id,
+                                                          prefix)
+
+    def tearDown(self):
+        for prefix in self.prefixes:
+            for table_type, dummy in self.table_types:
+                for suffix in ('F', 'R'):
+                    run_sql("DROP TABLE IF EXISTS %sidx%s%02d%s" %
+                            (prefix, table_type, self.index_id, suffix))
+
+    def _index(self, prefix, table_type, wash_index_terms, workers):
+        word_table = bibindex_engine.WordTable('title', table_type,
+                                               table_prefix=prefix,
+                                               wash_index_terms=wash_index_terms)
+        word_table.turn_off_virtual_indexes()
+        word_table.add_recIDs([[1, 150]], 50, workers)
+
+    def _dump(self, prefix, table_type):
+        table = "%sidx%s%02d" % (prefix, table_type, self.index_id)
+        return (run_sql("SELECT id, term, hitlist FROM %sF ORDER BY id" %
+                        table),
+                run_sql("SELECT id_bibrec, type, termlist FROM %sR "
+                        "ORDER BY id_bibrec, type" % table))
+
+    def test_parallel_tables_identical_to_serial(self):
+        """bibindex engine - parallel reindexing gives the serial tables"""
+        for table_type, wash_index_terms in self.table_types:
+            self._index('tmp_serial_', table_type, wash_index_terms, 1)
+            self._index('tmp_parallel_', table_type, wash_index_terms, 3)
+            serial = self._dump('tmp_serial_', table_type)
+            self.assertTrue(serial[0])
+            self.assertEqual(serial, self._dump('tmp_parallel_', table_type))
+
+
+class TestBulkFlush(InvenioTestCase):
+    """Tests for flushing the word tables in bulk."""
+
+    prefixes = ('tmp_wordbyword_', 'tmp_bulk_')
+    table_types = ('WORD', 'PAIR', 'PHRASE')
+
+    def setUp(self):
+        self.index_id = get_index_id_from_index_name('title')
+        for prefix in self.prefixes:
+            bibindex_engine.init_temporary_reindex_tables(self.index_id,
+                                                          prefix)
+
+    def tearDown(self):
+        for prefix in self.prefixes:
+            for table_type in self.table_types:
+                for suffix in ('F', 'R'):
+                    run_sql("DROP TABLE IF EXISTS %sidx%s%02d%s" %
+                            (prefix, table_type, self.index_id, suffix))
+
+    def _flush(self, prefix, table_type, bulk, words):
+        word_table = bibindex_engine.WordTable('title', table_type,
+                                               table_prefix=prefix,
+                                               wash_index_terms=0)
+        word_table.bulk_flush = bulk
+        for recid, word, sign in words:
+            word_table.put(recid, word, sign)
+        word_table.put_into_db()
+
+    def _dump(self, prefix, table_type):
+        return sorted((term, list(intbitset(hitlist))) for term, hitlist in
+                      run_sql("SELECT term, hitlist FROM %sidx%s%02dF" %
+                              (prefix, table_type, self.index_id)))
+
+    def test_bulk_flush_identical_to_word_by_word(self):
+        """bibindex engine - bulk flush merges accented terms like word by word"""
+        for table_type in self.table_types:
+            for prefix, bulk in zip(self.prefixes, (False, True)):
+                self._flush(prefix, table_type, bulk,
+                            [(1, 'cafe', 1), (1, 'ellis', 1), (2, 'été', 1)])
+                self._flush(prefix, table_type, bulk,
+                            [(2, 'café', 1), (3, 'cafè', 1), (3, 'ellis', 1),
+                             (2, 'ete', -1), (4, 'thé', 1), (5, 'the', 1)])
+            dump = self._dump('tmp_wordbyword_', table_type)
+            self.assertEqual(dump, self._dump('tmp_bulk_', table_type))
+            if table_type != 'PHRASE':
+                self.assertEqual([hitlist for term, hitlist in dump
+                                  if term in ('cafe', 'café', 'cafè')],
+                                 [[1, 2, 3]])
+
 
 TEST_SUITE = make_test_suite(TestListSetOperations,
                              TestWashIndexTerm,
@@ -268,7 +364,9 @@ TEST_SUITE = make_test_suite(TestListSetOperations,
                              TestGetPairsFromPhrase,
                              TestGetWordsFromDateTag,
                              TestGetAuthorFamilyNameWords,
-                             TestGetValuesFromRecjson,)
+                             TestGetValuesFromRecjson,
+                             TestParallelIndexing,
+                             TestBulkFlush,)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
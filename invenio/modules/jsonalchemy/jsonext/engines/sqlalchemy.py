@@ -19,17 +19,87 @@
 
 """SQLAlchemy storage engine implementation."""
 
+from __future__ import absolute_import
+
+import json as json_module
 import six
 
 from flask.helpers import locked_cached_property
+from sqlalchemy import bindparam, select
 from werkzeug import import_string
 
 from invenio.modules.jsonalchemy.storage import Storage
 
 
+def _chunks(iterable, size):
+    """Yield lists of at most ``size`` consecutive items of ``iterable``."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _get_values(json, field):
+    """Yield the values of the dotted ``field`` name inside ``json``.
+
+    Lists found on the way are flattened, i.e. ``authors.full_name``
+    yields the name of every author.
+    """
+    values = [json]
+    for key in field.split('.'):
+        new_values = []
+        for value in values:
+            if isinstance(value, (list, tuple)):
+                new_values.extend(item.get(key) for item in value
+                                  if isinstance(item, dict))
+            elif isinstance(value, dict):
+                new_values.append(value.get(key))
+        values = new_values
+    for value in values:
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                yield item
+        elif value is not None:
+            yield value
+
+
+def _group_values(values, repetitive_values, count):
+    """Apply ``repetitive_values`` and ``count`` to the list of values.
+
+    See :meth:`~invenio.modules.jsonalchemy.storage.Storage.get_field_values`.
+    """
+    if repetitive_values:
+        return values
+    counts = {}
+    unique_values = []
+    for value in values:
+        try:
+            key = value
+            hash(key)
+        except TypeError:
+            key = json_module.dumps(value, sort_keys=True)
+        if key not in counts:
+            counts[key] = 0
+            unique_values.append((key, value))
+        counts[key] += 1
+    if count:
+        return [(value, counts[value_key])
+                for value_key, value in unique_values]
+    return [value for dummy_key, value in unique_values]
+
+
 class SQLAlchemyStorage(Storage):
 
-    """Implement database backend for SQLAlchemy model storage."""
+    """Implement database backend for SQLAlchemy model storage.
+
+    Bulk operations are executed in chunks of ``chunk_size`` rows (1000 by
+    default), which can be set in the storage configuration together with
+    the ``model`` and the ``sqlalchemy_backend``.
+    """
 
     # FIXME: This storage engine should use transactions!
 
@@ -38,6 +108,7 @@ class SQLAlchemyStorage(Storage):
         self.__db = kwards.get('sqlalchemy_backend',
                                'invenio.ext.sqlalchemy:db')
         self.__model = model
+        self.chunk_size = kwards.get('chunk_size', 1000)
 
     @locked_cached_property
     def db(self):
@@ -66,11 +137,13 @@ class SQLAlchemyStorage(Storage):
         self.db.session.commit()
 
     def save_many(self, jsons, ids=None):
-        """See :meth:`~invenio.modules.jsonalchemy.storage.Storage.save_many`."""
-        if ids is None:
-            ids = map(lambda j: j['_id'], jsons)
-        self.db.session.add_all([self.model(id=id, json=json)
-                                 for id, json in zip(ids, jsons)])
+        """See :meth:`~invenio.modules.jsonalchemy.storage.Storage.save_many`.
+
+        The rows are inserted with one multi-row ``INSERT`` per chunk.
+        """
+        table = self.model.__table__
+        for chunk in _chunks(self._rows(jsons, ids), self.chunk_size):
+            self.db.session.execute(table.insert(), chunk)
         self.db.session.commit()
 
     def update_one(self, json, id=None):
@@ -83,38 +156,99 @@ class SQLAlchemyStorage(Storage):
         self.db.session.commit()
 
     def update_many(self, jsons, ids=None):
-        """See :meth:`~invenio.modules.jsonalchemy.storage.Storage.update_many`."""
-        #FIXME: what if we get only the fields that have change
-        if ids is None:
-            ids = map(lambda j: j['_id'], jsons)
+        """See :meth:`~invenio.modules.jsonalchemy.storage.Storage.update_many`.
 
-        for id, json in zip(ids, jsons):
-            self.db.session.merge(self.model(id=id, json=json))
+        For every chunk the ids already stored are fetched with one query,
+        then the existing rows are updated with one ``UPDATE`` statement
+        executed for many parameter sets and the missing rows are inserted
+        with one multi-row ``INSERT``.
+        """
+        #FIXME: what if we get only the fields that have change
+        table = self.model.__table__
+        update = table.update().where(table.c.id == bindparam('_id'))\
+            .values(json=bindparam('json'))
+        for chunk in _chunks(self._rows(jsons, ids), self.chunk_size):
+            existing_ids = set(row[0] for row in self.db.session.execute(
+                select([table.c.id])
+                .where(table.c.id.in_([row['id'] for row in chunk]))))
+            updates = [{'_id': row['id'], 'json': row['json']}
+                       for row in chunk if row['id'] in existing_ids]
+            inserts = [row for row in chunk if row['id'] not in existing_ids]
+            if updates:
+                self.db.session.execute(update, updates)
+            if inserts:
+                self.db.session.execute(table.insert(), inserts)
         self.db.session.commit()
 
+    @staticmethod
+    def _rows(jsons, ids):
+        """Yield the table rows for the given jsons and ids."""
+        if ids is None:
+            for json in jsons:
+                yield {'id': json['_id'], 'json': json}
+        else:
+            for id, json in zip(ids, jsons):
+                yield {'id': id, 'json': json}
+
     def get_one(self, id):
         """See :meth:`~invenio.modules.jsonalchemy.storage.Storage.get_one`."""
         return self.db.session.query(self.model.json)\
             .filter_by(id=id).one().json
 
     def get_many(self, ids):
-        """See :meth:`~invenio.modules.jsonalchemy.storage.Storage.get_many`."""
-        for json in self.db.session.query(self.model.json)\
-                .filter(self.model.id.in_(ids))\
-                .all():
-            yield json[0]
+        """See :meth:`~invenio.modules.jsonalchemy.storage.Storage.get_many`.
+
+        The JSON objects are returned ordered by id.  They are fetched with
+        one query per chunk of ids and streamed from a server-side cursor
+        of a dedicated connection, therefore changes not yet committed in
+        the current session are not visible.
+        """
+        for id, json in self._iter_rows(ids):
+            yield json
+
+    def _iter_rows(self, ids, chunk_size=0):
+        """Yield ``(id, json)`` rows for the given ids ordered by id."""
+        chunk_size = chunk_size if chunk_size > 0 else self.chunk_size
+        table = self.model.__table__
+        connection = self.db.engine.connect()
+        try:
+            connection = connection.execution_options(stream_results=True)
+            for chunk in _chunks(sorted(ids), chunk_size):
+                for row in connection.execute(
+                        select([table.c.id, table.c.json])
+                        .where(table.c.id.in_(chunk))
+                        .order_by(table.c.id)):
+                    yield row[0], row[1]
+        finally:
+            connection.close()
 
     def get_field_values(self, recids, field, repetitive_values=True, count=False,
                          include_recid=False, split_by=0):
-        """See :meth:`~invenio.modules.jsonalchemy.storage.Storage.get_field_values`."""
-        #TODO
-        raise NotImplementedError()
+        """See :meth:`~invenio.modules.jsonalchemy.storage.Storage.get_field_values`.
+
+        ``field`` can be a dotted name, e.g. ``title.title``.  If
+        ``include_recid`` is set, ``(recid, value)`` tuples are returned.
+        ``split_by`` sets how many records are fetched per query.
+        """
+        return self.get_fields_values(recids, [field], repetitive_values,
+                                      count, include_recid, split_by)[field]
 
     def get_fields_values(self, recids, fields, repetitive_values=True, count=False,
                           include_recid=False, split_by=0):
-        """See :meth:`~invenio.modules.jsonalchemy.storage.Storage.get_fields_values`."""
-        #TODO
-        raise NotImplementedError()
+        """See :meth:`~invenio.modules.jsonalchemy.storage.Storage.get_fields_values`.
+
+        All the fields are extracted from the same pass over the records.
+        """
+        result = dict((field, []) for field in fields)
+        for recid, json in self._iter_rows(recids, split_by):
+            for field in fields:
+                if include_recid:
+                    result[field].extend((recid, value)
+                                         for value in _get_values(json, field))
+                else:
+                    result[field].extend(_get_values(json, field))
+        return dict((field, _group_values(values, repetitive_values, count))
+                    for field, values in six.iteritems(result))
 
     def search(self, query):
         """See :meth:`~invenio.modules.jsonalchemy.storage.Storage.search`."""
@@ -19,9 +19,6 @@
 
 """Json Reader."""
 
-import re
-
-from invenio.modules.jsonalchemy.reader import ModelParser
 from invenio.modules.jsonalchemy.reader import Reader
 
 
@@ -42,9 +39,8 @@ class JsonReader(Reader):
         """
 
         """
-        model_fields = ModelParser.resolve_models(
-            self._json.model_info.names,
-            self._json.additional_info.namespace).get('fields', {})
+        model_fields = self._plan.resolve_models(
+            self._json.model_info.names).get('fields', {})
         model_json_ids = list(model_fields.keys())
         model_field_names = list(model_fields.values())
         for key in list(self._blob.keys()):
@@ -58,8 +54,7 @@ class JsonReader(Reader):
             return self._blob
         elements = []
         for k in regex_key:
-            regex = re.compile(k)
-            keys = filter(regex.match, self._blob.keys())
+            keys = self._get_blob_keys(k, self._blob.keys())
             values = []
             for key in keys:
                 values.append(self._blob.get(key))
@@ -25,17 +25,13 @@ cases. Instead :class:`~invenio.modules.jsonalchemy.readers.Reader` should be
 used with the explicit format.
 """
 
-import copy
 import re
 from six import iteritems
 from werkzeug.utils import import_string
 
 from invenio.base.globals import cfg
-from invenio.base.utils import try_to_eval
-
 from invenio.modules.jsonalchemy.reader import Reader
 from invenio.modules.jsonalchemy.errors import ReaderException
-from invenio.modules.jsonalchemy.registry import functions
 
 
 class MarcReader(Reader):
@@ -89,8 +85,7 @@ class MarcReader(Reader):
         if regex_key in ('entire_record', '*'):
             return self.rec_tree
         for k in regex_key:
-            regex = re.compile(k)
-            keys = filter(regex.match, self.rec_tree.keys())
+            keys = self._get_blob_keys(k, self.rec_tree.keys())
             for key in keys:
                 if key in self.rec_tree:
                     return (key, self.rec_tree.get(key, []))
@@ -165,16 +160,14 @@ class MarcReader(Reader):
                 field_def['source_tags'])
             if not isinstance(elements, (list, tuple)):
                 elements = (elements, )
+            tmp_field_def = self._plan.field_def_for_tag(field_def, marc_tag)
             for element in elements:
-                tmp_field_def = copy.deepcopy(field_def)
-                tmp_field_def['source_tags'] = [marc_tag, ]
                 if not self._evaluate_on_decorators(tmp_field_def, element):
                     continue
                 try:
-                    value = try_to_eval(
+                    value = self._plan.evaluate(
                         tmp_field_def['function'],
-                        functions(self._json.additional_info.namespace),
-                        value=element, self=self._json)
+                        {'value': element, 'self': self._json})
                     self._remove_none_values(value)
                     info = self._find_field_metadata(json_id, field_name,
                                                      'creator', tmp_field_def)
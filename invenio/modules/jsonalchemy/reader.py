@@ -27,9 +27,14 @@ reader depending of the master format of the input.
     >>> from invenio.modules.readers.api import Record
     >>> record = Reader.translate(blob, 'marc', Record, model=['picture'])
 """
+import copy
 import itertools
 import datetime
+import re
 import six
+import types
+
+from werkzeug.utils import cached_property, import_string
 
 from invenio.base.utils import try_to_eval
 
@@ -62,6 +67,216 @@ def split_blob(blob, master_format, slice_size=0, **kwargs):
                        readers[master_format].split_blob(blob, **kwargs))
 
 
+def _load_definitions(namespace):
+    """Parse the field and model definitions of ``namespace`` if needed."""
+    FieldParser.field_definitions(namespace)
+    ModelParser.model_definitions(namespace)
+    readers.keys()
+
+
+def _init_translate_worker(app, namespace):
+    """Initialize one worker process of :meth:`Reader.translate_many`.
+
+    The connections of the database engine inherited from the parent
+    process are dropped, so that the worker opens its own ones.
+    """
+    if app is not None:
+        app.app_context().push()
+        from invenio.ext.sqlalchemy import db
+        db.engine.dispose()
+    _load_definitions(namespace)
+
+
+def _translate_blob(args):
+    """Translate one blob inside a worker of :meth:`Reader.translate_many`.
+
+    :return: The JSON friendly representation of the new object.
+    """
+    blob, json_class, master_format, kwargs = args
+    return Reader.translate(blob, json_class, master_format, **kwargs).dumps()
+
+
+def translate_benchmark(blob=None, json_class=None, master_format='marc',
+                        repeats=3, **kwargs):
+    """Time the translation of the records in ``blob`` into ``json_class``.
+
+    By default the demo MARC records are translated into records.  The time
+    is measured once with a new :class:`RulePlan` built for every record and
+    once with the plan shared by all the records.  It needs the application
+    context, e.g. run it from ``inveniomanage shell``.
+
+    :return: dictionary with the number of records and, for the ``'new'``
+             and ``'shared'`` plans, the best time of ``repeats`` runs, in
+             seconds
+    """
+    import time
+    if blob is None:
+        import os
+        import pkg_resources
+        blob = pkg_resources.resource_string(
+            'invenio.testsuite',
+            os.path.join('data', 'demo_record_marc_data.xml'))
+    if json_class is None:
+        from invenio.modules.records.api import Record as json_class
+        kwargs.setdefault('namespace', 'recordext')
+    blobs = list(split_blob(blob, master_format, **kwargs))
+    stats = {'records': len(blobs)}
+    for shared_plan in (False, True):
+        timings = []
+        for dummy in range(repeats):
+            t1 = time.time()
+            for single_blob in blobs:
+                if not shared_plan:
+                    RulePlan._plans = {}
+                Reader.translate(single_blob, json_class, master_format,
+                                 **kwargs)
+            timings.append(time.time() - t1)
+        stats['shared' if shared_plan else 'new'] = min(timings)
+    return stats
+
+
+class RulePlan(object):
+
+    """Field rules of one namespace and master format ready to be applied.
+
+    The plan is built once from the field and model definitions and shared
+    by all the readers translating records of the same namespace and master
+    format.  It keeps the functions of the namespace, the compiled rule
+    functions and ``source_tags`` regular expressions, the decorator
+    evaluators of every rule and the resolved models, so that none of them
+    has to be looked up again for every record.
+
+    The plan is rebuilt as soon as the field or model definitions of the
+    namespace are parsed again.
+    """
+
+    _plans = {}
+
+    def __init__(self, namespace, master_format):
+        """Compile the rules of ``namespace`` for ``master_format``."""
+        self.namespace = namespace
+        self.master_format = master_format
+        self.field_definitions = FieldParser.field_definitions(namespace)
+        self.model_definitions = ModelParser.model_definitions(namespace)
+        self.functions = functions(namespace)
+        self.globals = dict(self.functions)
+        self._codes = {}
+        self._decorators = {}
+        self._field_defs = {}
+        self._models = {}
+        self._regexes = {}
+        self._patterns_by_key = {}
+        self.patterns = []
+        for rule in six.itervalues(self.field_definitions):
+            for field_def in rule.get('rules', {}).get(master_format, []):
+                source_tags = field_def.get('source_tags')
+                if source_tags in ('entire_record', '*'):
+                    continue
+                for pattern in source_tags or ():
+                    if pattern not in self._regexes:
+                        self._regexes[pattern] = re.compile(pattern)
+                        self.patterns.append(pattern)
+
+    @classmethod
+    def get(cls, namespace, master_format):
+        """Return the up to date plan for ``namespace`` and ``master_format``.
+        """
+        plan = cls._plans.get((namespace, master_format))
+        if plan is None or plan.field_definitions is not \
+                FieldParser.field_definitions(namespace) or \
+                plan.model_definitions is not \
+                ModelParser.model_definitions(namespace):
+            plan = cls._plans[(namespace, master_format)] = \
+                cls(namespace, master_format)
+        return plan
+
+    def resolve_models(self, model_names):
+        """Like :meth:`ModelParser.resolve_models` but computed only once."""
+        key = tuple(model_names) \
+            if isinstance(model_names, (list, tuple)) else model_names
+        if key not in self._models:
+            self._models[key] = ModelParser.resolve_models(model_names,
+                                                           self.namespace)
+        return self._models[key]
+
+    def index_keys(self, keys):
+        """Group the blob ``keys`` by the ``source_tags`` patterns they match.
+
+        :return: dictionary ``pattern: [key, ...]``, the keys keep the order
+            of ``keys``.
+        """
+        index = dict((pattern, []) for pattern in self.patterns)
+        for key in keys:
+            patterns = self._patterns_by_key.get(key)
+            if patterns is None:
+                patterns = self._patterns_by_key[key] = \
+                    [pattern for pattern in self.patterns
+                     if self._regexes[pattern].match(key)]
+            for pattern in patterns:
+                index[pattern].append(key)
+        return index
+
+    def decorators(self, field_def, kind):
+        """Return the ``(evaluator, args)`` pairs of the ``kind`` decorators.
+        """
+        key = (id(field_def), kind)
+        if key not in self._decorators:
+            if kind == 'before':
+                evaluators = FieldParser.decorator_before_extensions()
+            else:
+                evaluators = FieldParser.decorator_on_extensions()
+            # keep the field definition alive so that its id is not reused
+            self._decorators[key] = (field_def, [
+                (evaluators[name], content) for name, content
+                in six.iteritems(field_def['decorators'][kind])])
+        return self._decorators[key][1]
+
+    def field_def_for_tag(self, field_def, source_tag):
+        """Return a copy of ``field_def`` having ``source_tag`` as source.
+
+        The copy is shared by all the records, it must not be modified.
+        """
+        key = (id(field_def), source_tag)
+        if key not in self._field_defs:
+            tmp_field_def = copy.deepcopy(field_def)
+            tmp_field_def['source_tags'] = [source_tag, ]
+            self._field_defs[key] = (field_def, tmp_field_def)
+        return self._field_defs[key][1]
+
+    def evaluate(self, function, context):
+        """Evaluate the rule ``function`` like :func:`try_to_eval` does.
+
+        The function is compiled only once and the modules it needs are
+        imported only once.
+
+        :param context: names available to the function, e.g. ``value``.
+        """
+        if not function:
+            return None
+        code = self._codes.get(function)
+        if code is None:
+            code = self._codes[function] = compile(function, '<string>',
+                                                   'eval')
+        while True:
+            scope = dict(self.globals)
+            scope.update(context)
+            try:
+                # kwalitee: disable=eval
+                res = eval(code, scope)
+                break
+            except NameError as err:
+                import_name = str(err).split("'")[1]
+                if import_name in self.globals:
+                    raise
+                try:
+                    self.globals[import_name] = import_string(import_name)
+                except ImportError:
+                    return try_to_eval(function, self.functions, **context)
+        if isinstance(res, types.ModuleType):
+            raise ImportError
+        return res
+
+
 class Reader(object):  # pylint: disable=R0921
 
     """Base reader."""
@@ -80,6 +295,13 @@ class Reader(object):  # pylint: disable=R0921
             else json.get_blob()
         self._json = json
         self._parsed = []
+        self._blob_index = None
+
+    @cached_property
+    def _plan(self):
+        """Rule plan for the namespace and master format of the json."""
+        return RulePlan.get(self._json.additional_info.namespace,
+                            self._json.additional_info.master_format)
 
     @staticmethod
     def split_blob(blob, schema=None, **kwargs):
@@ -114,12 +336,60 @@ class Reader(object):  # pylint: disable=R0921
 
         json = json_class(master_format=master_format, **kwargs)
         # fill up with all possible fields
-        fields = ModelParser.resolve_models(json.model_info.names,
-                                            json.additional_info.namespace
-                                            ).get('fields')
+        fields = RulePlan.get(json.additional_info.namespace, master_format)\
+            .resolve_models(json.model_info.names).get('fields')
         cls.add(json, fields, blob, fetch_model_info=True)
         return json
 
+    @classmethod
+    def translate_many(cls, blobs, json_class, master_format='json',
+                       processes=None, chunksize=10, **kwargs):
+        """Transform many blobs into json structures using a process pool.
+
+        Each of the ``blobs`` is split by record using :func:`split_blob` and
+        each record is translated as in :meth:`translate`.  The field and
+        model definitions are parsed before the worker processes are started
+        so that none of them has to parse them again.
+
+        :param blobs: iterable of incoming blobs (like MARC)
+        :param processes: number of worker processes, by default the number
+            of CPUs.  If set to ``1`` the records are translated in the
+            current process.
+        :param chunksize: number of records sent to a worker at once.
+        :param kwargs: parameters to pass to :func:`split_blob` and to
+            ``json_class``
+
+        :return: Iterator over the new objects of ``json_class`` type, in the
+            same order as the records inside ``blobs``.
+        """
+        from flask import current_app
+        from multiprocessing import Pool
+
+        single_blobs = (single_blob for blob in blobs
+                        for single_blob in split_blob(blob, master_format,
+                                                      **kwargs))
+        if processes == 1:
+            for single_blob in single_blobs:
+                yield cls.translate(single_blob, json_class, master_format,
+                                    **kwargs)
+            return
+
+        namespace = json_class(master_format=master_format, **kwargs)\
+            .additional_info.namespace
+        _load_definitions(namespace)
+        app = current_app._get_current_object() if current_app else None
+        pool = Pool(processes, _init_translate_worker, (app, namespace))
+        try:
+            for json in pool.imap(_translate_blob,
+                                  ((single_blob, json_class, master_format,
+                                    kwargs) for single_blob in single_blobs),
+                                  chunksize):
+                yield json_class(json)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
     @classmethod
     def add(cls, json, fields, blob=None, fetch_model_info=False):
         """Add the list of fields to the json structure.
@@ -140,9 +410,8 @@ class Reader(object):  # pylint: disable=R0921
         if isinstance(fields, six.string_types):
             fields = (fields, )
         if isinstance(fields, (list, tuple)):
-            model_fields = ModelParser.resolve_models(
-                json.model_info.names,
-                json.additional_info.namespace).get('fields')
+            model_fields = reader._plan.resolve_models(
+                json.model_info.names).get('fields')
             fields = dict(
                 (field_name, model_fields.get(field_name, field_name))
                 for field_name in fields)
@@ -242,8 +511,7 @@ class Reader(object):  # pylint: disable=R0921
             self._json['__meta_metadata__']['__model_info__']['names'] = \
                 self._guess_model_from_input()
 
-        model = ModelParser.resolve_models(
-            self._json.model_info.names, self._json.additional_info.namespace)
+        model = self._plan.resolve_models(self._json.model_info.names)
 
         for key, value in six.iteritems(model):
             if key in ('fields', 'bases'):
@@ -287,6 +555,24 @@ class Reader(object):  # pylint: disable=R0921
         """
         raise NotImplementedError()
 
+    def _get_blob_keys(self, regex, keys):
+        """Return the ``keys`` of the blob matching the ``regex`` pattern.
+
+        All the ``keys`` are matched against the ``source_tags`` of all the
+        rules at once, the first time this method is called.
+
+        :param regex: one of the ``source_tags`` of a rule.
+        :param keys: all the keys of the blob.
+
+        :return: List of matching keys, in the same order as ``keys``
+        """
+        if self._blob_index is None:
+            self._blob_index = self._plan.index_keys(keys)
+        try:
+            return self._blob_index[regex]
+        except KeyError:
+            return filter(re.compile(regex).match, keys)
+
     def _unpack_rule(self, json_id, field_name=None):
         """
         From the field definitions extract the rules an tries to apply them to
@@ -348,10 +634,9 @@ class Reader(object):  # pylint: disable=R0921
                     if not self._evaluate_on_decorators(field_def, element):
                         continue
                     try:
-                        value = try_to_eval(
+                        value = self._plan.evaluate(
                             field_def['function'],
-                            functions(self._json.additional_info.namespace),
-                            value=element, self=self._json)
+                            {'value': element, 'self': self._json})
                         self._remove_none_values(value)
                         info = self._find_field_metadata(json_id, field_name,
                                                          'creator', field_def)
@@ -381,10 +666,8 @@ class Reader(object):  # pylint: disable=R0921
                 if not self._evaluate_before_decorators(field_def):
                     continue
                 try:
-                    value = try_to_eval(
-                        field_def['function'],
-                        functions(self._json.additional_info.namespace),
-                        self=self._json)
+                    value = self._plan.evaluate(field_def['function'],
+                                                {'self': self._json})
                     self._remove_none_values(value)
                     info = self._find_field_metadata(json_id, field_name,
                                                      field_type, field_def)
@@ -532,7 +815,8 @@ class Reader(object):  # pylint: disable=R0921
         elif field_type == 'UNKNOWN':
             info['function'] = 'UNKNOWN'
         else:
-            info['function'] = field_def['source_tags']
+            # the field definitions are shared by all the records
+            info['function'] = copy.copy(field_def['source_tags'])
 
         # Decorator extensions
         info['after'] = dict()
@@ -577,18 +861,17 @@ class Reader(object):  # pylint: disable=R0921
 
     def _evaluate_before_decorators(self, field_def):
         """Evaluate all the before decorators (they must return a boolean)."""
-        for name, content in six.iteritems(field_def['decorators']['before']):
-            if not FieldParser.decorator_before_extensions()[name]\
-                    .evaluate(self, content):
+        for evaluator, content in self._plan.decorators(field_def, 'before'):
+            if not evaluator.evaluate(self, content):
                 return False
         return True
 
     def _evaluate_on_decorators(self, field_def, master_value):
         """Evaluate all the on decorators (they must return a boolean."""
-        for name, content in six.iteritems(field_def['decorators']['on']):
-            if not FieldParser.decorator_on_extensions()[name]\
-                    .evaluate(master_value,
-                              self._json.additional_info.namespace, content):
+        for evaluator, content in self._plan.decorators(field_def, 'on'):
+            if not evaluator.evaluate(master_value,
+                                      self._json.additional_info.namespace,
+                                      content):
                 return False
         return True
 
@@ -1406,6 +1406,109 @@ class TestMarcReader(InvenioTestCase):
         for d in partial_result:
             self.assertTrue(d in json_for_marc)
 
+    def test_rule_plan(self):
+        """JSONAlchemy - rule plan is shared and gives the same output"""
+        from invenio.modules.jsonalchemy.parser import FieldParser
+        from invenio.modules.jsonalchemy.reader import Reader, RulePlan
+        from invenio.modules.jsonalchemy.wrappers import SmartJson
+        blob = """
+            <record>
+                <controlfield tag="001">8</controlfield>
+                <datafield tag="100" ind1=" " ind2=" ">
+                <subfield code="a">Efstathiou, G P</subfield>
+                </datafield>
+                <datafield tag="245" ind1=" " ind2=" ">
+                <subfield code="a">Constraints on $\Omega_{\Lambda }$</subfield>
+                </datafield>
+                <datafield tag="700" ind1=" " ind2=" ">
+                <subfield code="a">Bridle, S L</subfield>
+                </datafield>
+            </record>
+        """
+        jsons = []
+        for dummy in range(2):
+            RulePlan._plans = {}
+            jsons.append(Reader.translate(
+                blob, SmartJson, master_format='marc',
+                namespace='testsuite').dumps(without_meta_metadata=True))
+        jsons.append(Reader.translate(
+            blob, SmartJson, master_format='marc',
+            namespace='testsuite').dumps(without_meta_metadata=True))
+        self.assertEqual(jsons[0], jsons[1])
+        self.assertEqual(jsons[0], jsons[2])
+        self.assertEqual(jsons[0]['recid'], 8)
+
+        plan = RulePlan.get('testsuite', 'marc')
+        self.assertTrue(plan is RulePlan.get('testsuite', 'marc'))
+        FieldParser.reparse('testsuite')
+        self.assertFalse(plan is RulePlan.get('testsuite', 'marc'))
+
+    def test_rule_plan_legacy(self):
+        """JSONAlchemy - rule plan gives the legacy output on demo records"""
+        import copy
+        import os
+        import re
+        import pkg_resources
+        from invenio.base.utils import try_to_eval
+        from invenio.modules.jsonalchemy.parser import FieldParser, \
+            ModelParser
+        from invenio.modules.jsonalchemy.reader import Reader, RulePlan, \
+            split_blob
+        from invenio.modules.jsonalchemy.registry import functions
+        from invenio.modules.jsonalchemy.wrappers import SmartJson
+
+        class LegacyRulePlan(RulePlan):
+
+            """Plan looking everything up again like the readers used to."""
+
+            def resolve_models(self, model_names):
+                return ModelParser.resolve_models(model_names, self.namespace)
+
+            def index_keys(self, keys):
+                return dict((pattern, filter(re.compile(pattern).match, keys))
+                            for pattern in self.patterns)
+
+            def decorators(self, field_def, kind):
+                if kind == 'before':
+                    evaluators = FieldParser.decorator_before_extensions()
+                else:
+                    evaluators = FieldParser.decorator_on_extensions()
+                return [(evaluators[name], content) for name, content
+                        in field_def['decorators'][kind].items()]
+
+            def field_def_for_tag(self, field_def, source_tag):
+                tmp_field_def = copy.deepcopy(field_def)
+                tmp_field_def['source_tags'] = [source_tag, ]
+                return tmp_field_def
+
+            def evaluate(self, function, context):
+                return try_to_eval(function, functions(self.namespace),
+                                   **context)
+
+        def translate(blob):
+            json = Reader.translate(blob, SmartJson, master_format='marc',
+                                    namespace='testsuite')
+            dump = json.dumps()
+            meta_metadata = dump.pop('__meta_metadata__')
+            for info in meta_metadata.values():
+                if isinstance(info, dict):
+                    info.pop('timestamp', None)
+            return dump, meta_metadata
+
+        blob = pkg_resources.resource_string(
+            'invenio.testsuite',
+            os.path.join('data', 'demo_record_marc_data.xml'))
+        blobs = list(split_blob(blob, 'marc'))
+        self.assertTrue(len(blobs) > 100)
+        RulePlan._plans = {}
+        RulePlan.get('testsuite', 'marc')
+        jsons = [translate(single_blob) for single_blob in blobs]
+        for single_blob, json in zip(blobs, jsons):
+            RulePlan._plans[('testsuite', 'marc')] = \
+                LegacyRulePlan('testsuite', 'marc')
+            self.assertEqual(translate(single_blob), json)
+        RulePlan._plans = {}
+
 
 TEST_SUITE = make_test_suite(TestReader, TestMarcReader, TestJSONReader)
 
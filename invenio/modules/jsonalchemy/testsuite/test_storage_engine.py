@@ -60,7 +60,61 @@ class TestStorageEngineConfig(InvenioTestCase):
         self.assertEqual(DummyJson.storage_engine.get_one(1)['_id'],
                          database[1]['_id'])
 
-TEST_SUITE = make_test_suite(TestStorageEngineConfig)
+
+class TestSQLAlchemyStorage(InvenioTestCase):
+    """Test for bulk operations of the SQLAlchemy storage engine."""
+
+    def setUp(self):
+        """Create the storage engine on top of an in-memory database."""
+        from sqlalchemy import Column, Integer, create_engine
+        from sqlalchemy.ext.declarative import declarative_base
+        from sqlalchemy.orm import scoped_session, sessionmaker
+        from sqlalchemy.pool import StaticPool
+        from sqlalchemy_utils import JSONType
+        from invenio.modules.jsonalchemy.jsonext.engines import sqlalchemy
+
+        class Backend(object):
+            engine = create_engine('sqlite://', poolclass=StaticPool,
+                                   connect_args={'check_same_thread': False})
+            session = scoped_session(sessionmaker(bind=engine))
+
+        class DummyModel(declarative_base()):
+            __tablename__ = 'dummy_json'
+            id = Column(Integer, primary_key=True)
+            json = Column(JSONType)
+
+        self.storage = sqlalchemy.SQLAlchemyStorage(
+            DummyModel, sqlalchemy_backend=Backend(), chunk_size=3)
+        self.jsons = [{'_id': i, 'title': {'title': 'title %d' % (i % 3)},
+                       'authors': [{'full_name': 'Ellis, J'},
+                                   {'full_name': 'Author %d' % i}]}
+                      for i in range(1, 11)]
+
+    def test_save_and_update_many(self):
+        """jsonalchemy - sqlalchemy storage bulk insert and upsert"""
+        self.storage.save_many(self.jsons[:5])
+        self.jsons[0]['title']['title'] = 'new title'
+        self.storage.update_many([self.jsons[0]] + self.jsons[3:])
+        self.assertEqual(list(self.storage.get_many(range(10, 0, -1))),
+                         self.jsons)
+
+    def test_get_field_values(self):
+        """jsonalchemy - sqlalchemy storage field values of many records"""
+        self.storage.save_many(self.jsons)
+        self.assertEqual(
+            self.storage.get_field_values([5, 3], 'authors.full_name',
+                                          include_recid=True),
+            [(3, 'Ellis, J'), (3, 'Author 3'),
+             (5, 'Ellis, J'), (5, 'Author 5')])
+        self.assertEqual(
+            self.storage.get_fields_values(range(1, 11),
+                                           ['title.title', 'authors.full_name'],
+                                           repetitive_values=False, count=True,
+                                           split_by=4)['title.title'],
+            [('title 1', 4), ('title 2', 3), ('title 0', 3)])
+
+
+TEST_SUITE = make_test_suite(TestStorageEngineConfig, TestSQLAlchemyStorage)
 
 if __name__ == '__main__':
     run_test_suite(TEST_SUITE)
@@ -182,6 +182,21 @@ class OaiHARVESTLOG(db.Model):
     schtask = db.relationship(SchTASK)
 
 
+class OaiRESUMPTIONTOKEN(db.Model):
+
+    """Represents a OaiRESUMPTIONTOKEN record."""
+
+    __tablename__ = 'oaiRESUMPTIONTOKEN'
+    token = db.Column(db.String(255), nullable=False, primary_key=True)
+    set_spec = db.Column(db.String(255), nullable=False, server_default='',
+                         index=True)
+    expiration_date = db.Column(db.DateTime, nullable=False,
+                                server_default='1900-01-01 00:00:00',
+                                index=True)
+    value = db.Column(db.iLargeBinary, nullable=True)
+
+
 __all__ = ('OaiHARVEST',
            'OaiREPOSITORY',
-           'OaiHARVESTLOG')
+           'OaiHARVESTLOG',
+           'OaiRESUMPTIONTOKEN')
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Add the oaiRESUMPTIONTOKEN table."""
+
+import sqlalchemy as sa
+import warnings
+from invenio.modules.upgrader.api import op
+from sqlalchemy.dialects import mysql
+
+depends_on = ['oaiharvester_2014_09_09_initial']
+
+
+def info():
+    return "New oaiRESUMPTIONTOKEN table for OAI-PMH resumption tokens."
+
+
+def do_upgrade():
+    """Implement your upgrades here."""
+    op.create_table(
+        'oaiRESUMPTIONTOKEN',
+        sa.Column('token', sa.String(length=255), nullable=False),
+        sa.Column('set_spec', sa.String(length=255), nullable=False,
+                  server_default=''),
+        sa.Column('expiration_date', sa.DateTime(), nullable=False,
+                  server_default='1900-01-01 00:00:00'),
+        sa.Column('value', mysql.LONGBLOB(), nullable=True),
+        sa.PrimaryKeyConstraint('token'),
+        mysql_charset='utf8',
+        mysql_engine='MyISAM'
+    )
+    op.create_index('ix_oaiRESUMPTIONTOKEN_set_spec', 'oaiRESUMPTIONTOKEN',
+                    ['set_spec'])
+    op.create_index('ix_oaiRESUMPTIONTOKEN_expiration_date',
+                    'oaiRESUMPTIONTOKEN', ['expiration_date'])
+
+
+def estimate():
+    """Estimate running time of upgrade in seconds (optional)."""
+    return 1
+
+
+def pre_upgrade():
+    """Run pre-upgrade checks (optional)."""
+    pass
+
+
+def post_upgrade():
+    """Run post-upgrade checks (optional)."""
+    warnings.warn("Expired OAI resumption tokens are not deleted by the "
+                  "OAI repository anymore: please schedule the periodic "
+                  "tasklet, e.g. `bibtasklet -T bst_oai_cache_gc -s 1h`.")
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""OAI Repository resumption tokens garbage collector tasklet."""
+
+from invenio.legacy.bibsched.bibtask import write_message, \
+    task_update_progress
+from invenio.legacy.oairepository.server import oai_cache_gc
+
+
+def bst_oai_cache_gc():
+    """Delete the expired OAI-PMH resumption tokens.
+
+    Meant to be run periodically, e.g. every hour::
+
+        $ bibtasklet -T bst_oai_cache_gc -s 1h
+    """
+    task_update_progress("Deleting expired resumption tokens.")
+    count = oai_cache_gc()
+    write_message("Deleted %d expired resumption tokens." % count)
+    task_update_progress("Done.")
+    return 1
@@ -23,13 +23,19 @@
 __revision__ = "$Id$"
 
 
+import os
 import re
+import shutil
+import tempfile
+import time
 from six import StringIO
 
 from invenio.base.wrappers import lazy_import
 from invenio.testsuite import make_test_suite, run_test_suite, InvenioTestCase
 
 oai_repository_server = lazy_import('invenio.legacy.oairepository.server')
+resumption_tokens = lazy_import(
+    'invenio.legacy.oairepository.resumption_tokens')
 
 
 class TestVerbs(InvenioTestCase):
@@ -82,8 +88,166 @@ class TestErrorCodes(InvenioTestCase):
 
         self.assertNotEqual([], [code for (code, dummy_text) in oai_repository_server.check_argd({'verb': 'ListRecords', 'resumptionToken': ''}) if code == 'badResumptionToken'])
 
+
+class FakeRedis(object):
+    """In-memory Redis client with expiration of the keys."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        value, expiration_time = self.data.get(key, (None, None))
+        if expiration_time is not None and expiration_time < time.time():
+            return None
+        return value
+
+    def set(self, key, value, timeout=None):
+        self.data[key] = (value, timeout and time.time() + timeout)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class ResumptionTokenStoreTests(object):
+    """Tests of a resumption token store, to be mixed with a test case
+    whose setUp() sets 'store' and which implements _expire()."""
+
+    def _dump(self, set_spec):
+        """Store a harvest of SET_SPEC and return its token."""
+        token = self.store.generate(set_spec)
+        self.store.dump(token, {'argd': {'set': set_spec}, 'cursor': 1})
+        return token
+
+    def _expire(self, token):
+        """Make TOKEN older than CFG_OAI_EXPIRE."""
+        raise NotImplementedError
+
+    def test_dump_and_load(self):
+        """oairepository - resumption token dump and load"""
+        token = self._dump('a')
+        self.assertEqual(self.store.load(token),
+                         {'argd': {'set': 'a'}, 'cursor': 1})
+        self.assertRaises(IOError, self.store.load, 'unknown')
+
+    def test_invalidate_set(self):
+        """oairepository - resumption tokens of modified sets"""
+        tokens = dict((set_spec, self._dump(set_spec))
+                      for set_spec in ('', 'a', 'a:b', 'c'))
+        self.store.invalidate_set('a:b')
+        for set_spec in ('', 'a', 'a:b'):
+            self.assertRaises(IOError, self.store.load, tokens[set_spec])
+        self.assertEqual(self.store.load(tokens['c'])['argd']['set'], 'c')
+
+    def test_gc(self):
+        """oairepository - expired resumption tokens garbage collection"""
+        expired, valid = self._dump('a'), self._dump('a')
+        self._expire(expired)
+        self.assertRaises(IOError, self.store.load, expired)
+        self.store.gc()
+        self.assertRaises(IOError, self.store.load, expired)
+        self.assertEqual(self.store.load(valid)['cursor'], 1)
+
+
+class TestResumptionTokens(ResumptionTokenStoreTests, InvenioTestCase):
+    """Test for the storage of resumption tokens."""
+
+    def setUp(self):
+        """Use a file store in a temporary directory."""
+        self.cache_dir = tempfile.mkdtemp()
+        self.store = resumption_tokens.FileResumptionTokenStore(
+            self.cache_dir)
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        shutil.rmtree(self.cache_dir)
+
+    def _expire(self, token):
+        old = time.time() - resumption_tokens.CFG_OAI_EXPIRE - 1
+        os.utime(os.path.join(self.cache_dir, token), (old, old))
+
+    def test_set_spec_and_parents(self):
+        """oairepository - parents of a set spec"""
+        self.assertEqual(resumption_tokens.get_set_spec_and_parents('a:b'),
+                         ['a:b', 'a', ''])
+        self.assertEqual(resumption_tokens.get_set_spec_and_parents('a'),
+                         ['a', ''])
+        self.assertEqual(resumption_tokens.get_set_spec_and_parents(''),
+                         [''])
+
+    def test_load_outside_of_cache_dir(self):
+        """oairepository - resumption token file path"""
+        self.assertRaises(ValueError, self.store.load, '../unknown')
+
+    def test_gc_removes_files(self):
+        """oairepository - expired resumption token files are removed"""
+        expired, valid = self._dump('a'), self._dump('a')
+        self._expire(expired)
+        self.assertEqual(self.store.gc(), 1)
+        self.assertEqual(os.listdir(self.cache_dir), [valid])
+
+
+class TestSQLResumptionTokens(ResumptionTokenStoreTests, InvenioTestCase):
+    """Test for the storage of resumption tokens in the database."""
+
+    def setUp(self):
+        """Use the SQL store, remembering the tokens created."""
+        from invenio.legacy.dbquery import run_sql
+        self.run_sql = run_sql
+        self.store = resumption_tokens.SQLResumptionTokenStore()
+        self.tokens = []
+
+    def tearDown(self):
+        """Remove the tokens created."""
+        for token in self.tokens:
+            self.run_sql("DELETE FROM oaiRESUMPTIONTOKEN WHERE token=%s",
+                         (token, ))
+
+    def _dump(self, set_spec):
+        token = super(TestSQLResumptionTokens, self)._dump(set_spec)
+        self.tokens.append(token)
+        return token
+
+    def _expire(self, token):
+        self.run_sql("""UPDATE oaiRESUMPTIONTOKEN
+                        SET expiration_date=DATE_SUB(NOW(), INTERVAL 1 SECOND)
+                        WHERE token=%s""", (token, ))
+
+
+class TestRedisResumptionTokens(ResumptionTokenStoreTests, InvenioTestCase):
+    """Test for the storage of resumption tokens in Redis."""
+
+    def setUp(self):
+        """Use the Redis store on an in-memory Redis."""
+        self.redis = FakeRedis()
+        self.store = resumption_tokens.RedisResumptionTokenStore(self.redis)
+
+    def _expire(self, token):
+        key = self.store.token_key % token
+        self.redis.data[key] = (self.redis.data[key][0], time.time() - 1)
+
+    def test_no_redis_host(self):
+        """oairepository - resumption tokens in Redis need a Redis host"""
+        store = resumption_tokens.CFG_OAI_RESUMPTION_TOKEN_STORE
+        get_redis = resumption_tokens.get_redis
+        resumption_tokens.CFG_OAI_RESUMPTION_TOKEN_STORE = 'redis'
+        resumption_tokens.get_redis = \
+            lambda: resumption_tokens.DummyRedisClient()
+        resumption_tokens._RESUMPTION_TOKEN_STORE[:] = []
+        try:
+            self.assertTrue(isinstance(
+                resumption_tokens.get_resumption_token_store(),
+                resumption_tokens.FileResumptionTokenStore))
+        finally:
+            resumption_tokens.CFG_OAI_RESUMPTION_TOKEN_STORE = store
+            resumption_tokens.get_redis = get_redis
+            resumption_tokens._RESUMPTION_TOKEN_STORE[:] = []
+
+
 TEST_SUITE = make_test_suite(TestVerbs,
-                             TestErrorCodes)
+                             TestErrorCodes,
+                             TestResumptionTokens,
+                             TestSQLResumptionTokens,
+                             TestRedisResumptionTokens)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
@@ -21,8 +21,15 @@
 
 __revision__ = "$Id$"
 
+import os
+import shutil
+import tempfile
+
+from invenio.base.wrappers import lazy_import
 from invenio.testsuite import make_test_suite, run_test_suite, InvenioTestCase
 
+bibrank_citation_searcher = lazy_import('invenio.legacy.bibrank.citation_searcher')
+
 
 class TestCitationSearcher(InvenioTestCase):
 
@@ -51,7 +58,62 @@ class TestCitationSearcher(InvenioTestCase):
         """bibrank citation searcher - get co-cited-with data"""
         # FIXME: test postponed
 
-TEST_SUITE = make_test_suite(TestCitationSearcher,)
+
+class TestCitationDictsSnapshot(InvenioTestCase):
+
+    def setUp(self):
+        # pylint: disable=C0103
+        """Initialize stuff"""
+        self.path = tempfile.mkdtemp()
+        self.weights = {10: 2, 3: 5, 7: 2, 42: 1}
+        self.selfcites = {3: 4, 42: 1}
+
+    def tearDown(self):
+        # pylint: disable=C0103
+        """Remove the snapshots"""
+        shutil.rmtree(self.path)
+
+    def test_no_snapshot(self):
+        """bibrank citation searcher - no citation dictionaries snapshot"""
+        self.assertEqual(None,
+            bibrank_citation_searcher.load_citation_dicts_snapshot(self.path))
+
+    def test_snapshot_dicts(self):
+        """bibrank citation searcher - citation dictionaries snapshot"""
+        bibrank_citation_searcher.store_citation_dicts_snapshot(
+            self.weights, self.selfcites, self.path)
+        alldicts = bibrank_citation_searcher.load_citation_dicts_snapshot(
+            self.path)
+        weights = alldicts['citations_weights']
+        self.assertEqual(5, weights[3])
+        self.assertEqual(0, weights.get(4, 0))
+        self.assertTrue(42 in weights)
+        self.assertEqual(self.weights, dict(weights.iteritems()))
+        self.assertEqual([3, 7, 10, 42], list(alldicts['citations_keys']))
+        self.assertEqual([(3, 5), (7, 2), (10, 2), (42, 1)],
+                         list(alldicts['citations_counts']))
+        self.assertEqual({10: 2, 3: 1, 7: 2, 42: 0},
+                         dict(alldicts['selfcites_weights'].iteritems()))
+        self.assertEqual([(7, 2), (10, 2), (3, 1), (42, 0)],
+                         list(alldicts['selfcites_counts']))
+        self.assertEqual([7, 10],
+            list(alldicts['citations_counts'].get_recids_with_counts(2, 2)))
+        self.assertEqual([3, 7, 10],
+            list(alldicts['citations_counts'].get_recids_with_counts(2)))
+
+    def test_newer_snapshot_replaces_older(self):
+        """bibrank citation searcher - newer snapshot replaces older one"""
+        bibrank_citation_searcher.store_citation_dicts_snapshot(
+            self.weights, self.selfcites, self.path)
+        bibrank_citation_searcher.store_citation_dicts_snapshot(
+            {1: 1}, {}, self.path)
+        alldicts = bibrank_citation_searcher.load_citation_dicts_snapshot(
+            self.path)
+        self.assertEqual([(1, 1)], list(alldicts['citations_counts']))
+        self.assertEqual(2, len(os.listdir(self.path)))
+
+TEST_SUITE = make_test_suite(TestCitationSearcher,
+                             TestCitationDictsSnapshot,)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
@@ -53,6 +53,21 @@ class TestCiterankIndexer(InvenioTestCase):
         dict_of_ranks = bibrank_citerank_indexer.run_pagerank(self.cit, self.dict_of_ids, len(self.dict_of_ids), self.ref, self.damping_factor, self.conv_threshold, self.check_point, self.dates)
         self.assertEqual({96: 0.622, 18: 1.1419839999999999, 74: 0.88200100000000003, 77: 1.142002, 78: 1.6020020000000001, 79: 0.86200299999999996, 80: 0.62200199999999994, 81: 2.712002, 82: 0.62200199999999994, 83: 0.62200299999999997, 84: 1.6520029999999999, 85: 0.62200299999999997, 86: 0.62200299999999997, 87: 0.62200299999999997, 88: 0.62200299999999997, 89: 0.62200500000000003, 91: 0.88200699999999999, 92: 0.62200599999999995, 94: 1.1419969999999999, 95: 1.8519990000000002}, dict_of_ranks)
 
+    def test_sparse_dot(self):
+        """bibrank citerank indexer - sparse matrix times vector"""
+        from numpy import array, float64, int32
+        sparse = (array([0, 2, 2, 1], int32), array([1, 0, 2, 1], int32),
+                  array([0.5, 2.0, 1.0, 3.0], float64))
+        self.assertEqual([1.0, 6.0, 5.0],
+                         list(bibrank_citerank_indexer.sparse_dot(
+                             sparse, array([2.0, 2.0, 1.0]), 3)))
+
+    def test_statistics_on_sparse(self):
+        """bibrank citerank indexer - count papers citing themselves"""
+        sparse, dummy, dummy = bibrank_citerank_indexer.construct_sparse_matrix(
+            self.cit, self.ref, self.dict_of_ids, 20, self.damping_factor)
+        self.assertEqual(0, bibrank_citerank_indexer.statistics_on_sparse(sparse))
+
 TEST_SUITE = make_test_suite(TestCiterankIndexer,)
 
 if __name__ == "__main__":
@@ -48,6 +48,33 @@ class TestListSetOperations(InvenioTestCase):
         self.assertEqual(({1: 7, 2: 7, 5: 5}, {1: 1, 2: 1, 5: 1}),  bibrank_word_searcher.calculate_record_relevance(("testterm", 2.0),
 {"Gi":(0, 50.0), 1: (3, 4.0), 2: (4, 5.0), 5: (1, 3.5)}, hitset, {}, {}, 0, None))
 
+    def test_record_sorter_arrays(self):
+        """bibrank record sorter - sorting records held in arrays"""
+        from invenio.legacy.bibrank import word_searcher as bibrank_word_searcher
+        from intbitset import intbitset
+        import numpy
+        hitset = intbitset()
+        hitset += (1,2,5)
+        hitset2 = intbitset()
+        hitset2.add(5)
+        recdict = numpy.array([0, 50, 30, 70, 10, 0], dtype=numpy.int64)
+        rec_termcount = numpy.array([0, 1, 1, 1, 1, 0], dtype=numpy.int32)
+        (res1, res2) = bibrank_word_searcher.sort_record_relevance_arrays(recdict, rec_termcount, hitset, 50, 0)
+        self.assertEqual(([(1, 71), (3, 100)], list(hitset2)), (res1, list(res2)))
+        (res1, res2) = bibrank_word_searcher.sort_record_relevance_arrays(recdict, rec_termcount, intbitset([1, 2, 5]), 0, 0, 2)
+        self.assertEqual([(2, 42), (4, 14), (1, 71), (3, 100)], res1)
+
+    def test_calculate_record_relevance_arrays(self):
+        """bibrank record sorter - calculating relevances in arrays"""
+        from invenio.legacy.bibrank import word_searcher as bibrank_word_searcher
+        from intbitset import intbitset
+        import numpy
+        hitset_mask = bibrank_word_searcher.get_hitset_mask(intbitset((1,2,5)))
+        (recdict, rec_termcount) = bibrank_word_searcher.calculate_record_relevance_arrays(("testterm", 2.0),
+{"Gi":(0, 50.0), 1: (3, 4.0), 2: (4, 5.0), 5: (1, 3.5)}, hitset_mask,
+            numpy.zeros(6, dtype=numpy.int64), numpy.zeros(6, dtype=numpy.int32), 0, None)
+        self.assertEqual(([0, 7, 7, 0, 0, 5], [0, 1, 1, 0, 0, 1]), (recdict.tolist(), rec_termcount.tolist()))
+
 TEST_SUITE = make_test_suite(TestListSetOperations,)
 
 if __name__ == "__main__":
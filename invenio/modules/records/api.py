@@ -52,9 +52,45 @@ class Record(SmartJson):
         return Reader.translate(blob, Record, master_format, **kwargs)
 
     @classmethod
-    def create_many(cls, blobs, master_format, **kwargs):
-        """Create many new record from the blob using the right reader."""
-        raise NotImplementedError()
+    def create_many(cls, blobs, master_format, processes=None, save=False,
+                    chunk_size=1000, **kwargs):
+        """Create many new records from the blobs using the right reader.
+
+        The blobs are split by record and translated in parallel, see
+        :meth:`~invenio.modules.jsonalchemy.reader.Reader.translate_many`.
+
+        :param blobs: one blob or an iterable of blobs.
+        :param processes: number of processes used to translate the records.
+        :param save: if set to ``True`` the JSON of the records having a
+            ``recid`` is stored, using one bulk storage call for every
+            ``chunk_size`` records.
+        :return: iterator over the new records in input order.
+        """
+        if isinstance(blobs, six.string_types):
+            blobs = (blobs, )
+        records = Reader.translate_many(blobs, Record, master_format,
+                                        processes=processes, **kwargs)
+        if not save:
+            return records
+        return cls._save_many(records, chunk_size)
+
+    @classmethod
+    def _save_many(cls, records, chunk_size):
+        """Store the JSON of the records in chunks while iterating them."""
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                cls.storage_engine.update_many(
+                    [r.dumps() for r in chunk if 'recid' in r])
+                for r in chunk:
+                    yield r
+                chunk = []
+        if chunk:
+            cls.storage_engine.update_many(
+                [r.dumps() for r in chunk if 'recid' in r])
+            for r in chunk:
+                yield r
 
     @classmethod
     def get_record(cls, recid, reset_cache=False):
@@ -90,6 +126,16 @@ class Record(SmartJson):
         db.session.commit()
         return record
 
+    @classmethod
+    def get_many(cls, recids):
+        """Get many records from the DB ordered by recid.
+
+        Only the records whose JSON is stored are returned, their JSON is
+        not created again if missing.
+        """
+        for json in cls.storage_engine.get_many(recids):
+            yield Record(json)
+
     @classmethod
     def get_blob(cls, recid):
         """Get the blob from where the record was created."""
@@ -238,8 +284,32 @@ class Record(SmartJson):
                 "There was an error while parsing MARCXML: %s" % (errors,))
         return record
 
+
+def get_records_benchmark(recids=None, nb_records=100000):
+    """Compare loading of records one by one and in bulk.
+
+    Loads ``recids`` (by default the first ``nb_records`` records) through
+    :meth:`Record.get_record` and through :meth:`Record.get_many`.
+
+    :return: dictionary with, for each method, the number of records
+             loaded and the time spent, in seconds
+    """
+    import time
+    if recids is None:
+        recids = [recid for recid, in RecordModel.query.with_entities(
+            RecordModel.id).order_by(RecordModel.id).limit(nb_records)]
+    t1 = time.time()
+    for recid in recids:
+        Record.get_record(recid)
+    t2 = time.time()
+    nb_bulk = sum(1 for dummy in Record.get_many(recids))
+    t3 = time.time()
+    return {'Record.get_record': (len(recids), t2 - t1),
+            'Record.get_many': (nb_bulk, t3 - t2)}
+
 # Functional interface
 create_record = Record.create
 create_records = Record.create_many
 get_record = Record.get_record
+get_records = Record.get_many
 get_record_blob = Record.get_blob
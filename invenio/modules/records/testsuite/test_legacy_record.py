@@ -112,6 +112,57 @@ class BibRecordSuccessTest(InvenioTestCase):
         record1 = bibrecord.create_records(xmltext)[0]
         self.assertEqual(record1, record)
 
+    def test_create_records_from_file(self):
+        """ bibrecord - create_records_from_file() streams demo file records"""
+        xmlfile = pkg_resources.resource_stream('invenio.testsuite',
+                os.path.join('data', 'demo_record_marc_data.xml'))
+        recs = [rec[0] for rec in bibrecord.create_records_from_file(xmlfile)]
+        self.assertEqual(self.recs, recs)
+
+class BibRecordCompactRecordTest(InvenioTestCase):
+    """ bibrecord - testing compact records"""
+
+    def setUp(self):
+        """Initialize stuff"""
+        xmltext = pkg_resources.resource_string('invenio.testsuite',
+                os.path.join('data', 'demo_record_marc_data.xml'))
+        self.recs = [rec[0] for rec in bibrecord.create_records(xmltext)]
+        self.compact_recs = [rec[0] for rec in
+                             bibrecord.create_records(xmltext, compact=True)]
+
+    def test_to_dict(self):
+        """ bibrecord - compact record converted back to record"""
+        for rec, compact_rec in zip(self.recs, self.compact_recs):
+            self.assertEqual(rec, compact_rec.to_dict())
+            self.assertEqual(bibrecord.record_xml_output(rec),
+                             bibrecord.record_xml_output(compact_rec))
+
+    def test_get_field_values(self):
+        """ bibrecord - getting field values from compact record"""
+        get_instances = bibrecord.record_get_field_instances
+        get_values = bibrecord.record_get_field_values
+        get_value = bibrecord.record_get_field_value
+        for rec, compact_rec in zip(self.recs, self.compact_recs):
+            for tag in rec.keys() + ['999']:
+                for ind1, ind2 in ((' ', ' '), ('%', '%'), ('C', '5')):
+                    self.assertEqual(
+                        [(list(field[0]), ) + field[1:] for field in
+                         get_instances(compact_rec, tag, ind1, ind2)],
+                        get_instances(rec, tag, ind1, ind2))
+                    for code in ('', '%', 'a'):
+                        self.assertEqual(
+                            get_values(compact_rec, tag, ind1, ind2, code),
+                            get_values(rec, tag, ind1, ind2, code))
+                        self.assertEqual(
+                            get_value(compact_rec, tag, ind1, ind2, code),
+                            get_value(rec, tag, ind1, ind2, code))
+
+    def test_read_only(self):
+        """ bibrecord - compact record cannot be modified"""
+        self.assertRaises(TypeError, bibrecord.record_add_field,
+                          self.compact_recs[0], '999', subfields=[('a', 'x')])
+
+
 class BibRecordParsersTest(InvenioTestCase):
     """ bibrecord - testing the creation of records with different parsers"""
 
@@ -1714,6 +1765,7 @@ class BibRecordExtractIdentifiersTest(InvenioTestCase):
 
 TEST_SUITE = make_test_suite(
     BibRecordSuccessTest,
+    BibRecordCompactRecordTest,
     BibRecordParsersTest,
     BibRecordBadInputTreatmentTest,
     BibRecordGettingFieldValuesTest,
@@ -27,7 +27,7 @@ from flask.ext.registry import PkgResourcesDirDiscoveryRegistry, \
 from invenio.base.wrappers import lazy_import
 from invenio.ext.registry import ModuleAutoDiscoverySubRegistry
 from invenio.testsuite import make_test_suite, run_test_suite, \
-    InvenioTestCase, nottest
+    InvenioTestCase
 
 Record = lazy_import('invenio.modules.records.api:Record')
 Document = lazy_import('invenio.modules.documents.api:Document')
@@ -69,14 +69,19 @@ class TestRecord(InvenioTestCase):
         del self.app.extensions['registry']['testsuite.models']
         del self.app.extensions['registry']['testsuite.functions']
 
-    @nottest
-    def test_records_created(self):
-        """Record - demo file how many records are created."""
+    def test_create_many(self):
+        """Record - create many records in input order."""
         xmltext = pkg_resources.resource_string(
             'invenio.testsuite',
             os.path.join('data', 'demo_record_marc_data.xml'))
-        recs = [record for record in Record.create_many(xmltext, master_format='marc')]
-        self.assertEqual(141, len(recs))
+        recids = [record.get('recid') for record in Record.create_many(
+            xmltext, master_format='marc', namespace='testsuite')]
+        self.assertEqual(142, len(recids))
+        self.assertEqual(
+            recids,
+            [record.get('recid') for record in Record.create_many(
+                [xmltext], master_format='marc', namespace='testsuite',
+                processes=1)])
 
     def test_accented_unicode_letterst_test(self):
         """Record - accented Unicode letters."""
@@ -30,8 +30,17 @@ from .cache import search_results_cache, \
 from .models import Collection
 
 from invenio.base.globals import cfg
+from invenio.legacy.dbquery import run_sql, get_table_update_time
+from invenio.legacy.miscutil.data_cacher import DataCacher
 from intbitset import intbitset
 
+try:
+    ## import optional module:
+    import numpy
+    CFG_NUMPY_IMPORTABLE = True
+except ImportError:
+    CFG_NUMPY_IMPORTABLE = False
+
 
 def get_current_user_records_that_can_be_displayed(qid):
     """Return records that current user can display.
@@ -98,17 +107,126 @@ def faceted_results_filter(recids, filter_data, facets):
     return output
 
 
+class FacetPostings(object):
+
+    """Record to field value mapping of one facet.
+
+    The mapping is kept as two parallel arrays of record ids and value
+    ids, one item per field occurrence, so that value frequencies in
+    any set of records are computed by a single `numpy.bincount`.
+    Value ids follow the order of lowercased values, which breaks ties
+    in frequencies the same way as `get_most_popular_field_values`.
+
+    The record ids are also kept sorted by value id and then by record
+    id, with the offset of the records of every value, so that the
+    records having a given value are a slice of that array.
+    """
+
+    def __init__(self, pairs):
+        """Build postings from an iterable of (recid, value) pairs."""
+        recids = []
+        values = []
+        for recid, value in pairs:
+            recids.append(recid)
+            values.append(value)
+        self.values = sorted(set(values), key=lambda value: value.lower())
+        self.value_ids = dict((value, value_id) for value_id, value
+                              in enumerate(self.values))
+        self.recids = numpy.array(recids, dtype=numpy.int32)
+        self.recid_value_ids = numpy.array(
+            [self.value_ids[value] for value in values], dtype=numpy.int32)
+        self.max_recid = max(recids or [0])
+        order = numpy.lexsort((self.recids, self.recid_value_ids))
+        self.value_recids = self.recids[order]
+        self.value_offsets = numpy.concatenate((
+            [0], numpy.cumsum(numpy.bincount(self.recid_value_ids,
+                                             minlength=len(self.values)))))
+
+    def get_most_popular_values(self, recids, limit=20):
+        """Return list of (value, frequency) for the top values in RECIDS.
+
+        The list is sorted by descending frequency and then by
+        lowercased value, every occurrence of a value is counted.
+        """
+        if not self.values or not recids:
+            return []
+        hits = numpy.array(recids.tolist(), dtype=numpy.int32)
+        mask = numpy.zeros(self.max_recid + 1, dtype=bool)
+        mask[hits[hits <= self.max_recid]] = True
+        counts = numpy.bincount(self.recid_value_ids[mask[self.recids]],
+                                minlength=len(self.values))
+        value_ids = numpy.flatnonzero(counts)
+        if len(value_ids) > limit:
+            # keep values as frequent as the limit-th one (ties included)
+            threshold = numpy.sort(counts[value_ids])[-limit]
+            value_ids = value_ids[counts[value_ids] >= threshold]
+        value_ids = value_ids[numpy.lexsort((value_ids, -counts[value_ids]))]
+        return [(self.values[value_id], int(counts[value_id]))
+                for value_id in value_ids[:limit]]
+
+    def get_value_recids(self, value):
+        """Return intbitset of records having VALUE, None if unknown."""
+        value_id = self.value_ids.get(value)
+        if value_id is None:
+            return None
+        return intbitset(self.value_recids[
+            self.value_offsets[value_id]:self.value_offsets[value_id + 1]
+        ].tolist())
+
+
+class FacetPostingsDataCacher(DataCacher):
+
+    """Provide cache for facet postings of field values.
+
+    This class is not to be used directly; use method
+    `FacetBuilder.get_facet_postings` instead.
+
+    The postings are rebuilt from all the bibXXx rows of the facet, so
+    modifications of these tables are looked for at most every
+    CFG_WEBSEARCH_FACET_POSTINGS_CHECK_INTERVAL seconds, and the
+    postings are shared as a snapshot with the other processes when
+    CFG_DATACACHER_SNAPSHOT_STORE is set.
+    """
+
+    def __init__(self, name, tags):
+        """Initialize cacher of postings of facet NAME on MARC TAGS."""
+        tables = set()
+        for tag in tags:
+            tables.add("bib%sx" % tag[0:2])
+            tables.add("bibrec_bib%sx" % tag[0:2])
+
+        def cache_filler():
+            pairs = []
+            for tag in tags:
+                pairs.extend(run_sql(
+                    "SELECT bibx.id_bibrec, bx.value "
+                    "FROM bib%sx AS bx, bibrec_bib%sx AS bibx "
+                    "WHERE bx.id=bibx.id_bibxxx AND bx.tag LIKE %%s" %
+                    (tag[0:2], tag[0:2]), (tag,)))
+            return FacetPostings(pairs)
+
+        def timestamp_verifier():
+            return max([get_table_update_time(table) for table in tables])
+
+        DataCacher.__init__(
+            self, cache_filler, timestamp_verifier,
+            check_interval=cfg.get('CFG_WEBSEARCH_FACET_POSTINGS_CHECK_INTERVAL'),
+            snapshot_name='facet_postings_%s' % name)
+
+
 class FacetBuilder(object):
 
     """Facet builder helper class.
 
-    Implement a general facet builder using function
-    `get_most_popular_field_values`.
+    Implement a general facet builder using facet postings of field
+    values, or function `get_most_popular_field_values` when NumPy is
+    not available or the field is not stored in bibXXx tables.
     """
 
     def __init__(self, name):
         """Initialize facet builder."""
         self.name = name
+        self._postings_cacher = None
 
     def get_title(self, **kwargs):
         """Return facet title."""
@@ -135,19 +253,66 @@ class FacetBuilder(object):
         """Return record ids as list."""
         return self.get_recids_intbitset(qid).tolist()
 
+    def get_facet_postings(self):
+        """Return up-to-date facet postings, None if not available."""
+        if not CFG_NUMPY_IMPORTABLE:
+            return None
+        if self._postings_cacher is None:
+            from invenio.legacy.search_engine import get_field_tags
+            tags = get_field_tags(self.name)
+            if not tags or [tag for tag in tags
+                            if not tag[0:2].isdigit() or tag == '001___']:
+                return None
+            self._postings_cacher = FacetPostingsDataCacher(self.name, tags)
+        else:
+            self._postings_cacher.recreate_cache_if_needed()
+        return self._postings_cacher.cache
+
     def get_facets_for_query(self, qid, limit=20, parent=None):
-        """Return facet data."""
+        """Return facet data.
+
+        Facet data are cached per query, user and limit for
+        CFG_WEBSEARCH_SEARCH_CACHE_TIMEOUT seconds.
+        """
+        limit = int(limit)
+        key = '%s::facet::%s::%s::%d' % (
+            get_search_results_cache_key_from_qid(qid), self.name,
+            current_user.get_id(), limit)
+        facet = search_results_cache.get(key)
+        if facet is None:
+            facet = self.get_most_popular_values(
+                self.get_recids_intbitset(qid), limit)
+            search_results_cache.set(
+                key, facet, timeout=cfg.get('CFG_WEBSEARCH_SEARCH_CACHE_TIMEOUT'))
+        return facet
+
+    def get_most_popular_values(self, recids, limit=20):
+        """Return list of (value, frequency) of top values in RECIDS."""
+        postings = self.get_facet_postings()
+        if postings is not None:
+            return postings.get_most_popular_values(recids, limit)
         from invenio.legacy.search_engine import get_most_popular_field_values,\
             get_field_tags
-        return get_most_popular_field_values(self.get_recids(qid),
-                                             get_field_tags(self.name)
-                                             )[0:limit]
+        return get_most_popular_field_values(recids,
+                                             get_field_tags(self.name),
+                                             limit=limit)
 
     def get_value_recids(self, value):
-        """Return record ids in intbitset for given field value."""
+        """Return record ids in intbitset for given field value.
+
+        The values proposed by the facet are looked up exactly as they
+        are stored in the facet postings, i.e. case and accent
+        sensitively, which gives the records counted for the value.
+        Other values are searched as a phrase in the field.
+        """
         from invenio.legacy.search_engine import search_pattern
         if isinstance(value, unicode):
             value = value.encode('utf8')
+        postings = self.get_facet_postings()
+        if postings is not None:
+            recids = postings.get_value_recids(str(value))
+            if recids is not None:
+                return recids
         p = '"' + str(value) + '"'
         return search_pattern(p=p, f=self.name)
 
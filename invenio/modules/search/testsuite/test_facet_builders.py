@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the facet builders."""
+
+from intbitset import intbitset
+
+from invenio.base.wrappers import lazy_import
+from invenio.testsuite import make_test_suite, run_test_suite, InvenioTestCase
+
+facet_builders = lazy_import('invenio.modules.search.facet_builders')
+
+
+class TestFacetPostings(InvenioTestCase):
+    """Test of facet value counting."""
+
+    def setUp(self):
+        """Initialise postings of a small author facet."""
+        self.postings = facet_builders.FacetPostings([
+            (1, 'Ellis, J'), (2, 'Ellis, J'), (3, 'Ellis, J'),
+            (1, 'Higgs, P'), (2, 'Higgs, P'), (2, 'Higgs, P'),
+            (3, 'Englert, F'), (4, 'Englert, F'),
+            (4, 'Brout, R'), (5, 'Brout, R')])
+
+    def test_most_popular_values(self):
+        """facet builders - values sorted by frequency and by name"""
+        self.assertEqual(
+            self.postings.get_most_popular_values(intbitset([1, 2, 3, 4, 5])),
+            [('Ellis, J', 3), ('Higgs, P', 3), ('Brout, R', 2),
+             ('Englert, F', 2)])
+
+    def test_most_popular_values_in_hitset(self):
+        """facet builders - only values of the hitset are counted"""
+        self.assertEqual(
+            self.postings.get_most_popular_values(intbitset([2, 4, 6]), 2),
+            [('Higgs, P', 2), ('Brout, R', 1)])
+
+    def test_value_recids(self):
+        """facet builders - records having a given value"""
+        self.assertEqual(self.postings.get_value_recids('Englert, F'),
+                         intbitset([3, 4]))
+        self.assertEqual(self.postings.get_value_recids('Guralnik, G'), None)
+        self.assertEqual(self.postings.get_value_recids('Higgs, P'),
+                         intbitset([1, 2]))
+        self.assertEqual(self.postings.get_value_recids('higgs, p'), None)
+
+    def test_empty_postings(self):
+        """facet builders - postings of a facet without values"""
+        postings = facet_builders.FacetPostings([])
+        self.assertEqual(postings.get_most_popular_values(intbitset([1])), [])
+        self.assertEqual(postings.get_value_recids('Ellis, J'), None)
+
+
+class TestFacetBuilder(InvenioTestCase):
+    """Test of facet filtering."""
+
+    def test_value_recids_of_proposed_values(self):
+        """facet builders - proposed values give the phrase search records"""
+        from invenio.legacy.search_engine import search_pattern
+        facet = facet_builders.FacetBuilder('year')
+        if facet.get_facet_postings() is None:
+            return
+        values = facet.get_most_popular_values(intbitset(range(1, 105)))
+        self.assertTrue(values)
+        for value, dummy_frequency in values:
+            self.assertEqual(facet.get_value_recids(value),
+                             search_pattern(p='"%s"' % value, f='year'))
+
+    def test_value_recids_are_exact(self):
+        """facet builders - proposed values are looked up exactly"""
+        postings = facet_builders.FacetPostings([
+            (1, 'Ellis, J'), (2, 'ELLIS, J'), (3, 'Ellis, J')])
+        facet = facet_builders.FacetBuilder('author')
+        facet.get_facet_postings = lambda: postings
+        self.assertEqual(facet.get_value_recids(u'Ellis, J'),
+                         intbitset([1, 3]))
+        self.assertEqual(facet.get_facet_recids(['Ellis, J', 'ELLIS, J']),
+                         intbitset([1, 2, 3]))
+
+
+TEST_SUITE = make_test_suite(TestFacetPostings, TestFacetBuilder)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
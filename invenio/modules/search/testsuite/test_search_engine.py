@@ -281,10 +281,133 @@ class TestSearchUnitFunction(InvenioTestCase):
             search_engine.search_unit('BOOK', 'collection'))
 
 
+class TestMostPopularFieldValues(InvenioTestCase):
+    """Test for counting of the most popular field values."""
+
+    def test_batches_do_not_change_frequencies(self):
+        """search engine - most popular values do not depend on batch size"""
+        recids = range(1, 105)
+        tags = ('100__a', '700__a')
+        for count_repetitive_values in (True, False):
+            self.assertEqual(
+                search_engine.get_most_popular_field_values(
+                    recids, tags,
+                    count_repetitive_values=count_repetitive_values),
+                search_engine.get_most_popular_field_values(
+                    recids, tags,
+                    count_repetitive_values=count_repetitive_values,
+                    split_by=7))
+
+    def test_limit(self):
+        """search engine - limited list of most popular values"""
+        recids = range(1, 105)
+        self.assertEqual(
+            search_engine.get_most_popular_field_values(recids, '980__a',
+                                                        limit=3),
+            search_engine.get_most_popular_field_values(recids, '980__a')[:3])
+
+
+class TestBatchedBibwordsSearch(InvenioTestCase):
+    """Test for batched term lookup of exact word search units."""
+
+    def test_batched_units_equal_single_units(self):
+        """search engine - batched word lookup gives same hitsets as search_unit"""
+        units = [('ellis', ''), ('higgs', ''), ('ellis', ''),
+                 ('boson', 'title'), ('quark', 'title'),
+                 ('nonexistingword', 'title')]
+        terms = [search_engine.get_bibwords_exact_term(p, f, 'w')
+                 for p, f in units]
+        hitsets, stats = search_engine.search_units_in_bibwords(terms)
+        self.assertEqual(len(stats), 2)
+        for (p, f), term in zip(units, terms):
+            self.assertEqual(hitsets[term], search_engine.search_unit(p, f, 'w'))
+
+    def test_collation_equal_terms_in_one_batch(self):
+        """search engine - case variants of a term in one batch share hits"""
+        search_engine.hitlist_cache.invalidate()
+        bibwordsX = search_engine.get_bibwords_exact_term('ellis', '', 'w')[0]
+        terms = [(bibwordsX, 'Ellis'), (bibwordsX, 'ellis'),
+                 (bibwordsX, 'higgs')]
+        hitsets, stats = search_engine.search_units_in_bibwords(terms)
+        self.assertEqual(len(stats), 1)
+        expected = search_engine.search_unit('ellis', '', 'w')
+        self.assertTrue(expected)
+        self.assertEqual(hitsets[(bibwordsX, 'Ellis')], expected)
+        self.assertEqual(hitsets[(bibwordsX, 'ellis')], expected)
+
+    def test_non_exact_units_are_not_batched(self):
+        """search engine - wildcard, span and phrase units are not batched"""
+        self.assertEqual(search_engine.get_bibwords_exact_term('ell*', '', 'w'), None)
+        self.assertEqual(search_engine.get_bibwords_exact_term('1->5', 'year', 'w'), None)
+        self.assertEqual(search_engine.get_bibwords_exact_term('ellis', 'author', 'a'), None)
+        self.assertEqual(search_engine.get_bibwords_exact_term('1', 'refersto', 'w'), None)
+
+    def test_search_pattern_results_unchanged(self):
+        """search engine - multi-word query gives intersection of its units"""
+        expected = search_engine.search_unit('higgs', '', 'w') & \
+                   search_engine.search_unit('boson', '', 'w') & \
+                   search_engine.search_unit('higgs', 'title', 'w')
+        self.assertEqual(search_engine.search_pattern(p='higgs boson title:higgs'),
+                         expected)
+
+
+class TestSortRecordsPagination(InvenioTestCase):
+    """Test for sorting of one page of records only."""
+
+    def _sort_by_bibsort_weights(self, recids, sort_method, sort_order):
+        """Sort RECIDS with sorted() on the BibSort weights, placing the
+        records without weight as sort_records_bibsort() does."""
+        sort_cache = search_engine.CACHE_SORTED_DATA[sort_method]
+        sort_cache.recreate_cache_if_needed()
+        weights = sort_cache.cache['data_dict_ordered']
+        missing = [recid for recid in sorted(recids) if recid not in weights]
+        weighted = sorted([recid for recid in recids if recid in weights],
+                          key=weights.__getitem__, reverse=sort_order == 'd')
+        if sort_method == 'latest first' and sort_order == 'd':
+            return weighted + missing[::-1]
+        return missing + weighted
+
+    def test_bibsort_page_equals_slice_of_full_sort(self):
+        """search engine - bibsort page equals the page of all sorted records"""
+        # demo records loaded in the same second have equal creation
+        # dates, which BibSort weights break
+        recids = range(1, 105)
+        for sort_order in ('a', 'd'):
+            all_sorted = self._sort_by_bibsort_weights(recids, 'latest first',
+                                                       sort_order)
+            self.assertEqual(len(all_sorted), len(recids))
+            self.assertEqual(
+                search_engine.sort_records_bibsort(
+                    None, recids, 'latest first', sort_order=sort_order),
+                all_sorted)
+            for jrec in (1, 11, 95, 104):
+                self.assertEqual(
+                    search_engine.sort_records_bibsort(
+                        None, recids, 'latest first', sort_order=sort_order,
+                        rg=10, jrec=jrec),
+                    all_sorted[jrec-1:jrec-1+10])
+
+    def test_bibxxx_page_equals_slice_of_full_sort(self):
+        """search engine - bibxxx page equals the page of all sorted records"""
+        recids = range(1, 105)
+        for sort_order in ('a', 'd'):
+            all_sorted = search_engine.sort_records_bibxxx(
+                None, recids, None, 'title', sort_order)
+            for jrec in (1, 11, 95, 104):
+                self.assertEqual(
+                    search_engine.sort_records_bibxxx(
+                        None, recids, None, 'title', sort_order,
+                        rg=10, jrec=jrec),
+                    all_sorted[jrec-1:jrec-1+10])
+
+
 TEST_SUITE = make_test_suite(TestWashQueryParameters,
                              TestQueryParser,
                              TestMiscUtilityFunctions,
-                             TestSearchUnitFunction)
+                             TestSearchUnitFunction,
+                             TestBatchedBibwordsSearch,
+                             TestMostPopularFieldValues,
+                             TestSortRecordsPagination)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the search engine hitlist cache."""
+
+from intbitset import intbitset
+
+from invenio.base.wrappers import lazy_import
+from invenio.testsuite import make_test_suite, run_test_suite, InvenioTestCase
+
+hitlist_cache = lazy_import('invenio.legacy.search_engine.hitlist_cache')
+
+
+class TestHitlistCache(InvenioTestCase):
+    """Test of the LRU hitlist cache."""
+
+    def setUp(self):
+        """Initialise a cache holding hitlists of two 800-bit sets."""
+        self.entry_size = hitlist_cache.get_hitset_size(intbitset([1, 800]))
+        self.cache = hitlist_cache.HitlistCache(max_size=2 * self.entry_size,
+                                                check_interval=3600)
+
+    def test_get_and_set(self):
+        """hitlist cache - hits and misses are counted"""
+        self.assertEqual(self.cache.get('idxWORD01F', 'ellis'), None)
+        self.cache.set('idxWORD01F', 'ellis', intbitset([1, 800]))
+        self.assertEqual(self.cache.get('idxWORD01F', 'ellis'),
+                         intbitset([1, 800]))
+        stats = self.cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']),
+                         (1, 1, 1))
+
+    def test_hitsets_are_copied(self):
+        """hitlist cache - modifying returned hitsets does not alter the cache"""
+        self.cache.get('idxWORD01F', 'ellis')
+        hitset = intbitset([1, 800])
+        self.cache.set('idxWORD01F', 'ellis', hitset)
+        hitset.add(2)
+        self.cache.get('idxWORD01F', 'ellis').add(3)
+        self.assertEqual(self.cache.get('idxWORD01F', 'ellis'),
+                         intbitset([1, 800]))
+
+    def test_least_recently_used_is_evicted(self):
+        """hitlist cache - least recently used hitlist is evicted first"""
+        for term in ('ellis', 'higgs'):
+            self.cache.get('idxWORD01F', term)
+            self.cache.set('idxWORD01F', term, intbitset([1, 800]))
+        self.cache.get('idxWORD01F', 'ellis')
+        self.cache.set('idxWORD01F', 'boson', intbitset([1, 800]))
+        self.assertEqual(self.cache.get('idxWORD01F', 'higgs'), None)
+        self.assertNotEqual(self.cache.get('idxWORD01F', 'ellis'), None)
+        self.assertEqual(self.cache.get_stats()['evictions'], 1)
+        self.assertEqual(self.cache.get_stats()['size'], 2 * self.entry_size)
+
+    def test_invalidate_table(self):
+        """hitlist cache - invalidation drops hitlists of the flushed table only"""
+        for table in ('idxWORD01F', 'idxWORD02F'):
+            self.cache.get(table, 'ellis')
+            self.cache.set(table, 'ellis', intbitset([1, 800]))
+        self.cache.invalidate('idxWORD01F')
+        self.assertEqual(self.cache.get('idxWORD01F', 'ellis'), None)
+        self.assertEqual(self.cache.get('idxWORD02F', 'ellis'),
+                         intbitset([1, 800]))
+
+
+TEST_SUITE = make_test_suite(TestHitlistCache)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the vectorized comparison of bibauthorid signatures."""
+
+from invenio.testsuite import make_test_suite, run_test_suite, InvenioTestCase
+
+
+class BibAuthorIDCompareSignaturesTest(InvenioTestCase):
+    """Test compare_signatures against compare_bibrefrecs."""
+
+    def setUp(self):
+        from invenio.legacy.bibauthorid import comparison
+        self.comparison = comparison
+        self.cbrr_func_weight = comparison.cbrr_func_weight
+
+    def tearDown(self):
+        self.comparison.cbrr_func_weight = self.cbrr_func_weight
+
+    def _assert_same_results(self):
+        """Check compare_signatures on a synthetic surname block."""
+        stats = self.comparison.compare_signatures_benchmark(100)
+        self.assertEqual(stats['different signs'], 0)
+        self.assertTrue(stats['largest difference'] < 1e-9)
+
+    def test_synthetic_surname_block(self):
+        """bibauthorid - compare_signatures matches compare_bibrefrecs"""
+        self._assert_same_results()
+
+    def test_inspire_comparisons(self):
+        """bibauthorid - compare_signatures with the INSPIRE comparisons"""
+        c = self.comparison
+        c.cbrr_func_weight = ((c._compare_inspireid, .5, 'inspID'),
+                              (c._compare_affiliations, .3, 'aff'),
+                              (c._compare_names, 1., 'names'),
+                              (c._compare_collaboration, .3, 'collab'))
+        self._assert_same_results()
+
+    def test_ads_comparisons(self):
+        """bibauthorid - compare_signatures with the ADS comparisons"""
+        c = self.comparison
+        c.cbrr_func_weight = ((c._compare_email, 3., 'email'),
+                              (c._compare_unified_affiliations, 2., 'aff'),
+                              (c._compare_names, 5., 'names'),
+                              (c._compare_key_words, 2., 'kw'))
+        self._assert_same_results()
+
+
+class BibAuthorIDCompareClusterSetTest(InvenioTestCase):
+    """Test compare_cluster_set against the comparison of every pair."""
+
+    def setUp(self):
+        from invenio.legacy.bibauthorid import comparison
+        self.comparison = comparison
+        self.bibs, getters = comparison._create_surname_block(60)
+        self.getters = dict((name, getattr(comparison, name))
+                            for name in getters)
+        for name, getter in getters.iteritems():
+            setattr(comparison, name, getter)
+        comparison.clear_all_caches()
+
+    def tearDown(self):
+        for name, getter in self.getters.iteritems():
+            setattr(self.comparison, name, getter)
+        self.comparison.clear_all_caches()
+
+    def test_compared_pairs(self):
+        """bibauthorid - compare_cluster_set compares non hating clusters"""
+        from invenio.legacy.bibauthorid.cluster_set import ClusterSet
+        from invenio.legacy.bibauthorid.prob_matrix import compare_cluster_set
+        cluster_set = ClusterSet()
+        sizes = [1, 12, 3, 7, 1, 9, 2, 15, 10]
+        start = 0
+        for size in sizes:
+            cluster_set.clusters.append(
+                ClusterSet.Cluster(self.bibs[start:start + size]))
+            start += size
+        clusters = cluster_set.clusters
+        clusters[0].quarrel(clusters[3])
+        clusters[1].quarrel(clusters[2])
+        clusters[1].quarrel(clusters[8])
+        clusters[5].quarrel(clusters[6])
+
+        expected = []
+        for cl1 in clusters:
+            for cl2 in clusters:
+                if id(cl1) < id(cl2) and not cl1.hates(cl2):
+                    for bib1 in cl1.bibs:
+                        for bib2 in cl2.bibs:
+                            expected.append((bib1, bib2))
+
+        compared = []
+        for bibs1, bibs2, same_paper, probabilities, compatibilities \
+                in compare_cluster_set(cluster_set, processes=1, block_size=7):
+            for i, bib1 in enumerate(bibs1):
+                for j, bib2 in enumerate(bibs2):
+                    compared.append((bib1, bib2))
+                    val = self.comparison.compare_bibrefrecs(bib1, bib2)
+                    self.assertEqual(val == '-', same_paper[i, j])
+                    if val != '-':
+                        self.assertAlmostEqual(val[0], probabilities[i, j])
+                        self.assertAlmostEqual(val[1], compatibilities[i, j])
+        self.assertEqual(sorted(compared), sorted(expected))
+
+
+TEST_SUITE = make_test_suite(BibAuthorIDCompareSignaturesTest,
+                             BibAuthorIDCompareClusterSetTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the BibUpload lanes of BibSched."""
+
+import os
+import shutil
+import tempfile
+
+from invenio.testsuite import make_test_suite, run_test_suite, InvenioTestCase
+
+RECORD_XML = """<record>
+  <controlfield tag="001">%(recid)s</controlfield>
+  <datafield tag="024" ind1="7" ind2=" ">
+    <subfield code="2">DOI</subfield>
+    <subfield code="a">%(doi)s</subfield>
+  </datafield>
+</record>"""
+
+NEW_RECORD_XML = """<record>
+  <datafield tag="245" ind1=" " ind2=" ">
+    <subfield code="a">A new record</subfield>
+  </datafield>
+</record>"""
+
+
+class BibUploadFootprintTest(InvenioTestCase):
+    """Test the footprint of the bibupload tasks."""
+
+    def setUp(self):
+        from invenio.legacy.bibupload import footprint
+        self.footprint = footprint
+        self.footprint_dir = footprint.CFG_BIBUPLOAD_FOOTPRINT_DIR
+        self.tmpdir = tempfile.mkdtemp()
+        footprint.CFG_BIBUPLOAD_FOOTPRINT_DIR = os.path.join(self.tmpdir,
+                                                             'footprints')
+
+    def tearDown(self):
+        self.footprint.CFG_BIBUPLOAD_FOOTPRINT_DIR = self.footprint_dir
+        shutil.rmtree(self.tmpdir)
+
+    def test_mode_and_file(self):
+        """bibupload - mode and input file of a task command line"""
+        get_mode_and_file = self.footprint.get_bibupload_mode_and_file
+        self.assertEqual(
+            get_mode_and_file(['bibupload', '-r', '-i', '/tmp/a.xml']),
+            ('replace_or_insert', '/tmp/a.xml'))
+        self.assertEqual(
+            get_mode_and_file(['bibupload', '-P', '5', '--append', 'a.xml']),
+            ('append', 'a.xml'))
+        self.assertEqual(get_mode_and_file(['bibupload', '-z', '-u', 'admin',
+                                            'a.xml']),
+                         ('correct', 'a.xml'))
+        self.assertEqual(get_mode_and_file(['bibupload', 'a.xml']),
+                         (None, 'a.xml'))
+
+    def test_record_footprint(self):
+        """bibupload - footprint of a record"""
+        from invenio.legacy.bibrecord import create_record
+        record = create_record(RECORD_XML % {'recid': 12,
+                                             'doi': '10.1234/ABC'})[0]
+        self.assertEqual(self.footprint.get_record_footprint(record, 'insert'),
+                         set(['recid:12', 'doi:10.1234/abc']))
+        record = create_record(NEW_RECORD_XML)[0]
+        self.assertEqual(self.footprint.get_record_footprint(record, 'insert'),
+                         set())
+
+    def test_argv_footprint(self):
+        """bibupload - footprint of the input file of a task"""
+        path = os.path.join(self.tmpdir, 'input.xml')
+        marcxml_file = open(path, 'w')
+        marcxml_file.write('<collection>%s%s%s</collection>' % (
+            RECORD_XML % {'recid': 1, 'doi': '10.1234/a'},
+            NEW_RECORD_XML,
+            RECORD_XML % {'recid': 2, 'doi': '10.1234/b'}))
+        marcxml_file.close()
+        self.assertEqual(
+            self.footprint.get_argv_footprint(['bibupload', '-i', path]),
+            frozenset(['recid:1', 'doi:10.1234/a',
+                       'recid:2', 'doi:10.1234/b']))
+        self.assertEqual(self.footprint.get_argv_footprint(
+            ['bibupload', '-i', path + '.missing']), None)
+        self.assertEqual(self.footprint.get_argv_footprint(
+            ['bibupload', path]), None)
+
+    def test_big_file_footprint(self):
+        """bibupload - input files too big to be read have no footprint"""
+        path = os.path.join(self.tmpdir, 'input.xml')
+        marcxml_file = open(path, 'w')
+        marcxml_file.write(RECORD_XML % {'recid': 1, 'doi': '10.1234/a'})
+        marcxml_file.close()
+        max_file_size = self.footprint.CFG_BIBSCHED_BIBUPLOAD_LANES_MAX_FILE_SIZE
+        self.footprint.CFG_BIBSCHED_BIBUPLOAD_LANES_MAX_FILE_SIZE = 10
+        try:
+            self.assertEqual(
+                self.footprint.get_argv_footprint(['bibupload', '-i', path]),
+                None)
+        finally:
+            self.footprint.CFG_BIBSCHED_BIBUPLOAD_LANES_MAX_FILE_SIZE = \
+                max_file_size
+
+    def test_store_task_footprint(self):
+        """bibupload - footprint stored at submission time"""
+        self.assertEqual(self.footprint.get_task_footprint(7), None)
+        self.footprint.store_task_footprint(7, frozenset(['recid:1',
+                                                          'doi:10.1/a']))
+        self.assertEqual(self.footprint.get_task_footprint(7),
+                         frozenset(['recid:1', 'doi:10.1/a']))
+        self.footprint.store_task_footprint(8, None)
+        self.assertEqual(self.footprint.get_task_footprint(8), None)
+        self.footprint.remove_task_footprint(7)
+        self.assertEqual(self.footprint.get_task_footprint(7), None)
+
+
+class BibSchedBibUploadLanesTest(InvenioTestCase):
+    """Test the scheduling of bibuploads on parallel lanes."""
+
+    def setUp(self):
+        from invenio.legacy.bibsched import cli
+        from invenio.legacy.bibupload import footprint
+        self.cli = cli
+        self.footprint = footprint
+        self.run_sql = cli.run_sql
+        self.get_task_pid = cli.get_task_pid
+        self.lanes = cli.CFG_BIBSCHED_BIBUPLOAD_LANES
+        self.footprint_dir = footprint.CFG_BIBUPLOAD_FOOTPRINT_DIR
+        self.tmpdir = tempfile.mkdtemp()
+        footprint.CFG_BIBUPLOAD_FOOTPRINT_DIR = self.tmpdir
+        cli.CFG_BIBSCHED_BIBUPLOAD_LANES = 3
+        self.bibsched = cli.BibSched()
+        self.queue = []
+        cli.run_sql = lambda *args, **kwargs: self.queue
+
+    def tearDown(self):
+        self.cli.run_sql = self.run_sql
+        self.cli.get_task_pid = self.get_task_pid
+        self.cli.CFG_BIBSCHED_BIBUPLOAD_LANES = self.lanes
+        self.footprint.CFG_BIBUPLOAD_FOOTPRINT_DIR = self.footprint_dir
+        shutil.rmtree(self.tmpdir)
+
+    def _submit(self, task_id, status, keys=None):
+        """Add a bibupload to the queue, as sorted by the scheduler."""
+        self.queue.append((task_id, 'bibupload', None, status, 0, '', None))
+        if keys is not None:
+            self.footprint.store_task_footprint(task_id, frozenset(keys))
+
+    def _runnable(self):
+        return [task.id for task in self.bibsched.calculate_bibupload_lanes()]
+
+    def test_disjoint_tasks_run(self):
+        """bibsched - bibuploads of different records use free lanes"""
+        self._submit(1, 'RUNNING', ['recid:1'])
+        self._submit(2, 'WAITING', ['recid:1'])
+        self._submit(3, 'WAITING', ['recid:2'])
+        self._submit(4, 'WAITING', ['recid:3'])
+        self._submit(5, 'WAITING', ['recid:4'])
+        self.assertEqual(self._runnable(), [3, 4])
+
+    def test_previous_tasks_come_first(self):
+        """bibsched - bibuploads wait for the previous ones on same records"""
+        self._submit(2, 'WAITING', ['recid:1', 'doi:10.1/a'])
+        self._submit(3, 'WAITING', ['doi:10.1/a'])
+        self._submit(4, 'WAITING', [])
+        self.assertEqual(self._runnable(), [2, 4])
+
+    def test_unknown_footprint(self):
+        """bibsched - bibuploads with unknown footprint run alone"""
+        self._submit(1, 'RUNNING')
+        self._submit(2, 'WAITING', ['recid:2'])
+        self.assertEqual(self._runnable(), [])
+        self.queue = []
+        self._submit(3, 'WAITING')
+        self._submit(4, 'WAITING', ['recid:4'])
+        self.assertEqual(self._runnable(), [3])
+        self.queue = []
+        self._submit(4, 'WAITING', ['recid:4'])
+        self._submit(5, 'WAITING')
+        self.assertEqual(self._runnable(), [4])
+
+    def test_footprints_are_forgotten(self):
+        """bibsched - footprints of finished bibuploads are forgotten"""
+        self._submit(1, 'RUNNING', ['recid:1'])
+        self.assertEqual(self._runnable(), [])
+        self.assertTrue(1 in self.bibsched.bibupload_footprints)
+        self.queue = []
+        self.assertEqual(self._runnable(), [])
+        self.assertFalse(1 in self.bibsched.bibupload_footprints)
+
+    def test_footprints_of_crashed_tasks_are_removed(self):
+        """bibsched - footprints of crashed bibuploads are removed"""
+        Task = self.cli.Task
+        self.footprint.store_task_footprint(1, frozenset(['recid:1']))
+        self.footprint.store_task_footprint(2, frozenset(['recid:2']))
+        self.bibsched.node_active_tasks = [
+            Task(1, 'bibupload', None, 'RUNNING', 0, '', None),
+            Task(2, 'bibupload', None, 'RUNNING', 0, '', None)]
+        self.cli.get_task_pid = lambda task_id: task_id == 2 and 1234 or None
+        self.bibsched.check_for_crashed_tasks()
+        self.assertEqual(self.footprint.get_task_footprint(1), None)
+        self.assertEqual(self.footprint.get_task_footprint(2),
+                         frozenset(['recid:2']))
+
+    def test_used_resources(self):
+        """bibsched - running bibuploads use one resource together"""
+        Task = self.cli.Task
+        self.bibsched.node_active_tasks = [
+            Task(1, 'bibupload', None, 'RUNNING', 0, '', None),
+            Task(2, 'bibupload', None, 'RUNNING', 0, '', None),
+            Task(3, 'bibindex', None, 'RUNNING', 0, '', None)]
+        bibupload = Task(4, 'bibupload', None, 'WAITING', 0, '', None)
+        bibindex = Task(5, 'bibindex', None, 'WAITING', 0, '', None)
+        self.assertEqual(self.bibsched.count_used_resources(bibupload), 1)
+        self.assertEqual(self.bibsched.count_used_resources(bibindex), 2)
+        self.bibsched.node_active_tasks = self.bibsched.node_active_tasks[2:]
+        self.assertEqual(self.bibsched.count_used_resources(bibupload), 1)
+        self.assertEqual(self.bibsched.count_used_resources(bibindex), 1)
+        self.cli.CFG_BIBSCHED_BIBUPLOAD_LANES = 1
+        self.bibsched.node_active_tasks = [
+            Task(1, 'bibupload', None, 'RUNNING', 0, '', None),
+            Task(3, 'bibindex', None, 'RUNNING', 0, '', None)]
+        self.assertEqual(self.bibsched.count_used_resources(bibindex), 2)
+
+
+TEST_SUITE = make_test_suite(BibUploadFootprintTest,
+                             BibSchedBibUploadLanesTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
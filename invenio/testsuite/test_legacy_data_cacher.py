@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+##
+## This file is part of Invenio.
+## Copyright (C) 2014 CERN.
+##
+## Invenio is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 2 of the
+## License, or (at your option) any later version.
+##
+## Invenio is distributed in the hope that it will be useful, but
+## WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+## General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Invenio; if not, write to the Free Software Foundation, Inc.,
+## 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the data cacher snapshots."""
+
+import shutil
+import tempfile
+
+from intbitset import intbitset
+
+from invenio.base.wrappers import lazy_import
+from invenio.testsuite import make_test_suite, run_test_suite, InvenioTestCase
+
+data_cacher = lazy_import('invenio.legacy.miscutil.data_cacher')
+
+
+class FakeRedis(object):
+    """In-memory Redis client supporting what the snapshot store uses."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class DataCacherSnapshotTest(InvenioTestCase):
+    """Test the sharing of data cachers through snapshots."""
+
+    def setUp(self):
+        """Use a file snapshot store in a temporary directory."""
+        self.cache_dir = tempfile.mkdtemp()
+        self.store = data_cacher.FileSnapshotStore(self.cache_dir)
+        self.get_snapshot_store = data_cacher.get_snapshot_store
+        data_cacher.get_snapshot_store = lambda: self.store
+        self.update_time = '2014-01-01 00:00:00'
+        self.fills = 0
+
+    def tearDown(self):
+        """Restore the configured snapshot store."""
+        data_cacher.get_snapshot_store = self.get_snapshot_store
+        shutil.rmtree(self.cache_dir)
+
+    def make_cacher(self):
+        """Return a data cacher sharing its snapshot 'test'."""
+        def cache_filler():
+            self.fills += 1
+            return {'reclist': intbitset([1, 2, 3])}
+
+        def timestamp_verifier():
+            return self.update_time
+
+        return data_cacher.DataCacher(cache_filler, timestamp_verifier,
+                                      check_interval=0, snapshot_name='test')
+
+    def test_snapshot_is_shared(self):
+        """data cacher - up to date snapshot is loaded instead of filled"""
+        cacher1 = self.make_cacher()
+        cacher2 = self.make_cacher()
+        self.assertEqual(self.fills, 1)
+        self.assertEqual(cacher2.cache, {'reclist': intbitset([1, 2, 3])})
+        self.assertEqual(cacher2.timestamp, cacher1.timestamp)
+
+    def test_outdated_snapshot_is_rebuilt(self):
+        """data cacher - outdated snapshot is rebuilt once and shared"""
+        cacher1 = self.make_cacher()
+        cacher2 = self.make_cacher()
+        self.update_time = '9000-01-01 00:00:00'
+        cacher1.recreate_cache_if_needed()
+        self.assertEqual(self.fills, 2)
+        self.store.dump('test', ('9999-12-31 23:59:59', {}))
+        cacher2.recreate_cache_if_needed()
+        self.assertEqual(self.fills, 2)
+        self.assertEqual(cacher2.cache, {})
+
+    def test_check_interval(self):
+        """data cacher - timestamp is verified at most every check_interval"""
+        cacher = self.make_cacher()
+        cacher.check_interval = 3600
+        self.update_time = '9999-12-31 23:59:59'
+        cacher.recreate_cache_if_needed()
+        self.assertEqual(self.fills, 1)
+
+
+class RedisSnapshotStoreTest(InvenioTestCase):
+    """Test the Redis snapshot store."""
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.store = data_cacher.RedisSnapshotStore(self.redis)
+        self.store.lock_timeout = 0.2
+
+    def test_dump_and_load(self):
+        """data cacher - snapshots stored in Redis"""
+        self.assertEqual(self.store.load('test'), None)
+        self.store.dump('test', ('2014-01-01 00:00:00', intbitset([1, 2])))
+        self.assertEqual(self.store.load('test'),
+                         ('2014-01-01 00:00:00', intbitset([1, 2])))
+
+    def test_lock(self):
+        """data cacher - Redis lock is released by its owner only"""
+        key = self.store.lock_key % 'test'
+        with self.store.lock('test'):
+            owner = self.redis.get(key)
+            self.assertTrue(owner)
+            # another process waits for the lock until it expires
+            with self.store.lock('test'):
+                self.assertEqual(self.redis.get(key), owner)
+            self.assertEqual(self.redis.get(key), owner)
+        self.assertEqual(self.redis.get(key), None)
+
+    def test_no_redis_host(self):
+        """data cacher - Redis snapshots need a Redis host"""
+        store = data_cacher.CFG_DATACACHER_SNAPSHOT_STORE
+        get_redis = data_cacher.get_redis
+        data_cacher.CFG_DATACACHER_SNAPSHOT_STORE = 'redis'
+        data_cacher.get_redis = lambda: data_cacher.DummyRedisClient()
+        data_cacher._SNAPSHOT_STORE[:] = []
+        try:
+            self.assertTrue(isinstance(data_cacher.get_snapshot_store(),
+                                       data_cacher.FileSnapshotStore))
+        finally:
+            data_cacher.CFG_DATACACHER_SNAPSHOT_STORE = store
+            data_cacher.get_redis = get_redis
+            data_cacher._SNAPSHOT_STORE[:] = []
+
+
+TEST_SUITE = make_test_suite(DataCacherSnapshotTest,
+                             RedisSnapshotStoreTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)